@@ -0,0 +1,117 @@
+# Compare the record context lookup of util/record_context.py against the
+# per-character view.substr walk it replaced, on one large generated buffer.
+#
+#   python bench/bench_record_context.py [--lines N] [--repeat N]
+import os, sys, re, time, argparse
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.join(os.path.dirname(BENCH_DIR), 'stubs'), os.path.dirname(BENCH_DIR)]
+
+import sublime
+from util.record_context import RecordContext
+
+def legacy_looking_for_ther_nearest_record(view, pos):
+    stack = []
+    if pos - 2 > 0 and view.substr(pos - 1) == '.':
+        record = []
+        pos -= 1
+        while pos > 0:
+            pos -= 1
+            char = view.substr(pos)
+            if char == '#' and record != []:
+                record.reverse()
+                return record, False
+            if char == ' ':
+                return [], False
+            record.append(char)
+    else:
+        in_str = False
+        found_first_spec_word = False
+        pos -= 1
+        while pos > 0:
+            char = view.substr(pos)
+            match_spec = re.compile(r'\w').match(char)
+            if match_spec is None and found_first_spec_word == False :
+                found_first_spec_word = True
+                if char == '=':
+                    return [], False
+            if char == '"':
+                if len(stack) == 0 or stack[len(stack) - 1] != char:
+                    in_str = True
+                    stack.append(char)
+                elif stack[len(stack) - 1] == char:
+                    in_str = False
+                    stack.pop()
+            if char == '}' and in_str == False:
+                stack.append(char)
+            if char == '{' and in_str == False:
+                if len(stack) == 0:
+                    record = []
+                    while pos > 0:
+                        pos -= 1
+                        char = view.substr(pos)
+                        if char == '#' and record != []:
+                            record.reverse()
+                            return record, True
+                        if char == ' ':
+                            break
+                        record.append(char)
+                elif stack[len(stack) - 1] == '}':
+                    stack.pop()
+                else:
+                    return [], False
+            pos -= 1
+        return [], False
+
+def make_buffer(lines):
+    body = ['-module(big).', '-record(state, {id = 0, name = <<"n">>, items = []}).']
+    f = 0
+    while len(body) < lines:
+        body.append('fun_{}(#state{{id = Id}} = State, {{Key, Value}}) when Id > 0 ->'.format(f))
+        body.append('    case lists:keyfind(Key, 1, State#state.items) of')
+        body.append('        false -> {error, "not found: %s"};')
+        body.append('        {_, Old} -> {ok, Old + Value}')
+        body.append('    end.')
+        body.append('')
+        f += 1
+    return '\n'.join(body) + '\n'
+
+CASES = [
+    ('record field', 'update(State) ->\n    State#state{id = 1,\n                na'),
+    ('plain code', 'update(State) ->\n    lists:map(fun(X) -> X end, [a, b]),\n    foo(Ba'),
+    ('record access', 'update(State) ->\n    State#state.')
+]
+
+def measure(name, fun, view, pos, repeat, typing):
+    best = None
+    for i in range(repeat):
+        start_time = time.perf_counter()
+        for n in range(20):
+            if typing:
+                view.count += 1
+            result = fun(view, pos)
+        use_time = (time.perf_counter() - start_time) / 20
+        best = use_time if best is None else min(best, use_time)
+    print('  {:<22} {:>10.3f} ms  {}'.format(name, best * 1000, result))
+    return best
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--lines', type = int, default = 10000)
+    parser.add_argument('--repeat', type = int, default = 5)
+    args = parser.parse_args()
+
+    text = make_buffer(args.lines)
+    for (case, tail) in CASES:
+        view = sublime.View(text + tail)
+        pos = len(view.text)
+        print('{} ({} chars before the cursor)'.format(case, pos))
+        context = RecordContext()
+        legacy = measure('legacy', legacy_looking_for_ther_nearest_record, view, pos, args.repeat, True)
+        measure('chunked, cold', lambda view, pos: RecordContext().find(view, pos), view, pos, args.repeat, True)
+        chunked = measure('chunked, every change', context.find, view, pos, args.repeat, True)
+        measure('chunked, same change', context.find, view, pos, args.repeat, False)
+        print('  speedup {:.1f}x'.format(legacy / chunked))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+# Compare files/sec of util/scanner.py against the per-line regex cascade that
+# build_module_index used before it.
+#
+#   python bench/bench_scanner.py [erlang_dir] [--repeat N]
+#
+# Without a directory a synthetic corpus is generated in a temp dir.
+import os, sys, re, time, fnmatch, tempfile, argparse
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.join(os.path.dirname(BENCH_DIR), 'stubs'), os.path.dirname(BENCH_DIR)]
+
+import sublime
+from util import DataCache
+from corpus import make_corpus
+
+# the expressions of the per-line cascade, only kept for this comparison
+RE_DICT = {
+    'comment' : re.compile(r'%.*\n'),
+    'export' : re.compile(r'^\s*-\s*export\s*\(\s*\[\s*([^\]]*)\s*\]\s*\)\s*.', re.DOTALL + re.MULTILINE),
+    'export_all' : re.compile(r'^\s*-\s*compile\s*\(\s*export_all\s*\)\s*.', re.DOTALL + re.MULTILINE),
+    'funname' : re.compile(r'[a-zA-Z]+\w*\s*\/\s*[0-9]+'),
+    'funline' : re.compile(r'\s*(\w+)\s*\(([^)]*)\).*\-\>'),
+    'defineline' : re.compile(r'^\s*-\s*define\s*\(\s*(\w+)\({0}.*?\,\s*.*?\s*\)\s*\.'),
+    'record_re' : re.compile(r'\s*-\s*record\s*\(\s*(\w+)\s*,\s*\{([^-]*)\}\s*\)\s*\.', re.DOTALL + re.MULTILINE),
+    'record_field_re' : re.compile(r'\s*(\w+)\s*=?\s*([#{}\[\].\w\d"]*)\s*,?\s*', re.DOTALL + re.MULTILINE),
+    'special_param': re.compile(r'(?:\{.*\})|(?:<<.*>>)|(?:\[.*\])'),
+    '=' : re.compile(r'\s*=\s*\w+'),
+    'take_include' : re.compile(r'-include\("([^\)]*)"\)')
+}
+
+def legacy_format_param(param_str):
+    param_str = re.sub(RE_DICT['special_param'], 'Param', param_str)
+    param_str = re.sub(RE_DICT['='], '', param_str)
+    if param_str == '' or re.match('\s+', param_str):
+        return []
+    return re.split(',\s*', param_str)
+
+def legacy_build_module_index(filepath):
+    with open(filepath, encoding = 'UTF-8', errors='ignore') as fd:
+        content = fd.read()
+    code = re.sub(RE_DICT['comment'], '\n', content)
+
+    export_fun = {}
+    is_export_all = RE_DICT['export_all'].search(code)
+    if not is_export_all:
+        for export_match in RE_DICT['export'].finditer(code):
+            for funname_match in RE_DICT['funname'].finditer(export_match.group()):
+                [name, cnt] = funname_match.group().split('/')
+                export_fun[(name, int(cnt))] = None
+
+    rows = []
+    row_num = 1
+    for line in code.split('\n'):
+        funhead = RE_DICT['funline'].search(line)
+        if funhead is not None:
+            param_len = len(legacy_format_param(funhead.group(2)))
+            if (funhead.group(1), param_len) in export_fun or is_export_all != None:
+                rows.append((funhead.group(1), param_len, row_num))
+        else:
+            includehead = RE_DICT['take_include'].search(line)
+            if includehead is not None:
+                rows.append(includehead.group(1))
+            else:
+                definehead = RE_DICT['defineline'].search(line)
+                if definehead is not None:
+                    rows.append(definehead.group(1))
+        row_num += 1
+
+    for (record, fields_data) in RE_DICT['record_re'].findall(code):
+        rows.append(RE_DICT['record_field_re'].findall(fields_data))
+    return rows
+
+def collect(path):
+    all_filepath = []
+    for root, dirs, files in os.walk(path):
+        for file in fnmatch.filter(files, '*.[e|h]rl'):
+            all_filepath.append(os.path.join(root, file))
+    return all_filepath
+
+def measure(name, fun, all_filepath, repeat):
+    best = None
+    for i in range(repeat):
+        start_time = time.perf_counter()
+        for filepath in all_filepath:
+            fun(filepath)
+        use_time = time.perf_counter() - start_time
+        best = use_time if best is None else min(best, use_time)
+    print('{:<10} {:>8.1f} files/sec  ({:.3f}s for {} files)'.format(name, len(all_filepath) / best, best, len(all_filepath)))
+    return best
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('dir', nargs = '?')
+    parser.add_argument('--repeat', type = int, default = 3)
+    args = parser.parse_args()
+
+    path = args.dir
+    if path is None:
+        path = tempfile.mkdtemp(prefix = 'erl_corpus')
+        make_corpus(path)
+    all_filepath = collect(path)
+
+    cache = DataCache()
+    legacy = measure('legacy', legacy_build_module_index, all_filepath, args.repeat)
+    # the legacy parser found no call sites, compare without them
+    sublime.settings['index_references'] = False
+    current = measure('scanner', cache.build_module_index, all_filepath, args.repeat)
+    sublime.settings['index_references'] = True
+    measure('+refs', cache.build_module_index, all_filepath, args.repeat)
+    print('speedup    {:.2f}x'.format(legacy / current))
+
+if __name__ == '__main__':
+    main()
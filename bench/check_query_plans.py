@@ -0,0 +1,73 @@
+# Runs EXPLAIN QUERY PLAN for every query of util/data_cache.py on a small
+# synthetic index and fails when one of them scans a table instead of
+# searching an index. Run it after changing a table, an index or a query.
+#
+#   python bench/check_query_plans.py [--verbose]
+import os, sys, re, shutil, tempfile, argparse
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.join(os.path.dirname(BENCH_DIR), 'stubs'), os.path.dirname(BENCH_DIR)]
+
+import sublime
+from util import DataCache
+from util import data_cache
+import corpus
+
+# statements that read a whole table on purpose: loading the in-memory
+# indexes at startup, listing every module, rebuilding after a folder is removed
+# and parsing every file again after index_references changed
+FULL_SCANS = {
+    'QUERY_ALL_MOD': 'libs',
+    'QUERY_FILE_MODS': 'libs',
+    'QUERY_ALL_PATHS_SQL': 'files',
+    'RESET_FILES_SQL': 'files',
+    'DEL_ALL_CLOSURE_SQL': 'include_closure'
+}
+
+SCAN_RE = re.compile(r'\bSCAN (?:TABLE )?(\w+)(?: AS \w+)?(.*)')
+
+def statements():
+    for (name, sql) in sorted(vars(data_cache).items()):
+        if not isinstance(sql, str) or name.startswith('CREATE_') or not re.match(r'\s*(select|delete|update)\b', sql):
+            continue
+        # the ({}) lists of paths get two placeholders
+        yield (name, sql.format('?, ?') if '{}' in sql else sql)
+
+def check(db_con, name, sql, verbose):
+    plan = db_con.execute('explain query plan ' + sql, (None, ) * sql.count('?')).fetchall()
+    problems = []
+    subqueries = set()
+    for row in plan:
+        detail = row[-1]
+        m = SCAN_RE.search(detail)
+        if detail.startswith(('MATERIALIZE ', 'CO-ROUTINE ')):
+            subqueries.add(detail.split()[1])
+        # scanning a subquery's result or through a covering index is fine
+        elif m and m.group(1) not in subqueries and m.group(1) != 'SUBQUERY' and 'COVERING INDEX' not in m.group(2) and FULL_SCANS.get(name) != m.group(1):
+            problems.append(detail)
+    if verbose or problems:
+        print('{}{}'.format(name, ' SCANS' if problems else ''))
+        for row in plan:
+            print('    {}'.format(row[-1]))
+    return problems == []
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--verbose', action = 'store_true')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix = 'erl_plans')
+    try:
+        corpus.make_corpus(os.path.join(work_dir, 'corpus'), apps = 2, modules = 10, huge_files = 0)
+        project = DataCache('project', os.path.join(work_dir, 'cache'), [os.path.join(work_dir, 'corpus')])
+        project.build_data()
+        failed = [name for (name, sql) in statements() if not check(project.db_con, name, sql, args.verbose)]
+    finally:
+        shutil.rmtree(work_dir, ignore_errors = True)
+    if failed != []:
+        print('{} statements scan a table: {}'.format(len(failed), ', '.join(failed)))
+        sys.exit(1)
+    print('all query plans use an index')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+# Synthetic Erlang trees for the benchmarks.
+#
+#   python bench/corpus.py DIR [--apps N] [--modules N] [--functions N] ...
+#
+# Every app gets app/src modules and an app/include header that starts a chain
+# of include_depth headers, each adding a macro and a record. Modules call
+# functions of other modules, use the chain's macros and records and
+# include_lib the next app's header. huge_files modules of huge_functions
+# functions stand in for generated code.
+import os, random, argparse
+
+DEFAULTS = {
+    'apps': 4,
+    'modules': 50,
+    'functions': 40,
+    'records': 3,
+    'include_depth': 5,
+    'huge_files': 1,
+    'huge_functions': 5000,
+    'seed': 1
+}
+
+def module_name(app, module):
+    return 'mod_{}_{}'.format(app, module)
+
+def write_file(path, lines):
+    with open(path, 'w', encoding = 'UTF-8') as fd:
+        fd.write('\n'.join(lines) + '\n')
+
+def make_headers(app_dir, app, include_depth):
+    include_dir = os.path.join(app_dir, 'include')
+    os.makedirs(include_dir)
+    headers = ['app_{}.hrl'.format(app)] + ['app_{}_chain_{}.hrl'.format(app, depth) for depth in range(include_depth)]
+    for (depth, header) in enumerate(headers):
+        lines = ['%% include chain of app_{}, level {}'.format(app, depth)]
+        if depth + 1 < len(headers):
+            lines.append('-include("{}").'.format(headers[depth + 1]))
+        lines.append('-define(APP_{}_LEVEL_{}, {}).'.format(app, depth, depth))
+        lines.append('-record(app_{}_rec_{}, {{id = 0 :: integer(), name = <<"level {}">>, tags = [] :: list(), parent}}).'.format(app, depth, depth))
+        write_file(os.path.join(include_dir, header), lines)
+
+def make_module(path, apps, app, module, options, rand):
+    name = module_name(app, module)
+    functions = options['functions']
+    depth = options['include_depth']
+    lines = ['%% generated module {} of app_{}'.format(module, app), '-module({}).'.format(name)]
+    lines.append('-export([{}]).'.format(', '.join('fun_{}/2'.format(f) for f in range(0, functions, 2))))
+    lines.append('-include("app_{}.hrl").'.format(app))
+    lines.append('-include_lib("app_{0}/include/app_{0}.hrl").'.format((app + 1) % apps))
+    lines.append('-define(TIMEOUT_{}, 5000).'.format(module))
+    for r in range(options['records']):
+        lines.append('-record(state_{}, {{id = 0 :: integer(), name = <<"n">>, items = [] :: list(), ref}}).'.format(r))
+    for f in range(functions):
+        (other_app, other_module) = (rand.randrange(apps), rand.randrange(options['modules']))
+        level = rand.randrange(depth + 1)
+        lines.append('%% @doc fun_{} handles 100% of the cases'.format(f))
+        lines.append('fun_{}(#state_{}{{id = Id}} = State, {{Key, Value}}) when Id > 0 ->'.format(f, f % max(1, options['records'])))
+        lines.append('    Rec = #app_{}_rec_{}{{id = ?APP_{}_LEVEL_{}}},'.format(app, level, app, level))
+        lines.append('    case {}:fun_{}(Rec, {{Key, Value}}) of'.format(module_name(other_app, other_module), rand.randrange(0, functions, 2)))
+        lines.append('        false -> {error, "not found: %s"};')
+        lines.append('        {{_, Old}} -> {{ok, Old + Value, ?TIMEOUT_{}}}'.format(module))
+        lines.append('    end;')
+        lines.append('fun_{}(_State, _Other) ->'.format(f))
+        lines.append('    lists:reverse([ok]).')
+        lines.append('')
+    write_file(path, lines)
+
+def make_huge_module(path, name, functions):
+    lines = ['%% generated, do not edit', '-module({}).'.format(name), '-compile(export_all).']
+    for f in range(functions):
+        lines.append('lookup_{0}(Key) when Key =:= {0} -> {{value, {0}, <<"entry {0}">>}};'.format(f))
+        lines.append('lookup_{}(_) -> none.'.format(f))
+    write_file(path, lines)
+
+def make_corpus(path, **options):
+    options = dict(DEFAULTS, **options)
+    rand = random.Random(options['seed'])
+    apps = options['apps']
+    for app in range(apps):
+        app_dir = os.path.join(path, 'app_{}'.format(app))
+        make_headers(app_dir, app, options['include_depth'])
+        src_dir = os.path.join(app_dir, 'src')
+        os.makedirs(src_dir)
+        for module in range(options['modules']):
+            make_module(os.path.join(src_dir, module_name(app, module) + '.erl'), apps, app, module, options, rand)
+    if options['huge_files'] > 0:
+        gen_dir = os.path.join(path, 'generated', 'src')
+        os.makedirs(gen_dir)
+        for i in range(options['huge_files']):
+            make_huge_module(os.path.join(gen_dir, 'huge_{}.erl'.format(i)), 'huge_{}'.format(i), options['huge_functions'])
+    return options
+
+def add_arguments(parser):
+    for (name, default) in sorted(DEFAULTS.items()):
+        parser.add_argument('--' + name.replace('_', '-'), dest = name, type = int, default = default)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('dir')
+    add_arguments(parser)
+    args = vars(parser.parse_args())
+    path = args.pop('dir')
+    make_corpus(path, **args)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+# Index build time, peak memory and query latencies on a synthetic corpus,
+# written as JSON so runs of different revisions can be compared.
+#
+#   python bench/run_bench.py [--dir DIR] [--out result.json] [--samples N]
+#                             [--parse-mode thread|process] [corpus options]
+#
+# Without --dir a corpus is generated in a temp dir, see corpus.py for the
+# options. The index is always built from scratch in a fresh cache dir.
+import os, sys, re, json, time, random, tempfile, argparse, platform, subprocess
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.join(os.path.dirname(BENCH_DIR), 'stubs'), os.path.dirname(BENCH_DIR)]
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+import sublime
+from util import DataCache, GoTo
+from util.metrics import METRICS
+import corpus
+
+CALL_RE = re.compile(r'\b(mod_\d+_\d+):(fun_\d+)\(')
+USE_RE = re.compile(r'(?:\?|#)(APP_\d+_LEVEL_\d+|app_\d+_rec_\d+)')
+
+def revision():
+    try:
+        output = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd = BENCH_DIR, stderr = subprocess.DEVNULL)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return output.decode('UTF-8').strip()
+
+def collect_sources(path):
+    sources = []
+    for root, dirs, files in os.walk(path):
+        sources += [os.path.join(root, file) for file in files if file.endswith('.erl')]
+    return sorted(sources)
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[int(round(q * (len(values) - 1)))]
+
+def latency(fun, args_list):
+    times = []
+    for args in args_list:
+        start_time = time.perf_counter()
+        fun(*args)
+        times.append((time.perf_counter() - start_time) * 1000)
+    return {
+        'samples': len(times),
+        'p50_ms': percentile(times, 0.5),
+        'p99_ms': percentile(times, 0.99),
+        'max_ms': max(times)
+    }
+
+def build_index(cache_dir, path):
+    if tracemalloc != None:
+        tracemalloc.start()
+    start_time = time.perf_counter()
+    project = DataCache('project', cache_dir, [path])
+    project.build_data()
+    build_time = time.perf_counter() - start_time
+    peak = None
+    if tracemalloc != None:
+        (current, peak) = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    # modules and exports are queryable after the first of the two builds
+    first_tier = [build['seconds'] for build in METRICS.snapshot()['builds'] if build['data_type'] == 'project']
+    return (project, {'seconds': build_time, 'first_tier_seconds': first_tier[-1] if first_tier != [] else None, 'python_peak_bytes': peak})
+
+def goto_requests(sources, samples, rand):
+    # (point, view) pairs on remote calls, macros and records
+    requests = []
+    for filepath in rand.sample(sources, min(len(sources), samples)):
+        with open(filepath, encoding = 'UTF-8') as fd:
+            view = sublime.View(fd.read(), filepath)
+        matches = list(CALL_RE.finditer(view.text)) + list(USE_RE.finditer(view.text))
+        if matches != []:
+            m = rand.choice(matches)
+            requests.append((m.start(m.lastindex) + 1, view))
+    return requests
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dir')
+    parser.add_argument('--out')
+    parser.add_argument('--samples', type = int, default = 500)
+    parser.add_argument('--parse-mode', dest = 'parse_mode', default = 'thread')
+    corpus.add_arguments(parser)
+    args = vars(parser.parse_args())
+    (path, out, samples) = (args.pop('dir'), args.pop('out'), args.pop('samples'))
+    sublime.settings['index_parse_mode'] = args.pop('parse_mode')
+
+    options = None
+    if path == None:
+        path = tempfile.mkdtemp(prefix = 'erl_corpus')
+        options = corpus.make_corpus(path, **args)
+    sources = collect_sources(path)
+
+    (project, build) = build_index(tempfile.mkdtemp(prefix = 'erl_cache'), path)
+    build['files'] = project.db_query('select count(*) from files')[0][0]
+    project.db_cur.execute('pragma wal_checkpoint(truncate)')
+    build['db_bytes'] = os.path.getsize(project.db_path)
+    try:
+        import resource
+        build['max_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    except ImportError:
+        pass
+
+    rand = random.Random(1)
+    modules = [name for (name, ) in project.db_query('select m.name from (select distinct mod_id from libs) t join names m on m.id = t.mod_id')]
+    records = [(path, record) for (path, record) in project.db_query(
+        'select files.path, r.name from files join record_defs t on t.file_id = files.id join names r on r.id = t.record_id')]
+    cache = {'libs': DataCache('libs'), 'project': project}
+    go_to = GoTo()
+    queries = {
+        'query_mod_fun': latency(project.query_mod_fun, [(rand.choice(modules), ) for i in range(samples)]),
+        'query_all_mod': latency(project.query_all_mod, [() for i in range(max(1, samples // 10))]),
+        'query_file_defines': latency(project.query_file_defines, [(rand.choice(sources), ) for i in range(samples)]),
+        'query_record_fields': latency(project.query_record_fields, [rand.choice(records) + (True, ) for i in range(samples)]),
+        'goto_run': latency(lambda point, view: go_to.run(point, view, cache), goto_requests(sources, samples, rand))
+    }
+
+    result = {
+        'revision': revision(),
+        'python': platform.python_version(),
+        'corpus': options or {'dir': path},
+        'sources': len(sources),
+        'build': build,
+        'queries': queries
+    }
+    output = json.dumps(result, indent = 2, sort_keys = True)
+    if out != None:
+        with open(out, 'w') as fd:
+            fd.write(output + '\n')
+    print(output)
+
+if __name__ == '__main__':
+    main()
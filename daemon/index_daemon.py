@@ -0,0 +1,113 @@
+# Shared index process, several Sublime Text instances query one libs and one
+# project index instead of each building their own.
+#
+#   python3 daemon/index_daemon.py --cache-dir DIR [--socket PATH] [--escript PATH]
+#                                  [--index-pool-size N] [--index-parse-mode thread|process]
+#
+# The plugin connects when "index_daemon_socket" is set to the same socket
+# (DIR/index.sock by default). Use a cache dir of its own, not the plugin's.
+import os, sys, signal, socket, argparse, socketserver
+
+DAEMON_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.join(os.path.dirname(DAEMON_DIR), 'stubs'), os.path.dirname(DAEMON_DIR)]
+
+import sublime
+from util import DataCache, SCHEDULER, get_erl_otp_info
+from util.index_protocol import send_message, recv_message, REMOTE_METHODS
+from util.index_scheduler import PRIORITY_REFRESH, PRIORITY_BUILD
+
+# writes run on the scheduler, the client waits until they are done
+WRITE_PRIORITIES = {'build_dir_data': PRIORITY_BUILD, 'refresh_files': PRIORITY_REFRESH}
+
+class IndexHandler(socketserver.StreamRequestHandler):
+    # one connection per client thread, requests are answered in order
+    def handle(self):
+        while True:
+            try:
+                request = recv_message(self.rfile)
+            except (OSError, ValueError):
+                return
+            if request == None:
+                return
+            try:
+                (data_type, method, args) = request
+                response = [True, self.server.call(data_type, method, args)]
+            except Exception as e:
+                response = [False, '{}: {}'.format(type(e).__name__, e)]
+            try:
+                send_message(self.wfile, response)
+            except OSError:
+                return
+
+class IndexServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, caches):
+        self.caches = caches
+        socketserver.UnixStreamServer.__init__(self, socket_path, IndexHandler)
+
+    def call(self, data_type, method, args):
+        if method not in REMOTE_METHODS:
+            raise ValueError('unknown method {}'.format(method))
+        cache = self.caches[data_type]
+        if method == 'index_generation':
+            return cache.index_generation
+        if method in WRITE_PRIORITIES:
+            SCHEDULER.call(None, WRITE_PRIORITIES[method], None, getattr(cache, method), *args)
+            return None
+        return getattr(cache, method)(*args)
+
+def remove_stale_socket(socket_path):
+    if not os.path.exists(socket_path):
+        return True
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+        return False
+    except OSError:
+        os.remove(socket_path)
+        return True
+    finally:
+        sock.close()
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cache-dir', dest = 'cache_dir', required = True)
+    parser.add_argument('--socket')
+    parser.add_argument('--escript', default = 'escript')
+    parser.add_argument('--index-pool-size', dest = 'index_pool_size', type = int)
+    parser.add_argument('--index-parse-mode', dest = 'index_parse_mode', default = 'thread')
+    args = parser.parse_args()
+    sublime.settings.update(escript = args.escript, index_pool_size = args.index_pool_size, index_parse_mode = args.index_parse_mode)
+
+    cache_dir = os.path.abspath(args.cache_dir)
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    socket_path = args.socket or os.path.join(cache_dir, 'index.sock')
+    if not remove_stale_socket(socket_path):
+        print('an index daemon already listens on {}'.format(socket_path))
+        sys.exit(1)
+
+    libs = DataCache('libs')
+    info = get_erl_otp_info(cache_dir)
+    if info != None:
+        snapshot = 'otp{}-erts{}'.format(info['otp_release'], info['erts_version'])
+        libs = DataCache('libs', cache_dir, [info['lib_dir']], snapshot = snapshot)
+        libs.build_data()
+    project = DataCache('project', cache_dir, fallback = libs)
+    project.start_watching()
+
+    server = IndexServer(socket_path, {'libs': libs, 'project': project})
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    print('index daemon listens on {}'.format(socket_path))
+    try:
+        server.serve_forever()
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        project.stop_watching()
+        server.server_close()
+        os.remove(socket_path)
+
+if __name__ == '__main__':
+    main()
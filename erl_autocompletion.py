@@ -1,22 +1,65 @@
 from .util import *
 from functools import partial
-import sublime_plugin, sublime, re, os, sys, shutil
+import sublime_plugin, sublime, re, os, sys, shutil, json
 
 cache = {}
+hover = None
 
 ERL_AUTO_COMPLETE = ['#', '.', '{', '?', ':']
 
 def plugin_loaded():
-    global cache
+    global cache, hover
 
     cache_dir = os.path.join(sublime.cache_path(), GLOBAL_SET['package_name'])
-    cache['libs'] = DataCache('libs', cache_dir, [get_erl_lib_dir()])
-    cache['libs'].build_data_async()
+    SCHEDULER.cpu_limit = get_settings_param('index_cpu_limit', 0.5)
+    SCHEDULER.on_progress = show_progress
+    for window in sublime.windows():
+        for view in window.views():
+            SCHEDULER.focus(view.file_name())
+    socket_path = get_settings_param('index_daemon_socket', '')
+    if socket_path and index_daemon_running(socket_path):
+        print('use index daemon at {}'.format(socket_path))
+        on_lost = partial(use_local_index, cache_dir)
+        cache['libs'] = IndexClient(socket_path, 'libs', on_lost)
+        cache['project'] = IndexClient(socket_path, 'project', on_lost)
+        cache['project'].build_data_async()
+    else:
+        use_local_index(cache_dir)
+
+    METRICS.handler_budget = get_settings_param('handler_budget', 50) / 1000.0
+
+    hover = HoverResolver(cache,
+        delay = get_settings_param('hover_delay', 100) / 1000.0,
+        budget = get_settings_param('hover_latency_budget', 300) / 1000.0,
+        cache_size = get_settings_param('hover_cache_size', 128))
+
+def use_local_index(cache_dir):
+    if isinstance(cache.get('project'), DataCache):
+        return
+    # replaced by the index of the installed OTP release once escript answered
+    cache['libs'] = DataCache('libs')
+    cache['project'] = DataCache('project', cache_dir, fallback = cache['libs'])
+    cache['project'].start_watching()
+    SCHEDULER.submit(('load_libs', ), PRIORITY_BUILD, load_libs, cache_dir)
 
-    cache['project'] = DataCache('project', cache_dir)
-    cache['project'].build_data_async()
+def show_progress(text):
+    sublime.set_timeout(lambda: sublime.status_message(text), 0)
+
+def load_libs(cache_dir):
+    info = get_erl_otp_info(cache_dir)
+    if info != None:
+        snapshot = 'otp{}-erts{}'.format(info['otp_release'], info['erts_version'])
+        libs = DataCache('libs', cache_dir, [info['lib_dir']], snapshot = snapshot)
+        cache['libs'] = libs
+        cache['project'].fallback = libs
+        libs.build_data()
+    # project includes of OTP headers resolve against the libs apps
+    cache['project'].build_data()
 
 def plugin_unloaded():
+    if 'project' in cache:
+        cache['project'].stop_watching()
+
     from package_control import events
 
     package_name = GLOBAL_SET['package_name']
@@ -30,6 +73,7 @@ if sys.version_info < (3,):
     unload_handler = plugin_unloaded
 
 class ErlListener(sublime_plugin.EventListener):
+    @METRICS.handler('on_query_completions')
     def on_query_completions(self, view, prefix, locations):
         if not view.match_selector(locations[0], "source.erlang"): 
             return []
@@ -54,9 +98,11 @@ class ErlListener(sublime_plugin.EventListener):
             flag = sublime.INHIBIT_WORD_COMPLETIONS | sublime.INHIBIT_EXPLICIT_COMPLETIONS
             completion = cache['libs'].query_mod_fun(module_name)
             if completion != []:
+                cache['libs'].touch_module(module_name)
                 return (completion, flag)
             completion = cache['project'].query_mod_fun(module_name)
             if completion != []:
+                cache['project'].touch_module(module_name)
                 return (completion, flag)
         elif letter == '?':
             # show define list
@@ -86,11 +132,19 @@ class ErlListener(sublime_plugin.EventListener):
 
             if re.match('^[0-9a-z_]+$', prefix) and len(prefix) > 1:
                 # show module
-                modules = cache['libs'].query_all_mod() + cache['project'].query_all_mod() + cache['libs'].query_mod_fun('erlang')
-                return [ (mname, mval+":") for (mname, mval) in modules]
+                limit = get_settings_param('module_completion_limit', 50)
+                modules = cache['libs'].query_module_prefix(prefix, limit) + cache['project'].query_module_prefix(prefix, limit)
+                completion = []
+                all_mod = set()
+                for (rank, mod_name) in sorted(modules):
+                    if mod_name not in all_mod and len(completion) < limit:
+                        completion.append(['{}\tModule'.format(mod_name), mod_name + ':'])
+                        all_mod.add(mod_name)
+                return completion + cache['libs'].query_fun_prefix('erlang', prefix, limit)
             
             # return None
 
+    @METRICS.handler('on_text_command')
     def on_text_command(self, view, command_name, args):
         if command_name == 'goto':
             if args and 'event' in args:
@@ -106,13 +160,14 @@ class ErlListener(sublime_plugin.EventListener):
             go_to = GoTo()
             go_to.run(point, view, cache, is_quick_panel = True)
 
+    @METRICS.handler('on_hover')
     def on_hover(self, view, point, hover_zone):
-        if not view.match_selector(point, "source.erlang"): 
+        if hover_zone != sublime.HOVER_TEXT or not view.match_selector(point, "source.erlang"): 
             return
 
-        go_to = GoTo()
-        go_to.run(point, view, cache)
+        hover.hover(view, point)
 
+    @METRICS.handler('on_post_save_async')
     def on_post_save_async(self, view):
         caret = view.sel()[0].a
 
@@ -121,14 +176,29 @@ class ErlListener(sublime_plugin.EventListener):
 
         cache['project'].rebuild_module_index(view.file_name())
 
+    @METRICS.handler('on_window_command')
     def on_window_command(self, window, command_name, args):
         if command_name == 'remove_folder':
             cache['project'].delete_module_index(args['dirs'])
+        elif command_name == 'close_window' and isinstance(cache['project'], DataCache):
+            # a daemon keeps indexing for its other clients
+            open_folders = {folder for other in sublime.windows() if other.id() != window.id() for folder in other.folders()}
+            cache['project'].close_folders([folder for folder in window.folders() if folder not in open_folders])
 
+    @METRICS.handler('on_load')
     def on_load(self, view):
+        SCHEDULER.focus(view.file_name())
         cache['project'].build_data_async()
 
+    @METRICS.handler('on_close')
+    def on_close(self, view):
+        SCHEDULER.forget(view.file_name())
+        cache['project'].forget_view(view.id())
+
+    @METRICS.handler('on_modified')
     def on_modified(self, view):
+        hover.cancel()
+        SCHEDULER.typing()
         view_sel = view.sel()
         sel = view_sel[0]
         pos = sel.end()
@@ -139,4 +209,50 @@ class ErlListener(sublime_plugin.EventListener):
 
 class GotoCommand(sublime_plugin.TextCommand):
     def run(self, edit):
-        return
\ No newline at end of file
+        return
+
+class FindReferencesCommand(sublime_plugin.TextCommand):
+    @METRICS.handler('find_references')
+    def run(self, edit, event = None):
+        if event != None:
+            point = self.view.window_to_text((event['x'], event['y']))
+        else:
+            point = self.view.sel()[0].begin()
+
+        if not self.view.match_selector(point, "source.erlang"): 
+            return
+
+        GoTo().find_references(point, self.view, cache)
+
+    def want_event(self):
+        return True
+
+class ErlShowMetricsCommand(sublime_plugin.WindowCommand):
+    def run(self):
+        cache_dir = os.path.join(sublime.cache_path(), GLOBAL_SET['package_name'])
+        # with an index daemon nothing else writes to the cache folder
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        metrics_path = os.path.join(cache_dir, 'metrics.json')
+        with open(metrics_path, 'w', encoding = 'UTF-8') as fd:
+            json.dump(METRICS.snapshot(), fd, indent = 2, sort_keys = True)
+
+        panel = self.window.create_output_panel('erl_metrics')
+        panel.run_command('append', {'characters': METRICS.summary() + '\nfull dump: {}\n'.format(metrics_path)})
+        self.window.run_command('show_panel', {'panel': 'output.erl_metrics'})
+
+class ErlProfileIndexCommand(sublime_plugin.WindowCommand):
+    def run(self):
+        cache_dir = os.path.join(sublime.cache_path(), GLOBAL_SET['package_name'])
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        report_path = os.path.join(cache_dir, 'profile.txt')
+        # the daemon's index is profiled in a build of the plugin's own
+        project = cache['project'] if isinstance(cache['project'], DataCache) else DataCache('project')
+        window = self.window
+        def profile():
+            project.profile_build(report_path)
+            sublime.set_timeout(lambda: window.open_file(report_path), 0)
+        # a job like any build, so its writes never race the worker's
+        sublime.status_message('profiling an index build ...')
+        SCHEDULER.submit(('profile', ), PRIORITY_BUILD, profile)
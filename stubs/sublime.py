@@ -0,0 +1,118 @@
+# minimal stand-in for the sublime module so util/ can be imported headless,
+# by the benchmarks and by the index daemon
+import re, tempfile
+
+HOVER_TEXT = 1
+HIDE_ON_MOUSE_MOVE_AWAY = 2
+ENCODED_POSITION = 1
+TRANSIENT = 4
+
+_cache_path = None
+
+class Settings(dict):
+    def get(self, key, default = None):
+        return dict.get(self, key, default)
+
+def cache_path():
+    global _cache_path
+    if _cache_path == None:
+        _cache_path = tempfile.mkdtemp(prefix = 'erl_autocompletion_bench')
+    return _cache_path
+
+# shared by every settings file, benchmarks and the daemon's command line set
+# their options here
+settings = Settings()
+
+def load_settings(name):
+    return settings
+
+def windows():
+    return []
+
+def active_window():
+    return None
+
+class Region:
+    def __init__(self, a, b = None):
+        self.a = a
+        self.b = a if b == None else b
+
+    def begin(self):
+        return min(self.a, self.b)
+
+    def end(self):
+        return max(self.a, self.b)
+
+def set_timeout(callback, delay = 0):
+    callback()
+
+def status_message(message):
+    print(message)
+
+class Window:
+    def __init__(self):
+        self.opened = []
+        self.quick_panels = []
+
+    def folders(self):
+        return []
+
+    def active_view(self):
+        return None
+
+    def open_file(self, path, flags = 0):
+        self.opened.append(path)
+
+    def show_quick_panel(self, items, on_select, flags = 0, selected_index = -1, on_highlight = None):
+        self.quick_panels.append(items)
+
+class View:
+    # a read-only buffer, popups are recorded instead of shown
+    next_id = 1
+
+    def __init__(self, text = '', file_name = None):
+        self.text = text
+        self.path = file_name
+        self.count = 0
+        self.view_id = View.next_id
+        View.next_id += 1
+        self.popups = []
+        self.parent = Window()
+
+    def id(self):
+        return self.view_id
+
+    def change_count(self):
+        return self.count
+
+    def size(self):
+        return len(self.text)
+
+    def file_name(self):
+        return self.path
+
+    def window(self):
+        return self.parent
+
+    def substr(self, x):
+        if isinstance(x, Region):
+            return self.text[x.begin():x.end()]
+        return self.text[x:x + 1]
+
+    def line(self, point):
+        if isinstance(point, Region):
+            point = point.begin()
+        end = self.text.find('\n', point)
+        return Region(self.text.rfind('\n', 0, point) + 1, len(self.text) if end == -1 else end)
+
+    def word(self, point):
+        start = point
+        while start > 0 and re.match(r'\w', self.text[start - 1]):
+            start -= 1
+        end = point
+        while end < len(self.text) and re.match(r'\w', self.text[end]):
+            end += 1
+        return Region(start, end)
+
+    def show_popup(self, content, flags = 0, location = -1, max_width = 320, max_height = 240, on_navigate = None, on_hide = None):
+        self.popups.append(content)
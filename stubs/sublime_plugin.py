@@ -0,0 +1,14 @@
+# minimal stand-in for the sublime_plugin module, see sublime.py
+class EventListener:
+    pass
+
+class TextCommand:
+    def __init__(self, view):
+        self.view = view
+
+class WindowCommand:
+    def __init__(self, window):
+        self.window = window
+
+class ApplicationCommand:
+    pass
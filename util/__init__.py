@@ -1,3 +1,7 @@
 from .data_cache import DataCache
-from .settings import get_erl_lib_dir, get_settings_param, GLOBAL_SET
-from .go_to import GoTo
\ No newline at end of file
+from .settings import get_erl_otp_info, get_settings_param, GLOBAL_SET
+from .go_to import GoTo
+from .hover import HoverResolver
+from .metrics import METRICS
+from .index_scheduler import SCHEDULER, PRIORITY_BUILD
+from .index_client import IndexClient, index_daemon_running
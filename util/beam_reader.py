@@ -0,0 +1,339 @@
+import os, re, struct, zlib, hashlib
+
+# reads the exported functions of a compiled module without an Erlang runtime:
+# the atom table (AtU8, or Atom before OTP 20) and the export table (ExpT) give
+# the names and arities, the abstract code in Dbgi (Abst before OTP 20) gives
+# the line and the argument names of the first clause when it was compiled
+# with debug_info
+
+UINT32 = struct.Struct('>I')
+INT32 = struct.Struct('>i')
+EXPORT = struct.Struct('>III')
+
+# a 5-tuple starting with the atom function, in any of the four atom encodings
+FUNCTION_FORM_RE = re.compile(b'\\x68\\x05(?:\\x77\\x08|\\x73\\x08|\\x76\\x00\\x08|\\x64\\x00\\x08)function')
+
+class BeamError(ValueError):
+    pass
+
+def read_chunks(data, names):
+    if len(data) < 12 or data[0:4] != b'FOR1' or data[8:12] != b'BEAM':
+        raise BeamError('not a beam file')
+    chunks = {}
+    pos = 12
+    while pos + 8 <= len(data):
+        name = data[pos:pos + 4].decode('latin-1')
+        (size, ) = UINT32.unpack_from(data, pos + 4)
+        if name in names:
+            chunks[name] = data[pos + 8:pos + 8 + size]
+        # chunks are padded to 4 bytes
+        pos += 8 + ((size + 3) & ~3)
+    return chunks
+
+def read_compact_int(data, pos):
+    # the compact term encoding of beam_asm, only the value is needed
+    b = data[pos]
+    if b & 0x08 == 0:
+        return (b >> 4, pos + 1)
+    if b & 0x10 == 0:
+        return (((b & 0xe0) << 3) | data[pos + 1], pos + 2)
+    size = (b >> 5) + 2
+    pos += 1
+    if size == 9:
+        (size, pos) = read_compact_int(data, pos)
+        size += 9
+    return (int.from_bytes(data[pos:pos + size], 'big', signed = True), pos + size)
+
+def read_atoms(chunk, encoding):
+    (count, ) = INT32.unpack_from(chunk, 0)
+    atoms = [None]
+    pos = 4
+    # since OTP 28 a negative count means the lengths are compact encoded
+    compact = count < 0
+    for i in range(abs(count)):
+        if compact:
+            (size, pos) = read_compact_int(chunk, pos)
+        else:
+            size = chunk[pos]
+            pos += 1
+        atoms.append(chunk[pos:pos + size].decode(encoding))
+        pos += size
+    return atoms
+
+def read_exports(chunk, atoms):
+    (count, ) = UINT32.unpack_from(chunk, 0)
+    exports = []
+    for i in range(count):
+        (name, arity, label) = EXPORT.unpack_from(chunk, 4 + i * 12)
+        exports.append((atoms[name], arity))
+    return exports
+
+class Atom(str):
+    pass
+
+class TermReader:
+    # decodes the external term format, skip() walks past a term without
+    # building it so function bodies cost no allocations
+    def __init__(self, data):
+        self.data = data
+
+    def decode(self, pos):
+        data = self.data
+        tag = data[pos]
+        pos += 1
+        if tag == 97:
+            return (data[pos], pos + 1)
+        if tag == 98:
+            return (INT32.unpack_from(data, pos)[0], pos + 4)
+        if tag in (100, 118):
+            (size, ) = struct.unpack_from('>H', data, pos)
+            return (Atom(data[pos + 2:pos + 2 + size].decode('UTF-8' if tag == 118 else 'latin-1')), pos + 2 + size)
+        if tag in (115, 119):
+            size = data[pos]
+            return (Atom(data[pos + 1:pos + 1 + size].decode('UTF-8' if tag == 119 else 'latin-1')), pos + 1 + size)
+        if tag in (104, 105):
+            if tag == 104:
+                (arity, pos) = (data[pos], pos + 1)
+            else:
+                (arity, pos) = (UINT32.unpack_from(data, pos)[0], pos + 4)
+            items = []
+            for i in range(arity):
+                (item, pos) = self.decode(pos)
+                items.append(item)
+            return (tuple(items), pos)
+        if tag == 106:
+            return ([], pos)
+        if tag == 107:
+            (size, ) = struct.unpack_from('>H', data, pos)
+            return (list(data[pos + 2:pos + 2 + size]), pos + 2 + size)
+        if tag == 108:
+            (size, ) = UINT32.unpack_from(data, pos)
+            pos += 4
+            items = []
+            for i in range(size):
+                (item, pos) = self.decode(pos)
+                items.append(item)
+            (tail, pos) = self.decode(pos)
+            return (items, pos)
+        if tag == 109:
+            (size, ) = UINT32.unpack_from(data, pos)
+            return (bytes(data[pos + 4:pos + 4 + size]), pos + 4 + size)
+        return (None, self.skip(pos - 1))
+
+    def skip(self, pos):
+        data = self.data
+        pending = 1
+        while pending > 0:
+            pending -= 1
+            tag = data[pos]
+            pos += 1
+            if tag == 97:
+                pos += 1
+            elif tag == 98:
+                pos += 4
+            elif tag in (100, 118, 107):
+                pos += 2 + struct.unpack_from('>H', data, pos)[0]
+            elif tag in (115, 119):
+                pos += 1 + data[pos]
+            elif tag == 104:
+                pending += data[pos]
+                pos += 1
+            elif tag == 105:
+                pending += UINT32.unpack_from(data, pos)[0]
+                pos += 4
+            elif tag == 106:
+                pass
+            elif tag == 108:
+                # the elements and the tail
+                pending += UINT32.unpack_from(data, pos)[0] + 1
+                pos += 4
+            elif tag == 109:
+                pos += 4 + UINT32.unpack_from(data, pos)[0]
+            elif tag == 77:
+                pos += 5 + UINT32.unpack_from(data, pos)[0]
+            elif tag == 70:
+                pos += 8
+            elif tag == 99:
+                pos += 31
+            elif tag == 110:
+                pos += 2 + data[pos]
+            elif tag == 111:
+                pos += 5 + UINT32.unpack_from(data, pos)[0]
+            elif tag == 116:
+                pending += 2 * UINT32.unpack_from(data, pos)[0]
+                pos += 4
+            elif tag == 113:
+                # fun M:F/A
+                pending += 3
+            else:
+                raise BeamError('unsupported term tag {}'.format(tag))
+        return pos
+
+    def tuple_header(self, pos):
+        # (arity, pos of the first element) or (None, pos) if not a tuple
+        tag = self.data[pos]
+        if tag == 104:
+            return (self.data[pos + 1], pos + 2)
+        if tag == 105:
+            return (UINT32.unpack_from(self.data, pos + 1)[0], pos + 5)
+        return (None, pos)
+
+    def list_header(self, pos):
+        tag = self.data[pos]
+        if tag == 108:
+            return (UINT32.unpack_from(self.data, pos + 1)[0], pos + 5)
+        if tag == 106:
+            return (0, pos + 1)
+        return (None, pos)
+
+def binary_to_term(chunk):
+    if chunk[0:1] != b'\x83':
+        raise BeamError('not an external term')
+    if chunk[1:2] == b'\x50':
+        # compressed, 4 bytes of uncompressed size and a zlib stream
+        return TermReader(b'\x83' + zlib.decompress(chunk[6:]))
+    return TermReader(chunk)
+
+def anno_line(anno):
+    # erl_anno: Line, {Line, Column} or a list with {location, Location}
+    if isinstance(anno, int):
+        return anno
+    if isinstance(anno, tuple) and len(anno) == 2 and isinstance(anno[0], int):
+        return anno[0]
+    if isinstance(anno, list):
+        for item in anno:
+            if isinstance(item, tuple) and len(item) == 2 and item[0] == 'location':
+                return anno_line(item[1])
+    return 0
+
+def pattern_name(pattern):
+    # the same names the source scanner gives: a variable, a simple literal or Param
+    if isinstance(pattern, tuple) and len(pattern) >= 3:
+        if pattern[0] == 'var' and isinstance(pattern[2], Atom):
+            return str(pattern[2])
+        if pattern[0] == 'match':
+            for side in pattern[2:4]:
+                if isinstance(side, tuple) and len(side) >= 3 and side[0] == 'var':
+                    return str(side[2])
+        if pattern[0] in ('atom', 'integer') and len(pattern) == 3:
+            return str(pattern[2])
+    return 'Param'
+
+def read_function_heads(reader, exports):
+    # {function, Anno, Name, Arity, [Clause | _]} forms of the exported
+    # functions, found by their encoding instead of walking every function body
+    # term by term, returns {(name, arity): (line, [param])}
+    heads = {}
+    for m in FUNCTION_FORM_RE.finditer(reader.data):
+        try:
+            (anno, pos) = reader.decode(m.end())
+            (name, pos) = reader.decode(pos)
+            (arity, pos) = reader.decode(pos)
+            if (name, arity) not in exports or (name, arity) in heads:
+                continue
+            params = None
+            (clause_count, pos) = reader.list_header(pos)
+            if clause_count:
+                (clause_arity, pos) = reader.tuple_header(pos)
+                if clause_arity == 5:
+                    # {clause, Anno, Patterns, Guards, Body}
+                    (patterns, pos) = reader.decode(reader.skip(reader.skip(pos)))
+                    if isinstance(patterns, list) and len(patterns) == arity:
+                        params = [pattern_name(pattern) for pattern in patterns]
+            heads[(str(name), arity)] = (anno_line(anno), params)
+        except (BeamError, IndexError, TypeError, struct.error, UnicodeDecodeError):
+            continue
+    return heads
+
+def read_debug_info(chunks, exports):
+    if 'Dbgi' in chunks:
+        reader = binary_to_term(chunks['Dbgi'])
+        # {debug_info_v1, erl_abstract_code, {Forms, Options}}
+        (arity, pos) = reader.tuple_header(1)
+        if arity != 3:
+            return {}
+        (version, pos) = reader.decode(pos)
+        (backend, pos) = reader.decode(pos)
+        if version != 'debug_info_v1' or backend != 'erl_abstract_code':
+            return {}
+        return read_function_heads(reader, exports)
+    if 'Abst' in chunks and chunks['Abst'] != b'':
+        reader = binary_to_term(chunks['Abst'])
+        # {raw_abstract_v1, Forms}
+        (arity, pos) = reader.tuple_header(1)
+        if arity != 2:
+            return {}
+        (version, pos) = reader.decode(pos)
+        if version != 'raw_abstract_v1':
+            return {}
+        return read_function_heads(reader, exports)
+    return {}
+
+def read_beam(filepath, skip_hash = None):
+    # (hash, None) when the file hash equals skip_hash, otherwise
+    # (hash, (module, [(fun_name, arity, line, params)]))
+    with open(filepath, 'rb') as fd:
+        data = fd.read()
+    code_hash = hashlib.md5(data).hexdigest()
+    if code_hash == skip_hash:
+        return (code_hash, None)
+
+    chunks = read_chunks(data, ('AtU8', 'Atom', 'ExpT', 'Dbgi', 'Abst'))
+    if 'ExpT' not in chunks or not ('AtU8' in chunks or 'Atom' in chunks):
+        raise BeamError('no atom or export table')
+    try:
+        if 'AtU8' in chunks:
+            atoms = read_atoms(chunks['AtU8'], 'UTF-8')
+        else:
+            atoms = read_atoms(chunks['Atom'], 'latin-1')
+        exports = read_exports(chunks['ExpT'], atoms)
+    except (IndexError, struct.error, UnicodeDecodeError):
+        raise BeamError('truncated atom or export table')
+    try:
+        heads = read_debug_info(chunks, set(exports))
+    except (BeamError, IndexError, struct.error, zlib.error, UnicodeDecodeError):
+        heads = {}
+
+    funs = []
+    for (fun_name, arity) in exports:
+        # added to every module by the compiler
+        if fun_name == 'module_info':
+            continue
+        (line, params) = heads.get((fun_name, arity), (0, None))
+        if params == None or len(params) != arity:
+            params = ['Arg{}'.format(i + 1) for i in range(arity)]
+        funs.append((fun_name, arity, line, params))
+    return (code_hash, (atoms[1], funs))
+
+def read_source(filepath):
+    # the source a module was compiled from, recorded in its compile info
+    # unless it was built deterministic
+    try:
+        with open(filepath, 'rb') as fd:
+            chunks = read_chunks(fd.read(), ('CInf', ))
+        if 'CInf' not in chunks:
+            return None
+        reader = binary_to_term(chunks['CInf'])
+        (info, pos) = reader.decode(1)
+    except (OSError, BeamError, IndexError, struct.error, zlib.error, UnicodeDecodeError):
+        return None
+    for item in info if isinstance(info, list) else []:
+        if isinstance(item, tuple) and len(item) == 2 and item[0] == 'source' and isinstance(item[1], list):
+            try:
+                return bytes(item[1]).decode('UTF-8')
+            except (ValueError, UnicodeDecodeError):
+                # a list of code points over 255
+                return ''.join(chr(c) for c in item[1])
+    return None
+
+def beam_source_path(filepath):
+    # where go to should open a function read from filepath
+    (ebin_dir, filename) = os.path.split(filepath)
+    module = os.path.splitext(filename)[0]
+    source = os.path.join(os.path.dirname(ebin_dir), 'src', module + '.erl')
+    if os.path.exists(source):
+        return source
+    source = read_source(filepath)
+    if source != None and os.path.exists(source):
+        return source
+    return filepath
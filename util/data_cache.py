@@ -1,200 +1,832 @@
-import os, fnmatch, re, threading, sublime, sqlite3, shutil, time
+import os, sys, fnmatch, threading, sublime, sqlite3, time, multiprocessing, tempfile, shutil, cProfile, pstats, io, mmap, codecs
 from multiprocessing.pool import ThreadPool
 from .settings import get_settings_param, GLOBAL_SET
+from . import scanner, beam_reader
+from .prefix_index import PrefixIndex
+from .lru_cache import LRUCache
+from .fs_watcher import FolderWatcher
+from .dir_walker import DirWalker, get_app_from_path
+from .record_context import RecordContext
+from .outline import ViewOutline
+from .index_scheduler import SCHEDULER, PRIORITY_FILE, PRIORITY_DELETE, PRIORITY_REFRESH, PRIORITY_BUILD
+from .metrics import METRICS
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
 
 CREATE_LIBS_INFO_SQL = '''
 create table if not exists libs_info (
-    id int unsigned not null,
+    id integer primary key,
     parent_id int unsigned not null,
-    folder varchar(256) not null,
-    primary key(id)
+    folder varchar(256) not null
 );
 '''
 
 INSERT_FOLDER_INFO = '''
-replace into libs_info(id, parent_id, folder) values
-(?, ?, ?);
+insert into libs_info(parent_id, folder) values
+(?, ?);
+'''
+
+CREATE_LIBS_INFO_FOLDER_INDEX_SQL = '''
+create index if not exists libs_info_folder on libs_info (folder, id, parent_id);
+'''
+
+CREATE_LIBS_INFO_PARENT_INDEX_SQL = '''
+create index if not exists libs_info_parent on libs_info (parent_id);
 '''
 
 QUERY_FOLDER = '''
 select id, parent_id from libs_info where folder = ?;
 '''
 
+DEL_FOLDER_SQL = '''
+delete from libs_info where parent_id = ? or folder = ?;
+'''
+
+CREATE_FILES_SQL = '''
+create table if not exists files (
+    id integer primary key,
+    path varchar(512) not null unique,
+    path_id int unsigned not null,
+    name varchar(128) not null,
+    folder_id int unsigned not null,
+    mtime double not null,
+    size int unsigned not null,
+    hash char(32) not null,
+    detail boolean not null
+);
+'''
+
+CREATE_FILES_FOLDER_INDEX_SQL = '''
+create index if not exists files_folder on files (folder_id);
+'''
+
+CREATE_FILES_PATH_ID_INDEX_SQL = '''
+create index if not exists files_path_id on files (path_id);
+'''
+
+CREATE_FILES_DETAIL_INDEX_SQL = '''
+create index if not exists files_detail on files (detail);
+'''
+
+INSERT_FILE_SQL = '''
+insert into files(path, path_id, name, folder_id, mtime, size, hash, detail) values (?, ?, ?, ?, ?, ?, ?, ?);
+'''
+
+UPDATE_FILE_SQL = '''
+update files set folder_id = ?, mtime = ?, size = ?, hash = ?, detail = ? where id = ?;
+'''
+
+QUERY_FILE_SQL = '''
+select id, folder_id, mtime, size, hash from files where path = ?;
+'''
+
+QUERY_FILE_DETAIL_SQL = '''
+select detail from files where path = ?;
+'''
+
+QUERY_SKELETON_FILES_SQL = '''
+select path, id, folder_id, hash from files where detail = 0;
+'''
+
+QUERY_PATH_PREFIX_SQL = '''
+select path from files where path >= ? and path < ?;
+'''
+
+QUERY_FOLDER_FILES_SQL = '''
+select path, id, folder_id, mtime, size, hash from files
+where folder_id in (select id from libs_info where parent_id = ? or id = ?);
+'''
+
+DEL_FILE_SQL = '''
+delete from files where id = ?;
+'''
+
+FOLDER_FILES = '''
+select files.id from files where folder_id in (select id from libs_info where parent_id = ? or id = ?)
+'''
+
+DEL_FOLDER_FILES_SQL = '''
+delete from files where folder_id in (select id from libs_info where parent_id = ? or id = ?);
+'''
+
+# module, function, record, field and macro names are stored once here and
+# referenced by id from the tables below, so are the paths of files and includes
+CREATE_NAMES_SQL = '''
+create table if not exists names (
+    id integer primary key,
+    name varchar(256) not null unique
+);
+'''
+
+INSERT_NAME_SQL = '''
+insert or ignore into names (name) values (?);
+'''
+
+QUERY_NAME_ID_SQL = '''
+select id from names where name = ?;
+'''
+
 CREATE_LIBS_SQL = '''
 create table if not exists libs (
-    id int unsigned not null,
-    mod_name varchar(128) not null,
-    fun_name varchar(128) not null,
+    file_id int unsigned not null,
+    mod_id int unsigned not null,
+    fun_id int unsigned not null,
     param_len tinyint(2) not null,
     row_num int unsigned not null,
     completion varchar(256) not null,
-    primary key(id, mod_name, fun_name, param_len)
+    primary key(file_id, mod_id, fun_id, param_len)
 ); 
 '''
 
+# covers the module and function lookups, completion is read from the row
+CREATE_LIBS_MOD_INDEX_SQL = '''
+create index if not exists libs_mod on libs (mod_id, fun_id, param_len, file_id, row_num);
+'''
+
 INSERT_LIBS_SQL = '''
-replace into libs(id, mod_name, fun_name, param_len, row_num, completion) values 
+replace into libs(file_id, mod_id, fun_id, param_len, row_num, completion) values 
 (?, ?, ?, ?, ?, ?);
 '''
 
 DEL_LIBS_SQL = '''
-delete from libs where id = ? and mod_name = ?;
+delete from libs where file_id = ?;
 '''
 
 QUERY_COMPLETION = '''
-select fun_name, param_len, completion from libs where mod_name = ?;
+select f.name, libs.param_len, libs.completion from names m join libs on libs.mod_id = m.id join names f on f.id = libs.fun_id
+where m.name = ?;
 '''
 
 QUERY_ALL_MOD = '''
-select distinct mod_name from libs;
+select m.name from (select distinct mod_id from libs) t join names m on m.id = t.mod_id;
 '''
 
-QUERY_POSITION = '''
-select folder, fun_name, param_len, row_num from libs join libs_info where libs_info.id = libs.id and mod_name = ? and fun_name = ?;
+QUERY_FILE_MODS = '''
+select t.file_id, m.name from (select distinct file_id, mod_id from libs) t join names m on m.id = t.mod_id;
 '''
 
-DEL_FOLDER_LIBS_SQL = '''
-delete from libs where id in (select id from libs_info where parent_id = ?);
+QUERY_POSITION = '''
+select files.path, f.name, libs.param_len, libs.row_num from names m join names f join libs on libs.mod_id = m.id and libs.fun_id = f.id
+join files on files.id = libs.file_id where m.name = ? and f.name = ?;
 '''
 
-DEL_FOLDER_SQL = '''
-delete from libs_info where parent_id = ? or folder = ?;
-'''
+DEL_FOLDER_LIBS_SQL = '''
+delete from libs where file_id in ({});
+'''.format(FOLDER_FILES)
 
 CREATE_INCLUDE_SQL = '''
 create table if not exists includes ( 
-    id int unsigned not null,
-    file_name varchar ( 128 ) not null, 
-    include varchar ( 128 ), 
-    primary key (id, file_name, include)
+    file_id int unsigned not null,
+    include_id int unsigned not null, 
+    primary key (file_id, include_id)
 );
 '''
 
 INSERT_INCLUDE_INFO_SQL = '''
-replace into includes (id, file_name, include) values (?, ?, ?);
+replace into includes (file_id, include_id) values (?, ?);
+'''
+
+QUERY_INCLUDE_SQL = '''
+select include_id from includes where file_id = ?;
+'''
+
+QUERY_PATH_INCLUDE_SQL = '''
+select i.name from files join includes on includes.file_id = files.id join names i on i.id = includes.include_id
+where files.path = ?;
+'''
+
+DEL_INCLUDE_SQL = '''
+delete from includes where file_id = ?;
+'''
+
+DEL_FOLDER_INCLUDE_SQL = '''
+delete from includes where file_id in ({});
+'''.format(FOLDER_FILES)
+
+# transitive include closure of a file, the names ids of every path it
+# includes directly or indirectly (itself included), computed on first use and
+# dropped as soon as an include edge below it changes
+CREATE_CLOSURE_SQL = '''
+create table if not exists include_closure (
+    file_id int unsigned not null,
+    path_id int unsigned not null,
+    primary key (file_id, path_id)
+);
+'''
+
+CREATE_CLOSURE_PATH_INDEX_SQL = '''
+create index if not exists include_closure_path on include_closure (path_id);
+'''
+
+INSERT_CLOSURE_SQL = '''
+replace into include_closure (file_id, path_id) values (?, ?);
+'''
+
+HAS_CLOSURE_SQL = '''
+select 1 from include_closure where file_id = ? limit 1;
+'''
+
+QUERY_EXTERNAL_CLOSURE_SQL = '''
+select p.name from include_closure c join names p on p.id = c.path_id left join files on files.path_id = c.path_id
+where c.file_id = ? and files.id is null;
+'''
+
+DEL_CLOSURE_SQL = '''
+delete from include_closure where file_id in (select file_id from include_closure where path_id = (select id from names where name = ?));
+'''
+
+DEL_ALL_CLOSURE_SQL = '''
+delete from include_closure;
+'''
+
+# every file is parsed again by the next build
+RESET_FILES_SQL = '''
+update files set mtime = 0, hash = '';
+'''
+
+QUERY_ALL_PATHS_SQL = '''
+select path from files;
 '''
 
 CREATE_DEFINE_SQL = '''
 create table if not exists defines (
-    id int unsigned not null,
-    file_name varchar(128) not null,
-    define varchar(128) not null,
-    primary key (id, file_name, define)
+    file_id int unsigned not null,
+    define_id int unsigned not null,
+    row_num int unsigned not null,
+    definition text not null,
+    primary key (file_id, define_id)
 );
 '''
 
 INSERT_DEFINE_SQL = '''
-replace into defines (id, file_name, define) values (?, ?, ?);
+replace into defines (file_id, define_id, row_num, definition) values (?, ?, ?, ?);
 '''
 
 QUERY_DEFINE_SQL = '''
-with recursive
-    includetree(name) as (
-    select ? union all 
-    select includes.include from includetree, includes 
-    where includes.file_name = includetree.name)
-select t.define from includetree, defines t where t.file_name = includetree.name;
+select d.name from (select distinct t.define_id from include_closure c join files on files.path_id = c.path_id join defines t on t.file_id = files.id
+where c.file_id = ?) t join names d on d.id = t.define_id;
+'''
+
+QUERY_PATHS_DEFINE_SQL = '''
+select d.name from (select distinct t.define_id from files join defines t on t.file_id = files.id where files.path in ({})) t
+join names d on d.id = t.define_id;
+'''
+
+QUERY_DEFINE_POSITION_SQL = '''
+select files.path, t.row_num, t.definition from include_closure c join files on files.path_id = c.path_id join defines t on t.file_id = files.id
+where c.file_id = ? and t.define_id = (select id from names where name = ?);
 '''
 
+QUERY_PATHS_DEFINE_POSITION_SQL = '''
+select files.path, t.row_num, t.definition from files join defines t on t.file_id = files.id
+where files.path in ({}) and t.define_id = (select id from names where name = ?);
+'''
+
+DEL_DEFINE_SQL = '''
+delete from defines where file_id = ?;
+'''
+
+DEL_FOLDER_DEFINE_SQL = '''
+delete from defines where file_id in ({});
+'''.format(FOLDER_FILES)
+
 CREATE_RECORD_INFO_SQL = '''
 create table if not exists records (
-    id int unsigned not null,
-    file_name varchar (128) not null,
-    record varchar(128) not null,
-    field varchar(128) not null,
+    file_id int unsigned not null,
+    record_id int unsigned not null,
+    field_id int unsigned not null,
     default_val varchar(128) not null,
-    primary key (id, file_name, record, field)
+    primary key (file_id, record_id, field_id)
 );
 '''
 
 INSERT_RECORD_INFO_SQL = '''
-replace into records (id, file_name, record, field, default_val) values (?, ?, ?, ?, ?);
+replace into records (file_id, record_id, field_id, default_val) values (?, ?, ?, ?);
 '''
 
+# record names come from record_defs, one row per record instead of one per field
 QUERY_RECORD_SQL = '''
-with recursive
-    includetree(name) as (
-    select ? union all 
-    select includes.include from includetree, includes 
-    where includes.file_name = includetree.name)
-select t.record from includetree,
-(select records.file_name, records.record from records group by records.record) t 
-where t.file_name = includetree.name;
+select r.name from (select distinct t.record_id from include_closure c join files on files.path_id = c.path_id join record_defs t on t.file_id = files.id
+where c.file_id = ?) t join names r on r.id = t.record_id;
 '''
 
-QUERY_RECORD_FIELDS_SQL = '''
-with recursive
-    includetree(name) as (
-    select ? union all 
-    select includes.include from includetree, includes 
-    where includes.file_name = includetree.name)
-select t.field, t.default_val from includetree,
-(select records.file_name, records.field, records.default_val from records where records.record = ?) t 
-where t.file_name = includetree.name;
+QUERY_PATHS_RECORD_SQL = '''
+select r.name from (select distinct t.record_id from files join record_defs t on t.file_id = files.id where files.path in ({})) t
+join names r on r.id = t.record_id;
 '''
 
-DEL_INCLUDE_SQL = '''
-delete from includes where id in (select id from libs_info where parent_id = ?);
+QUERY_RECORD_FIELDS_SQL = '''
+select f.name, t.default_val from include_closure c join files on files.path_id = c.path_id join records t on t.file_id = files.id
+join names f on f.id = t.field_id where c.file_id = ? and t.record_id = (select id from names where name = ?);
 '''
 
-DEL_DEFINE_SQL = '''
-delete from defines where id in (select id from libs_info where parent_id = ?);
+QUERY_PATHS_RECORD_FIELDS_SQL = '''
+select f.name, t.default_val from files join records t on t.file_id = files.id join names f on f.id = t.field_id
+where files.path in ({}) and t.record_id = (select id from names where name = ?);
 '''
 
 DEL_RECORD_SQL = '''
-delete from records where id in (select id from libs_info where parent_id = ?);
+delete from records where file_id = ?;
+'''
+
+DEL_FOLDER_RECORD_SQL = '''
+delete from records where file_id in ({});
+'''.format(FOLDER_FILES)
+
+CREATE_RECORD_DEF_SQL = '''
+create table if not exists record_defs (
+    file_id int unsigned not null,
+    record_id int unsigned not null,
+    row_num int unsigned not null,
+    definition text not null,
+    primary key (file_id, record_id)
+);
+'''
+
+INSERT_RECORD_DEF_SQL = '''
+replace into record_defs (file_id, record_id, row_num, definition) values (?, ?, ?, ?);
+'''
+
+QUERY_RECORD_POSITION_SQL = '''
+select files.path, t.row_num, t.definition from include_closure c join files on files.path_id = c.path_id join record_defs t on t.file_id = files.id
+where c.file_id = ? and t.record_id = (select id from names where name = ?);
+'''
+
+QUERY_PATHS_RECORD_POSITION_SQL = '''
+select files.path, t.row_num, t.definition from files join record_defs t on t.file_id = files.id
+where files.path in ({}) and t.record_id = (select id from names where name = ?);
+'''
+
+DEL_RECORD_DEF_SQL = '''
+delete from record_defs where file_id = ?;
+'''
+
+DEL_FOLDER_RECORD_DEF_SQL = '''
+delete from record_defs where file_id in ({});
+'''.format(FOLDER_FILES)
+
+CREATE_REFS_SQL = '''
+create table if not exists refs (
+    file_id int unsigned not null,
+    kind tinyint not null,
+    mod_id int unsigned not null,
+    name_id int unsigned not null,
+    param_len int not null,
+    row_num int unsigned not null
+);
+'''
+
+CREATE_REFS_NAME_INDEX_SQL = '''
+create index if not exists refs_name on refs (name_id, mod_id, kind);
 '''
 
+CREATE_REFS_FILE_INDEX_SQL = '''
+create index if not exists refs_file on refs (file_id);
+'''
+
+INSERT_REFS_SQL = '''
+insert into refs (file_id, kind, mod_id, name_id, param_len, row_num) values (?, ?, ?, ?, ?, ?);
+'''
+
+QUERY_REFS_SQL = '''
+select files.path, refs.param_len, refs.row_num from refs join files on files.id = refs.file_id
+where refs.name_id = (select id from names where name = ?) and refs.mod_id = (select id from names where name = ?) and refs.kind = ?;
+'''
+
+DEL_REFS_SQL = '''
+delete from refs where file_id = ?;
+'''
+
+DEL_FOLDER_REFS_SQL = '''
+delete from refs where file_id in ({});
+'''.format(FOLDER_FILES)
+
+CREATE_INDEX_INFO_SQL = '''
+create table if not exists index_info (
+    name varchar(64) not null,
+    value text not null,
+    primary key (name)
+);
+'''
+
+INSERT_INDEX_INFO_SQL = '''
+replace into index_info (name, value) values (?, ?);
+'''
+
+QUERY_INDEX_INFO_SQL = '''
+select value from index_info where name = ?;
+'''
+
+# bump whenever a table definition changes, old index files are dropped on load
+SCHEMA_VERSION = 12
+
+# the name columns of the rows build_module_index returns for libs, includes,
+# defines, records, record_defs and refs, the writer stores their names table ids.
+# The include column holds the resolved path
+NAME_COLUMNS = ((0, 1), (0, ), (0, ), (0, 1), (0, ), (1, 2))
+
+# refs.kind, records and macros are stored with an empty module
+(REF_CALL, REF_RECORD, REF_MACRO) = range(3)
+REF_KINDS = {'call': REF_CALL, 'record': REF_RECORD, 'macro': REF_MACRO}
+
+NO_INDEX = ([], [], [], [], [], [])
+
+# (stream_size, max_size, budget): files over stream_size bytes are scanned in
+# chunks of a memory map, files over max_size or taking longer than budget
+# seconds get their exports only
+DEFAULT_PARSE_LIMITS = (1024 * 1024, 16 * 1024 * 1024, 2.0)
+
+DEGRADED_REASONS = {'size': 'over index_max_file_size', 'budget': 'over index_parse_budget'}
+
+READ_CHUNK_SIZE = 1024 * 1024
+
+# returns (hash, index, degraded), degraded says why a file only got its
+# exports indexed. Call sites are only indexed with references
+def build_module_index(filepath, file_hash = None, limits = DEFAULT_PARSE_LIMITS, references = False):
+    if filepath.endswith('.beam'):
+        return build_beam_index(filepath, file_hash)
+    (stream_size, max_size, budget) = limits
+    size = os.path.getsize(filepath)
+    deadline = time.time() + budget
+    if size > stream_size:
+        symbols = scanner.scan_stream(read_chunks(filepath), file_hash, deadline, size > max_size, references)
+    else:
+        with open(filepath, encoding = 'UTF-8', errors='ignore') as fd:
+            content = fd.read()
+        symbols = scanner.scan(content, file_hash, references, deadline)
+    if symbols == None:
+        return (file_hash, None, None)
+    return (symbols['hash'], index_symbols(filepath, symbols), symbols.get('degraded'))
+
+def index_symbols(filepath, symbols):
+    module = os.path.splitext(os.path.basename(filepath))[0]
+    is_export_all = symbols['export_all']
+    export_fun = symbols['exports']
+    funs = []
+    all_fun = set()
+    for (fun_name, param_len, row_num, params) in symbols['functions']:
+        key = (fun_name, param_len)
+        if key in all_fun or not (is_export_all or key in export_fun):
+            continue
+        all_fun.add(key)
+        funs.append((module, fun_name, param_len, row_num, tran2completion(fun_name, params)))
+
+    includes = {(kind, include) for (kind, include, row_num) in symbols['includes']}
+    defines = []
+    define_names = set()
+    for (define, row_num, text) in symbols['defines']:
+        if define not in define_names:
+            define_names.add(define)
+            defines.append((define, row_num, text))
+
+    records = []
+    record_defs = []
+    record_names = set()
+    for (record, row_num, fields, text) in symbols['records']:
+        if record not in record_names:
+            record_names.add(record)
+            record_defs.append((record, row_num, text))
+            for (field, default_val) in fields:
+                records.append((record, field, default_val))
+
+    # a local call is to the module itself, or to an auto-imported BIF
+    local_funs = {(fun_name, param_len) for (fun_name, param_len, row_num, params) in symbols['functions']}
+    refs = set()
+    for (kind, ref_module, name, param_len, row_num) in symbols['references']:
+        if ref_module == '?MODULE' or (kind == 'call' and ref_module == None and (name, param_len) in local_funs):
+            ref_module = module
+        elif kind == 'call' and ref_module == None:
+            ref_module = 'erlang'
+        refs.add((REF_KINDS[kind], ref_module or '', name, param_len, row_num))
+
+    return (funs, list(includes), defines, records, record_defs, list(refs))
+
+# the first tier of the index, the exported functions of a module without
+# their rows or parameter names. Returns (hash, index, detail), the hash is
+# empty until the second tier, build_module_index, fills in the rest. Beams
+# and export_all modules are indexed whole, headers and files over
+# stream_size bytes get an empty skeleton.
+def build_module_skeleton(filepath, limits = DEFAULT_PARSE_LIMITS, references = False):
+    if filepath.endswith('.beam'):
+        (code_hash, index, degraded) = build_beam_index(filepath)
+        return (code_hash, index, True)
+    if not filepath.endswith('.erl') or os.path.getsize(filepath) > limits[0]:
+        return ('', NO_INDEX, False)
+    with open(filepath, encoding = 'UTF-8', errors='ignore') as fd:
+        content = fd.read()
+    symbols = scanner.scan_exports(content)
+    if symbols['export_all']:
+        symbols = scanner.scan(content, None, references)
+        return (symbols['hash'], index_symbols(filepath, symbols), True)
+    module = os.path.splitext(os.path.basename(filepath))[0]
+    funs = [(module, fun_name, param_len, 0, tran2completion(fun_name, ['Arg{}'.format(i + 1) for i in range(param_len)]))
+        for (fun_name, param_len) in sorted(symbols['exports'])]
+    return ('', (funs, ) + NO_INDEX[1:], False)
+
+def read_chunks(filepath):
+    # the decoded text of a large file piece by piece, it is never held whole
+    decoder = codecs.getincrementaldecoder('UTF-8')(errors = 'ignore')
+    with open(filepath, 'rb') as fd:
+        try:
+            data = mmap.mmap(fd.fileno(), 0, access = mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            data = None
+        try:
+            pos = 0
+            carry = ''
+            while True:
+                chunk = data[pos:pos + READ_CHUNK_SIZE] if data != None else fd.read(READ_CHUNK_SIZE)
+                pos += len(chunk)
+                text = carry + decoder.decode(chunk, chunk == b'')
+                # like text mode, a \r\n split by the chunk is joined in the next one
+                carry = '\r' if text.endswith('\r') and chunk != b'' else ''
+                text = (text[:-1] if carry else text).replace('\r\n', '\n')
+                if text != '':
+                    yield text
+                if chunk == b'':
+                    return
+        finally:
+            if data != None:
+                data.close()
+
+# only the exports, a compiled module has no includes, macros or records left
+def build_beam_index(filepath, file_hash = None):
+    (code_hash, beam) = beam_reader.read_beam(filepath, file_hash)
+    if beam == None:
+        return (code_hash, None, None)
+    (module, exports) = beam
+    funs = [(module, fun_name, param_len, row_num, tran2completion(fun_name, params)) for (fun_name, param_len, row_num, params) in exports]
+    return (code_hash, (funs, ) + NO_INDEX[1:], None)
+
+def tran2completion(funname, params):
+    param_list = ['${{{0}:{1}}}'.format(i + 1, param) for (i, param) in enumerate(params)]
+    param_str = ', '.join(param_list)
+    return '{0}({1})${2}'.format(funname, param_str, len(params) + 1)
+
+# runs in the pool workers, possibly in another process, so it only gets plain
+# arguments and returns plain tuples for the writer
+def parse_file_task(task):
+    (filepath, file_hash, limits, references, skeleton) = task
+    start_time = time.time()
+    try:
+        if skeleton:
+            (code_hash, index, detail) = build_module_skeleton(filepath, limits, references)
+            degraded = None
+        else:
+            (code_hash, index, degraded) = build_module_index(filepath, file_hash, limits, references)
+            detail = True
+    except (OSError, beam_reader.BeamError):
+        return (filepath, None, None, time.time() - start_time, None, False)
+    return (filepath, code_hash, index, time.time() - start_time, degraded, detail)
+
+class IndexWriter:
+    # buffers parsed files and writes them with executemany, one transaction
+    # per batch, so readers only wait for a bounded time and see partial results
+    def __init__(self, cache, max_files = 200, max_rows = 20000, max_delay = 1.0):
+        self.cache = cache
+        self.max_files = max_files
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self.files = []
+        self.rows = 0
+        self.last_flush = time.time()
+        self.lock_time = 0
+        self.batches = 0
+
+    def add(self, filepath, folder_id, fingerprint, code_hash, file_id, index, detail = True):
+        if file_id == None:
+            self.cache.register_app(filepath)
+        if index != None:
+            (funs, includes, defines, records, record_defs, refs) = index
+            includes = list({(self.cache.resolve_include(filepath, kind, include), ) for (kind, include) in includes})
+            index = (funs, includes, defines, records, record_defs, refs)
+        self.files.append((filepath, folder_id, fingerprint, code_hash, file_id, index, detail))
+        if index != None:
+            self.rows += sum(len(rows) for rows in index)
+        if len(self.files) >= self.max_files or self.rows >= self.max_rows or time.time() - self.last_flush >= self.max_delay:
+            self.flush()
+
+    def flush(self):
+        if self.files == []:
+            return
+        cache = self.cache
+        reindex = []
+        file_mods = []
+        changed_paths = []
+        table_rows = ([], [], [], [], [], [])
+        wait_start = time.time()
+        try:
+            cache.lock.acquire(True)
+            start_time = time.time()
+            METRICS.observe('writer.lock_wait', start_time - wait_start)
+            for (filepath, folder_id, (mtime, size), code_hash, file_id, index, detail) in self.files:
+                if file_id == None:
+                    filename = cache.get_filename_from_path(filepath)
+                    cache.db_cur.execute(INSERT_FILE_SQL, (filepath, cache.intern_name(filepath), filename, folder_id, mtime, size, code_hash, detail))
+                    file_id = cache.db_cur.lastrowid
+                    changed_paths.append((filepath, ))
+                else:
+                    cache.db_cur.execute(UPDATE_FILE_SQL, (folder_id, mtime, size, code_hash, detail, file_id))
+                    if index != None:
+                        reindex.append((file_id, ))
+                        cache.db_cur.execute(QUERY_INCLUDE_SQL, (file_id, ))
+                        # a skeleton lost its macros and records too
+                        if not detail or set(cache.db_cur.fetchall()) != {(cache.intern_name(path), ) for (path, ) in index[1]}:
+                            changed_paths.append((filepath, ))
+
+                if index != None:
+                    for (rows, new_rows, columns) in zip(table_rows, index, NAME_COLUMNS):
+                        for row in new_rows:
+                            row = [file_id] + list(row)
+                            for i in columns:
+                                row[i + 1] = cache.intern_name(row[i + 1])
+                            rows.append(row)
+                    file_mods.append((file_id, {row[0] for row in index[0]}))
+
+            for sql in (DEL_LIBS_SQL, DEL_INCLUDE_SQL, DEL_DEFINE_SQL, DEL_RECORD_SQL, DEL_RECORD_DEF_SQL, DEL_REFS_SQL):
+                cache.db_cur.executemany(sql, reindex)
+            for (sql, rows) in zip((INSERT_LIBS_SQL, INSERT_INCLUDE_INFO_SQL, INSERT_DEFINE_SQL, INSERT_RECORD_INFO_SQL, INSERT_RECORD_DEF_SQL, INSERT_REFS_SQL), table_rows):
+                cache.db_cur.executemany(sql, rows)
+            cache.db_cur.executemany(DEL_CLOSURE_SQL, changed_paths)
+            cache.closure_writes += 1
+            cache.db_con.commit()
+            self.lock_time += time.time() - start_time
+            METRICS.observe('writer.lock_held', time.time() - start_time)
+        except Exception:
+            # the next commit would otherwise store part of this batch, the
+            # names it interned are gone with the rollback
+            cache.db_con.rollback()
+            cache.name_ids.clear()
+            raise
+        finally:
+            cache.lock.release()
+
+        METRICS.count('rows_written', sum(len(rows) for rows in table_rows))
+        for (file_id, mod_names) in file_mods:
+            cache.bump_generation(cache.module_index.owners.get(file_id, frozenset()) | mod_names)
+            cache.module_index.set_owner(file_id, mod_names)
+        self.batches += 1
+        self.files = []
+        self.rows = 0
+        self.last_flush = time.time()
+
 class DataCache:
-    def __init__(self, data_type = '', cache_dir = '', dir = None):
+    # a snapshot (the OTP libs of one release) is walked once, later loads
+    # only open the stored index
+    def __init__(self, data_type = '', cache_dir = '', dir = None, fallback = None, snapshot = None):
         self.dir = dir
+        self.snapshot = snapshot
+        self.db_path = None
+        self.fallback = fallback
+        self.app_dirs = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
         self.data_type = data_type
         self.cache_dir = cache_dir
         self.re_dict = GLOBAL_SET['compiled_re']
-        self.pool_size = 8
-        self.folder_id = 1
+        self.checked_folders = set()
+        self.module_index = PrefixIndex()
+        self.completion_cache = LRUCache(get_settings_param('completion_cache_size', 256))
+        self.generation = 0
+        self.mod_generation = {}
+        self.index_generation = 0
+        # writes that may have dropped closures, counted under the lock
+        self.closure_writes = 0
+        self.name_ids = {}
+        self.watcher = None
+        self.walker = DirWalker()
+        self.record_context = RecordContext()
+        self.parse_inline = False
+        self.outline = ViewOutline()
         if cache_dir != '':
             self.__init_db()
 
     def __init_db(self):
-        if os.path.exists(self.cache_dir): 
-            shutil.rmtree(self.cache_dir)
-        self.db_con = sqlite3.connect(':memory:', check_same_thread = False)
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        if self.snapshot != None:
+            self.db_path = os.path.join(self.cache_dir, '{}-{}.db'.format(self.data_type, self.snapshot))
+        else:
+            self.db_path = os.path.join(self.cache_dir, '{}.db'.format(self.data_type))
+        self.db_con = self.__open_db(self.db_path)
         self.db_cur = self.db_con.cursor()
+        # readers get their own connections and see the last committed batch
+        # while the writer keeps appending to the write-ahead log
+        self.db_cur.execute('pragma journal_mode = wal')
+        self.db_cur.execute('pragma synchronous = normal')
         self.db_cur.execute(CREATE_LIBS_INFO_SQL)
+        self.db_cur.execute(CREATE_LIBS_INFO_FOLDER_INDEX_SQL)
+        self.db_cur.execute(CREATE_LIBS_INFO_PARENT_INDEX_SQL)
+        self.db_cur.execute(CREATE_NAMES_SQL)
         self.db_cur.execute(CREATE_LIBS_SQL)
+        self.db_cur.execute(CREATE_LIBS_MOD_INDEX_SQL)
         self.db_cur.execute(CREATE_INCLUDE_SQL)
         self.db_cur.execute(CREATE_DEFINE_SQL)
         self.db_cur.execute(CREATE_RECORD_INFO_SQL)
+        self.db_cur.execute(CREATE_RECORD_DEF_SQL)
+        self.db_cur.execute(CREATE_REFS_SQL)
+        self.db_cur.execute(CREATE_REFS_NAME_INDEX_SQL)
+        self.db_cur.execute(CREATE_REFS_FILE_INDEX_SQL)
+        self.db_cur.execute(CREATE_FILES_SQL)
+        self.db_cur.execute(CREATE_FILES_FOLDER_INDEX_SQL)
+        self.db_cur.execute(CREATE_FILES_PATH_ID_INDEX_SQL)
+        self.db_cur.execute(CREATE_FILES_DETAIL_INDEX_SQL)
+        self.db_cur.execute(CREATE_CLOSURE_SQL)
+        self.db_cur.execute(CREATE_CLOSURE_PATH_INDEX_SQL)
+        self.db_cur.execute(CREATE_INDEX_INFO_SQL)
+        self.db_cur.execute('pragma user_version = {}'.format(SCHEMA_VERSION))
+        # the rows of a file tell nothing about whether its call sites were
+        # left out, a changed index_references needs every file parsed again
+        references = str(int(self.index_references()))
+        self.db_cur.execute(QUERY_INDEX_INFO_SQL, ('references', ))
+        if self.db_cur.fetchone() not in (None, (references, )):
+            self.db_cur.execute(RESET_FILES_SQL)
+        self.db_cur.execute(INSERT_INDEX_INFO_SQL, ('references', references))
+        self.db_con.commit()
 
-    def query_mod_fun(self, module):
-        query_data = []
+        self.load_module_index()
+        self.db_cur.execute(QUERY_ALL_PATHS_SQL)
+        for (filepath, ) in self.db_cur.fetchall():
+            self.register_app(filepath)
+
+    # the id of name in the names table, only called with the lock held
+    def intern_name(self, name):
+        name_id = self.name_ids.get(name)
+        if name_id == None:
+            self.db_cur.execute(INSERT_NAME_SQL, (name, ))
+            self.db_cur.execute(QUERY_NAME_ID_SQL, (name, ))
+            (name_id, ) = self.db_cur.fetchone()
+            self.name_ids[name] = name_id
+        return name_id
+
+    def load_module_index(self):
+        self.db_cur.execute(QUERY_FILE_MODS)
+        file_mods = {}
+        for (file_id, mod_name) in self.db_cur.fetchall():
+            file_mods.setdefault(file_id, set()).add(mod_name)
+        self.module_index.clear()
+        for (file_id, mod_names) in file_mods.items():
+            self.module_index.set_owner(file_id, mod_names)
+
+    def __open_db(self, db_path):
         try:
-            self.lock.acquire(True)
-            self.db_cur.execute(QUERY_COMPLETION, (module, ))
-            query_data = self.db_cur.fetchall()
-        finally:
-            self.lock.release()
+            db_con = sqlite3.connect(db_path, check_same_thread = False)
+            (version, ) = db_con.execute('pragma user_version').fetchone()
+            if version == SCHEMA_VERSION or version == 0:
+                return db_con
+            db_con.close()
+        except sqlite3.DatabaseError:
+            pass
+
+        print('drop {} index {}, schema changed'.format(self.data_type, db_path))
+        if os.path.exists(db_path):
+            os.remove(db_path)
+        return sqlite3.connect(db_path, check_same_thread = False)
+
+    def db_query(self, sql, params = ()):
+        db_con = getattr(self.local, 'db_con', None)
+        if db_con == None:
+            if self.db_path == None:
+                return []
+            db_con = sqlite3.connect(self.db_path)
+            self.local.db_con = db_con
+        return db_con.execute(sql, params).fetchall()
+
+    @METRICS.timed('query.query_mod_fun')
+    def query_mod_fun(self, module):
+        key = (module, self.generation, self.mod_generation.get(module, 0))
+        completion_data = self.completion_cache.get(key)
+        if completion_data != None:
+            return completion_data
+
+        query_data = self.db_query(QUERY_COMPLETION, (module, ))
 
         completion_data = []
-        all_fun = []
-        for (fun_name, param_len, param_str) in query_data:
+        all_fun = set()
+        for (fun_name, param_len, completion) in query_data:
             if (fun_name, param_len) not in all_fun:
-                param_list = self.format_param(param_str)
-                completion = self.__tran2compeletion(fun_name, param_list, param_len)
                 completion_data.append(['{}/{}\tMethod'.format(fun_name, param_len), completion])
-                all_fun.append((fun_name, param_len))
+                all_fun.add((fun_name, param_len))
 
+        self.completion_cache.put(key, completion_data)
         return completion_data
 
+    def bump_generation(self, modules = None):
+        # any write, for caches that can not tell which rows they depend on
+        self.index_generation += 1
+        if modules == None:
+            self.generation += 1
+            self.completion_cache.clear()
+            return
+        for module in modules:
+            self.mod_generation[module] = self.mod_generation.get(module, 0) + 1
+
+    @METRICS.timed('query.query_all_mod')
     def query_all_mod(self):
-        query_data = []
-        try:
-            self.lock.acquire(True)
-            self.db_cur.execute(QUERY_ALL_MOD)
-            query_data = self.db_cur.fetchall()
-        finally:
-            self.lock.release()
+        query_data = self.db_query(QUERY_ALL_MOD)
 
         completion_data = []
         for (mod_name, ) in query_data:
@@ -202,59 +834,57 @@ class DataCache:
 
         return completion_data
 
+    @METRICS.timed('query.query_module_prefix')
+    def query_module_prefix(self, prefix, limit):
+        return self.module_index.query(prefix, limit)
+
+    @METRICS.timed('query.query_fun_prefix')
+    def query_fun_prefix(self, module, prefix, limit):
+        completion_data = [completion for completion in self.query_mod_fun(module) if completion[0].startswith(prefix)]
+        completion_data.sort(key = lambda completion: len(completion[0]))
+        return completion_data[:limit]
+
+    def touch_module(self, module):
+        self.module_index.touch(module)
+
+    @METRICS.timed('query.query_fun_position')
     def query_fun_position(self, module, function):
-        query_data = []
-        try:
-            self.lock.acquire(True)
-            self.db_cur.execute(QUERY_POSITION, (module, function))
-            query_data = self.db_cur.fetchall()
-        finally:
-            self.lock.release()
+        query_data = self.db_query(QUERY_POSITION, (module, function))
+        # rows of a skeleton have no row number yet
+        deadline = self.detail_deadline()
+        if any([self.ensure_detail(filepath, deadline) for (filepath, fun_name, param_len, row_num) in query_data]):
+            query_data = self.db_query(QUERY_POSITION, (module, function))
 
         completion_data = []
-        for (folder, fun_name, param_len, row_num) in query_data:
-            filepath = os.path.join(folder, module + '.erl')
-            completion_data.append(('{}/{}'.format(fun_name, param_len), filepath, row_num))
+        for (filepath, fun_name, param_len, row_num) in query_data:
+            if filepath.endswith('.beam'):
+                filepath = beam_reader.beam_source_path(filepath)
+            completion = ('{}/{}'.format(fun_name, param_len), filepath, row_num)
+            # a source next to its beam can be indexed twice, e.g. in a src subdirectory
+            if completion not in completion_data:
+                completion_data.append(completion)
 
         return completion_data
 
+    @METRICS.timed('query.query_file_defines')
     def query_file_defines(self, filepath):
-        filename = self.get_filename_from_path(filepath)
-        query_data = []
-        try:
-            self.lock.acquire(True)
-            self.db_cur.execute(QUERY_DEFINE_SQL, (filename, ))
-            query_data = self.db_cur.fetchall()
-        finally:
-            self.lock.release()
+        query_data = self.query_include_closure(filepath, QUERY_DEFINE_SQL, QUERY_PATHS_DEFINE_SQL)
         completion_data = []
         for (define, ) in query_data:
             completion_data.append([('{0}\tdefine').format(define), ('{0}${1}').format(define,1)])
         return completion_data
 
+    @METRICS.timed('query.query_file_record')
     def query_file_record(self, filepath):
-        filename = self.get_filename_from_path(filepath)
-        query_data = []
-        try:
-            self.lock.acquire(True)
-            self.db_cur.execute(QUERY_RECORD_SQL, (filename, ))
-            query_data = self.db_cur.fetchall()
-        finally:
-            self.lock.release()
+        query_data = self.query_include_closure(filepath, QUERY_RECORD_SQL, QUERY_PATHS_RECORD_SQL)
         completion_data = []
         for (record, ) in query_data:
             completion_data.append([('{0}\trecord').format(record), ('{0}${1}').format(record,1)])
         return completion_data
 
+    @METRICS.timed('query.query_record_fields')
     def query_record_fields(self, filepath, record, need_show_equal):
-        filename = self.get_filename_from_path(filepath)
-        query_data = []
-        try:
-            self.lock.acquire(True)
-            self.db_cur.execute(QUERY_RECORD_FIELDS_SQL, (filename, record, ))
-            query_data = self.db_cur.fetchall()
-        finally:
-            self.lock.release()
+        query_data = self.query_include_closure(filepath, QUERY_RECORD_FIELDS_SQL, QUERY_PATHS_RECORD_FIELDS_SQL, (record, ))
         completion_data = []
         for (field, default_val) in query_data:
             if need_show_equal:
@@ -263,62 +893,164 @@ class DataCache:
                 completion_data.append([('{0}\tfield').format(field), ('{0}').format(field)])
         return completion_data
 
-    def build_module_index(self, filepath, folder_id):
-        with open(filepath, encoding = 'UTF-8', errors='ignore') as fd:
-            content = fd.read()
-            code = re.sub(self.re_dict['comment'], '\n', content)
-
-            export_fun = {}
-            is_export_all = self.re_dict['export_all'].search(code)
-            if not is_export_all:
-                for export_match in self.re_dict['export'].finditer(code):
-                    for funname_match in self.re_dict['funname'].finditer(export_match.group()):
-                        [name, cnt] = funname_match.group().split('/')
-                        export_fun[(name, int(cnt))] = None
-            module = self.get_module_from_path(filepath)
-            filename = self.get_filename_from_path(filepath)
-
-            row_num = 1
-            includes = []
-            defines = []
-            for line in code.split('\n'):
-                funhead = self.re_dict['funline'].search(line)
-                if funhead is not None: 
-                    fun_name = funhead.group(1)
-                    param_str = funhead.group(2)
-                    param_list = self.format_param(param_str)
-                    param_len = len(param_list)
-                    if (fun_name, param_len) in export_fun or is_export_all != None:
-                        if is_export_all == None:
-                            del(export_fun[(fun_name, param_len)])
-                        self.db_execute(INSERT_LIBS_SQL, (folder_id, module, fun_name, param_len, row_num, param_str))
-                else:
-                    includehead = self.re_dict['take_include'].search(line)
-                    if includehead is not None:
-                        includefile = includehead.group(1)
-                        if includefile not in includes:
-                            self.db_execute(INSERT_INCLUDE_INFO_SQL, (folder_id, filename, includefile))
-                    else:
-                        definehead = self.re_dict['defineline'].search(line)
-                        if definehead is not None:
-                            define = definehead.group(1)
-                            if define not in defines:
-                                self.db_execute(INSERT_DEFINE_SQL, (folder_id, filename, define))
-                row_num += 1
-
-            records = []
-            records_match = self.re_dict['record_re'].findall(code)
-            for (record, fields_data) in records_match:
-                if record not in records:
-                    records.append(record)
-                    fields_match = self.re_dict['record_field_re'].findall(fields_data)
-                    for (field, default_val) in fields_match:
-                        self.db_execute(INSERT_RECORD_INFO_SQL,(folder_id, filename, record, field, default_val))
+    # call sites of module:function (any arity), or uses of a record or macro
+    # when kind is 'record' or 'macro' and module is empty
+    @METRICS.timed('query.query_references')
+    def query_references(self, kind, module, name):
+        query_data = self.db_query(QUERY_REFS_SQL, (name, module, REF_KINDS[kind]))
+        completion_data = []
+        for (filepath, param_len, row_num) in sorted(query_data):
+            if kind == 'call':
+                label = '{}:{}/{}'.format(module, name, param_len)
+            else:
+                label = '{}{}'.format('#' if kind == 'record' else '?', name)
+            completion_data.append((label, filepath, row_num))
+        return completion_data
+
+    @METRICS.timed('query.query_define_position')
+    def query_define_position(self, filepath, define):
+        return self.query_definition(filepath, QUERY_DEFINE_POSITION_SQL, QUERY_PATHS_DEFINE_POSITION_SQL, define)
+
+    @METRICS.timed('query.query_record_position')
+    def query_record_position(self, filepath, record):
+        return self.query_definition(filepath, QUERY_RECORD_POSITION_SQL, QUERY_PATHS_RECORD_POSITION_SQL, record)
+
+    def query_definition(self, filepath, sql, paths_sql, name):
+        query_data = self.query_include_closure(filepath, sql, paths_sql, (name, ))
+        # the file's own definition first, like the preprocessor would see it
+        return sorted(query_data, key = lambda row: (row[0] != filepath, row[0], row[1]))
+
+    def query_include_closure(self, filepath, sql, paths_sql, params = ()):
+        (file_id, closure) = self.get_include_closure(filepath)
+        if file_id == None:
+            return []
+        if closure != None:
+            query_data = self.query_paths(paths_sql, closure, params)
+            external_paths = closure
+        else:
+            query_data = self.db_query(sql, (file_id, ) + params)
+            external_paths = [path for (path, ) in self.db_query(QUERY_EXTERNAL_CLOSURE_SQL, (file_id, ))]
+        if external_paths != [] and self.fallback != None:
+            query_data += self.fallback.query_paths(paths_sql, external_paths, params)
+        return query_data
+
+    def query_paths(self, paths_sql, paths, params = ()):
+        query_data = []
+        # stay below sqlite's limit of host parameters per statement
+        for i in range(0, len(paths), 500):
+            chunk = paths[i:i + 500]
+            query_data += self.db_query(paths_sql.format(', '.join('?' * len(chunk))), tuple(chunk) + params)
+        return query_data
+
+    # returns (file_id, None) when the closure is already stored, otherwise the
+    # freshly computed closure so the caller can query it without waiting for
+    # the writer to store it
+    def get_include_closure(self, filepath):
+        deadline = self.detail_deadline()
+        self.ensure_detail(filepath, deadline)
+        file_info = self.get_file_info(filepath)
+        if file_info == None:
+            return (None, None)
+        file_id = file_info[0]
+        if self.db_query(HAS_CLOSURE_SQL, (file_id, )) != []:
+            return (file_id, None)
+
+        closure_writes = self.closure_writes
+        closure = [filepath]
+        visited = {filepath}
+        for path in closure:
+            includes = self.get_path_includes(path, deadline)
+            if includes == None and self.fallback != None:
+                includes = self.fallback.get_path_includes(path, deadline)
+            for include in includes or []:
+                if include not in visited:
+                    visited.add(include)
+                    closure.append(include)
+
+        # an include edge written since the closure was read may already have
+        # dropped the stored closures it is part of, this one would outlive it
+        if self.lock.acquire(False):
+            try:
+                if self.closure_writes == closure_writes:
+                    self.db_cur.executemany(INSERT_CLOSURE_SQL, [(file_id, self.intern_name(path)) for path in closure])
+                    self.db_con.commit()
+            finally:
+                self.lock.release()
+        return (file_id, closure)
+
+    def get_path_includes(self, filepath, deadline):
+        if self.get_file_info(filepath) == None:
+            return None
+        self.ensure_detail(filepath, deadline)
+        return [include for (include, ) in self.db_query(QUERY_PATH_INCLUDE_SQL, (filepath, ))]
+
+    def register_app(self, filepath):
+        app = get_app_from_path(filepath)
+        if app != None:
+            self.app_dirs.setdefault(app[0], app[1])
+
+    def get_app_dir(self, app_name):
+        app_dir = self.app_dirs.get(app_name)
+        if app_dir == None and self.fallback != None:
+            app_dir = self.fallback.app_dirs.get(app_name)
+        return app_dir
+
+    def resolve_include(self, filepath, kind, include):
+        # same search order as epp: the including file's directory, the app's
+        # include directory, then for include_lib the named application
+        directory = os.path.dirname(filepath)
+        candidates = [os.path.join(directory, include)]
+        app = get_app_from_path(filepath)
+        if app != None:
+            candidates.append(os.path.join(app[1], 'include', include))
+        if kind == 'include_lib':
+            parts = include.replace('\\', '/').split('/', 1)
+            app_dir = len(parts) == 2 and self.get_app_dir(parts[0])
+            if app_dir:
+                candidates.append(os.path.join(app_dir, parts[1]))
+        for candidate in candidates:
+            if os.path.exists(candidate):
+                return os.path.normpath(candidate)
+        return os.path.normpath(candidates[-1])
+
+    def build_module_index(self, filepath, file_hash = None):
+        return build_module_index(filepath, file_hash, self.get_parse_limits(), self.index_references())
+
+    # OTP sources are never a find references target
+    def index_references(self):
+        return self.data_type != 'libs' and get_settings_param('index_references', True)
+
+    # parses a file indexed by its skeleton only, for a query that needs the
+    # rest of it now rather than when the second tier gets to it. The parse
+    # runs on the scheduler like every write, the query waits for it until
+    # deadline and otherwise makes do with the skeleton
+    def ensure_detail(self, filepath, deadline):
+        for (detail, ) in self.db_query(QUERY_FILE_DETAIL_SQL, (filepath, )):
+            if not detail:
+                METRICS.count('details_on_demand')
+                return SCHEDULER.call(('file', self.data_type, filepath), PRIORITY_FILE,
+                    max(0, deadline - time.time()), self.index_file, filepath)
+        return False
+
+    # one deadline for all the files a query needs. The UI thread never waits
+    # for the indexer, it answers from what is indexed; hover workers and the
+    # daemon's handlers wait up to index_detail_wait seconds
+    def detail_deadline(self):
+        if threading.current_thread().name == 'MainThread':
+            return time.time()
+        return time.time() + get_settings_param('index_detail_wait', 1.0)
+
+    def get_parse_limits(self):
+        (stream_size, max_size, budget) = DEFAULT_PARSE_LIMITS
+        return (get_settings_param('index_stream_size', stream_size),
+            get_settings_param('index_max_file_size', max_size),
+            get_settings_param('index_parse_budget', budget))
 
     def db_execute(self, sql, params):
         try:
             self.lock.acquire(True)
             self.db_cur.execute(sql, params)
+            self.db_con.commit()
         finally:
             self.lock.release()
 
@@ -331,29 +1063,18 @@ class DataCache:
         (path, filename) = os.path.split(filepath)
         return filename
 
-    def format_param(self, param_str):
-        param_str = re.sub(self.re_dict['special_param'], 'Param', param_str)
-        param_str = re.sub(self.re_dict['='], '', param_str)
-
-        if param_str == '' or re.match('\s+', param_str):
-            return []
-        else:
-            return re.split(',\s*', param_str)
-
-    def __tran2compeletion(self, funname, params, len):
-        param_list = ['${{{0}:{1}}}'.format(i + 1, params[i]) for i in range(len)]
-        param_str = ', '.join(param_list)
-        completion = '{0}({1})${2}'.format(funname, param_str, len + 1)
-        return completion
-
     def build_data(self):
+        if self.snapshot != None and self.db_query(QUERY_INDEX_INFO_SQL, ('complete', )) != []:
+            print('load {} index {}'.format(self.data_type, self.snapshot))
+            self.checked_folders.update(self.dir)
+            return
         self.build_dir_data(self.dir)
+        if self.snapshot != None:
+            self.db_execute(INSERT_INDEX_INFO_SQL, ('complete', '1'))
 
     def build_dir_data(self, dirpath):
-        all_filepath = []
+        all_filepath = {}
         start_time = time.time()
-        task_pool = ThreadPool(self.pool_size)
-        self.lock = threading.Lock()
 
         if dirpath == None:
             folders = self.get_all_open_folders()
@@ -362,28 +1083,297 @@ class DataCache:
 
         is_save_build_index = False
         for folder in folders:
-            if self.get_folder_id(folder) != None:
+            if folder in self.checked_folders or SCHEDULER.cancelled(folder):
                 continue
+            self.checked_folders.add(folder)
+            # watch before walking, so edits made during the walk are picked up
+            if self.watcher != None:
+                self.watcher.watch(folder)
 
-            print('build {}: {} index'.format(self.data_type, folder))
-            is_save_build_index = True
-            self.db_cur.execute(INSERT_FOLDER_INFO, (self.folder_id, 0, folder))
-            parent_id = self.folder_id
-            for root, dirs, files in os.walk(folder):
-                erl_files = fnmatch.filter(files, '*.[e|h]rl')
+            folder_info = self.get_folder_id(folder)
+            if folder_info == None:
+                print('build {}: {} index'.format(self.data_type, folder))
+                parent_id = self.insert_folder(folder, 0)
+                old_files = {}
+            else:
+                print('check {}: {} index'.format(self.data_type, folder))
+                parent_id = folder_info[0]
+                old_files = self.get_folder_files(parent_id)
+
+            walk_start = time.time()
+            walked = self.walker.walk(folder)
+            METRICS.observe('walk', time.time() - walk_start)
+            METRICS.count('dirs_walked', len(walked))
+            for (root, files) in walked:
+                erl_files = self.filter_index_files(root, files)
                 if erl_files == []:
                     continue
-                    
-                if folder != root:
-                    self.folder_id += 1
-                    self.db_cur.execute(INSERT_FOLDER_INFO, (self.folder_id, parent_id, root))
+
+                folder_id = self.get_sub_folder_id(root, folder, parent_id)
                 for file in erl_files:
-                    all_filepath.append((os.path.join(root, file), self.folder_id))
-                self.folder_id += 1
-        
-        task_pool.starmap(self.build_module_index, all_filepath)
-        self.db_con.commit()
-        is_save_build_index and print("build {} index, use {} second".format(self.data_type, time.time() - start_time))
+                    filepath = os.path.join(root, file)
+                    self.register_app(filepath)
+                    fingerprint = self.get_fingerprint(filepath)
+                    file_info = old_files.pop(filepath, (None, None, None, None, None))
+                    (file_id, old_folder_id, mtime, size, file_hash) = file_info
+                    if fingerprint == None or (old_folder_id, mtime, size) == (folder_id, ) + fingerprint:
+                        METRICS.count('files_unchanged')
+                        continue
+                    all_filepath[filepath] = (folder_id, fingerprint, file_id, file_hash)
+                    is_save_build_index = True
+
+            for (filepath, (file_id, folder_id, mtime, size, file_hash)) in old_files.items():
+                self.delete_file_index(file_id, filepath)
+                is_save_build_index = True
+
+        # modules and exports of new files first, completion works while the
+        # rest is parsed. Indexed files keep their rows until the one-pass
+        # parse, which skips them when their content hash is unchanged
+        new_filepath = {filepath: info for (filepath, info) in all_filepath.items() if info[2] == None}
+        old_filepath = {filepath: info for (filepath, info) in all_filepath.items() if info[2] != None}
+        writer = self.index_files(new_filepath, get_settings_param('index_lazy_detail', True))
+        old_writer = self.index_files(old_filepath)
+        (lock_time, batches) = (writer.lock_time + old_writer.lock_time, writer.batches + old_writer.batches)
+        METRICS.build(self.data_type, len(all_filepath), time.time() - start_time, lock_time, batches)
+        is_save_build_index and print("build {} index, {} files, use {} second, lock held {} second in {} batches".format(
+            self.data_type, len(all_filepath), time.time() - start_time, lock_time, batches))
+        self.index_details()
+
+    def index_files(self, all_filepath, skeleton = False):
+        writer = IndexWriter(self)
+        if all_filepath != {}:
+            self.parse_files(all_filepath, writer, skeleton)
+        writer.flush()
+        return writer
+
+    # the second tier, every file only indexed by its skeleton so far
+    def index_details(self):
+        start_time = time.time()
+        all_filepath = {}
+        for (filepath, file_id, folder_id, file_hash) in self.db_query(QUERY_SKELETON_FILES_SQL):
+            fingerprint = self.get_fingerprint(filepath)
+            if fingerprint != None:
+                all_filepath[filepath] = (folder_id, fingerprint, file_id, file_hash)
+        if all_filepath == {}:
+            return
+        writer = self.index_files(all_filepath)
+        METRICS.build('{} details'.format(self.data_type), len(all_filepath), time.time() - start_time, writer.lock_time, writer.batches)
+        print("build {} index details, {} files, use {} second, lock held {} second in {} batches".format(
+            self.data_type, len(all_filepath), time.time() - start_time, writer.lock_time, writer.batches))
+
+    def refresh_files(self, paths):
+        start_time = time.time()
+        candidates = set()
+        for path in paths:
+            folder = self.get_top_folder(path)
+            if folder != None and os.path.isdir(path):
+                for (root, files) in self.walker.walk_path(folder, path):
+                    candidates.update(os.path.join(root, file) for file in self.filter_index_files(root, files))
+            elif folder != None and self.walker.accepts(folder, path) and self.filter_index_files(os.path.dirname(path), [os.path.basename(path)]) != []:
+                candidates.add(path)
+            # indexed files below a directory that was removed or renamed
+            prefix = os.path.join(path, '')
+            candidates.update(filepath for (filepath, ) in self.db_query(QUERY_PATH_PREFIX_SQL, (prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1))))
+
+        all_filepath = {}
+        deleted = 0
+        for filepath in candidates:
+            folder = self.get_top_folder(filepath)
+            if folder == None:
+                continue
+            (file_id, old_folder_id, mtime, size, file_hash) = self.get_file_info(filepath) or (None, None, None, None, None)
+            fingerprint = self.get_fingerprint(filepath)
+            # gone, or now excluded from the walk
+            if fingerprint == None or not self.walker.accepts(folder, filepath):
+                if file_id != None:
+                    self.delete_file_index(file_id, filepath)
+                    deleted += 1
+                continue
+            (parent_id, _) = self.get_folder_id(folder)
+            folder_id = self.get_sub_folder_id(os.path.dirname(filepath), folder, parent_id)
+            if (old_folder_id, mtime, size) == (folder_id, ) + fingerprint:
+                continue
+            self.register_app(filepath)
+            all_filepath[filepath] = (folder_id, fingerprint, file_id, file_hash)
+
+        self.index_files(all_filepath)
+        if all_filepath != {} or deleted > 0:
+            print("refresh {} index, {} changed, {} deleted, use {} second".format(
+                self.data_type, len(all_filepath), deleted, time.time() - start_time))
+
+    def filter_index_files(self, root, files):
+        if self.is_beam_dir(root):
+            return fnmatch.filter(files, '*.beam')
+        return [file for file in fnmatch.filter(files, '*.[e|h]rl') if not self.has_beam(os.path.join(root, file))]
+
+    def is_beam_dir(self, root):
+        # the ebin of an OTP application or of a rebar3 dependency, a project's
+        # own apps are read from source, rebar3 links their src into _build
+        if os.path.basename(root) != 'ebin' or not get_settings_param('index_beams', True):
+            return False
+        app_dir = os.path.dirname(root)
+        if os.path.islink(os.path.join(app_dir, 'src')):
+            return False
+        if self.data_type == 'libs':
+            return True
+        build_dir = os.path.dirname(os.path.dirname(os.path.dirname(app_dir)))
+        return os.path.basename(build_dir) == '_build' and os.path.basename(os.path.dirname(app_dir)) == 'lib'
+
+    def has_beam(self, filepath):
+        # sources are only parsed where the compiled module is missing
+        if not filepath.endswith('.erl'):
+            return False
+        app = get_app_from_path(filepath)
+        if app == None:
+            return False
+        ebin_dir = os.path.join(app[1], 'ebin')
+        return os.path.exists(os.path.join(ebin_dir, self.get_module_from_path(filepath) + '.beam')) and self.is_beam_dir(ebin_dir)
+
+    def get_top_folder(self, filepath):
+        # the longest indexed folder containing filepath
+        top_folder = None
+        for folder in list(self.checked_folders):
+            if filepath.startswith(os.path.join(folder, '')) and (top_folder == None or len(folder) > len(top_folder)):
+                top_folder = folder
+        if top_folder == None or self.get_folder_id(top_folder) == None:
+            return None
+        return top_folder
+
+    def start_watching(self):
+        if not get_settings_param('watch_folders', True):
+            return
+        self.watcher = FolderWatcher(self.refresh_files_async, self.walker.walk_dirs,
+            debounce = get_settings_param('watch_debounce', 0.5),
+            poll_interval = get_settings_param('watch_poll_interval', 5.0))
+        self.watcher.start()
+        for folder in list(self.checked_folders):
+            self.watcher.watch(folder)
+
+    def stop_watching(self):
+        if self.watcher != None:
+            self.watcher.stop()
+            self.watcher = None
+
+    def parse_files(self, all_filepath, writer, skeleton = False):
+        limits = self.get_parse_limits()
+        references = self.index_references()
+        ranks = SCHEDULER.rank(list(all_filepath))
+        tasks = [(filepath, file_hash, limits, references, skeleton) for (filepath, (folder_id, fingerprint, file_id, file_hash)) in all_filepath.items()]
+        tasks.sort(key = lambda task: ranks[task[0]])
+        if self.parse_inline:
+            # a profiler only sees the thread it runs in
+            (task_pool, pool_size) = (None, 1)
+        else:
+            (task_pool, pool_size) = self.create_pool()
+        # parsed a slice at a time, between slices the build can be cancelled or throttled
+        slice_size = pool_size * 16
+        chunksize = max(1, min(64, slice_size // (pool_size * 8)))
+        label = 'Erlang {} {}'.format(self.data_type, 'modules' if skeleton else 'index')
+        try:
+            for i in range(0, len(tasks), slice_size):
+                slice_tasks = [task for task in tasks[i:i + slice_size] if not SCHEDULER.cancelled(task[0])]
+                METRICS.count('files_cancelled', min(slice_size, len(tasks) - i) - len(slice_tasks))
+                start_time = time.time()
+                if task_pool == None:
+                    self.write_parsed(all_filepath, writer, map(parse_file_task, slice_tasks))
+                else:
+                    self.write_parsed(all_filepath, writer, task_pool.imap_unordered(parse_file_task, slice_tasks, chunksize))
+                if not self.parse_inline:
+                    # a profiled build is neither the index in progress nor
+                    # slowed down, its time would count sleeping
+                    SCHEDULER.progress(label, min(i + slice_size, len(tasks)), len(tasks))
+                    SCHEDULER.throttle(time.time() - start_time)
+                SCHEDULER.run_urgent()
+        finally:
+            if task_pool != None:
+                task_pool.close()
+                task_pool.join()
+
+    def write_parsed(self, all_filepath, writer, results):
+        for (filepath, code_hash, index, parse_time, degraded, detail) in results:
+            METRICS.parsed(filepath, parse_time, code_hash, index)
+            self.report_degraded(filepath, degraded)
+            if code_hash == None:
+                continue
+            # rows of a removed folder would outlive its delete
+            if SCHEDULER.cancelled(filepath):
+                METRICS.count('files_cancelled')
+                continue
+            (folder_id, fingerprint, file_id, file_hash) = all_filepath[filepath]
+            writer.add(filepath, folder_id, fingerprint, code_hash, file_id, index, detail)
+
+    def report_degraded(self, filepath, degraded):
+        if degraded == None:
+            return
+        METRICS.degraded(filepath, degraded)
+        print('index {} exports only, {}: {}'.format(self.data_type, DEGRADED_REASONS[degraded], filepath))
+
+    def create_pool(self):
+        pool_size = get_settings_param('index_pool_size', None) or multiprocessing.cpu_count()
+        parse_mode = get_settings_param('index_parse_mode', 'thread')
+        # worker processes are forked from the plugin host, spawning them would
+        # need to import this package outside of sublime. The default start
+        # method is spawn on macOS since Python 3.8, fork is asked for by name
+        if parse_mode == 'process' and sys.platform != 'win32':
+            try:
+                context = multiprocessing.get_context('fork') if hasattr(multiprocessing, 'get_context') else multiprocessing
+                return (context.Pool(pool_size), pool_size)
+            except (OSError, ValueError) as e:
+                print('start {} index processes failed, use threads: {}'.format(self.data_type, e))
+        return (ThreadPool(pool_size), pool_size)
+
+    def delete_file_index(self, file_id, filepath):
+        try:
+            self.lock.acquire(True)
+            self.db_cur.execute(DEL_CLOSURE_SQL, (filepath, ))
+            self.closure_writes += 1
+            self.db_cur.execute(DEL_LIBS_SQL, (file_id, ))
+            self.db_cur.execute(DEL_INCLUDE_SQL, (file_id, ))
+            self.db_cur.execute(DEL_DEFINE_SQL, (file_id, ))
+            self.db_cur.execute(DEL_RECORD_SQL, (file_id, ))
+            self.db_cur.execute(DEL_RECORD_DEF_SQL, (file_id, ))
+            self.db_cur.execute(DEL_REFS_SQL, (file_id, ))
+            self.db_cur.execute(DEL_FILE_SQL, (file_id, ))
+            self.db_con.commit()
+        finally:
+            self.lock.release()
+        self.bump_generation(self.module_index.owners.get(file_id, ()))
+        self.module_index.remove_owner(file_id)
+
+    def get_fingerprint(self, filepath):
+        try:
+            stat = os.stat(filepath)
+        except OSError:
+            return None
+        return (stat.st_mtime, stat.st_size)
+
+    def get_folder_files(self, parent_id):
+        result = self.db_query(QUERY_FOLDER_FILES_SQL, (parent_id, parent_id))
+
+        return {row[0]: row[1:] for row in result}
+
+    def get_sub_folder_id(self, root, folder, parent_id):
+        if root == folder:
+            return parent_id
+        folder_info = self.get_folder_id(root)
+        if folder_info != None:
+            return folder_info[0]
+        return self.insert_folder(root, parent_id)
+
+    def insert_folder(self, folder, parent_id):
+        # ids come from sqlite, another editor instance may share the file
+        try:
+            self.lock.acquire(True)
+            self.db_cur.execute(QUERY_FOLDER, (folder, ))
+            folder_info = self.db_cur.fetchone()
+            if folder_info != None:
+                return folder_info[0]
+            self.db_cur.execute(INSERT_FOLDER_INFO, (parent_id, folder))
+            folder_id = self.db_cur.lastrowid
+            self.db_con.commit()
+            return folder_id
+        finally:
+            self.lock.release()
 
     def get_all_open_folders(self):
         all_folders = []
@@ -393,13 +1383,7 @@ class DataCache:
         return all_folders
 
     def get_folder_id(self, folder):
-        result = None
-        try:
-            self.lock.acquire(True)
-            self.db_cur.execute(QUERY_FOLDER, (folder, ))
-            result = self.db_cur.fetchall()
-        finally:
-            self.lock.release()
+        result = self.db_query(QUERY_FOLDER, (folder, ))
 
         if result is None:
             return None
@@ -407,93 +1391,141 @@ class DataCache:
             return (fid, pid)
 
 
+    def get_file_info(self, filepath):
+        for file_info in self.db_query(QUERY_FILE_SQL, (filepath, )):
+            return file_info
+
     def rebuild_module_index(self, filepath):
+        SCHEDULER.submit(('file', self.data_type, filepath), PRIORITY_FILE, self.index_file, filepath)
+
+    # a saved file, or the details of a skeleton, only run by the scheduler
+    def index_file(self, filepath):
         (folder, filename) = os.path.split(filepath)
-        (module, extension) = os.path.splitext(filename)
-        get_fid_return = self.get_folder_id(folder)
-        if get_fid_return == None:
-            self.build_dir_data([folder])
+        folder_info = self.get_folder_id(folder)
+        top_folder = self.get_top_folder(filepath)
+        if folder_info != None:
+            fid = folder_info[0]
+        elif top_folder != None:
+            fid = self.get_sub_folder_id(folder, top_folder, self.get_folder_id(top_folder)[0])
+        else:
+            # a file outside the open folders is indexed on its own, its
+            # directory is neither walked nor watched
+            fid = self.insert_folder(folder, 0)
+        fingerprint = self.get_fingerprint(filepath)
+        if fingerprint == None:
             return
-        (fid, pid) = get_fid_return
+        (file_id, folder_id, mtime, size, file_hash) = self.get_file_info(filepath) or (None, None, None, None, None)
+        start_time = time.time()
         try:
-            self.lock.acquire(True)
-            self.db_cur.execute(DEL_LIBS_SQL, (fid, module))
-        finally:
-            self.lock.release()
-        self.build_module_index(filepath, fid)
-        self.db_con.commit()
+            (code_hash, index, degraded) = self.build_module_index(filepath, file_hash)
+        except (OSError, beam_reader.BeamError):
+            METRICS.count('files_failed')
+            return
+        METRICS.parsed(filepath, time.time() - start_time, code_hash, index)
+        self.report_degraded(filepath, degraded)
+        # with an unchanged hash the stored rows are still valid, only the
+        # fingerprint is written
+        writer = IndexWriter(self)
+        writer.add(filepath, fid, fingerprint, code_hash, file_id, index)
+        writer.flush()
 
     def delete_module_index(self, folders):
+        # a build of these folders stops first, the rows go once it has
+        for folder in folders:
+            self.checked_folders.discard(folder)
+        SCHEDULER.cancel(folders)
+        SCHEDULER.submit(None, PRIORITY_DELETE, self.delete_folders, folders)
+
+    # a closed window's folders are not indexed any further, their rows stay
+    # for the next time they are opened
+    def close_folders(self, folders):
+        for folder in folders:
+            self.checked_folders.discard(folder)
+            if self.watcher != None:
+                self.watcher.unwatch(folder)
+        SCHEDULER.cancel(folders)
+
+    def delete_folders(self, folders):
         for folder in folders:
+            folder_info = self.get_folder_id(folder)
+            self.checked_folders.discard(folder)
+            if self.watcher != None:
+                self.watcher.unwatch(folder)
+            if folder_info == None:
+                continue
+            params = (folder_info[0], folder_info[0])
             try:
                 self.lock.acquire(True)
-                folder_info = self.get_folder_id(folder)
-                self.db_cur.execute(DEL_FOLDER_LIBS_SQL, (folder_info[0], ))
-                self.db_cur.execute(DEL_INCLUDE_SQL, (folder_info[0], ))
-                self.db_cur.execute(DEL_DEFINE_SQL, (folder_info[0], ))
-                self.db_cur.execute(DEL_RECORD_SQL, (folder_info[0], ))
+                self.db_cur.execute(DEL_FOLDER_LIBS_SQL, params)
+                self.db_cur.execute(DEL_FOLDER_INCLUDE_SQL, params)
+                self.db_cur.execute(DEL_FOLDER_DEFINE_SQL, params)
+                self.db_cur.execute(DEL_FOLDER_RECORD_SQL, params)
+                self.db_cur.execute(DEL_FOLDER_RECORD_DEF_SQL, params)
+                self.db_cur.execute(DEL_FOLDER_REFS_SQL, params)
+                self.db_cur.execute(DEL_FOLDER_FILES_SQL, params)
                 self.db_cur.execute(DEL_FOLDER_SQL, (folder_info[0], folder))
+                self.db_cur.execute(DEL_ALL_CLOSURE_SQL)
+                self.closure_writes += 1
+                self.db_con.commit()
+                self.load_module_index()
+                self.bump_generation()
             finally:
                 self.lock.release()
-        self.db_con.commit()
 
     def build_data_async(self):
-        this = self
-        class BuildDataAsync(threading.Thread):
-            def run(self):
-                this.build_data()
-                
-        BuildDataAsync().start()
+        # opening a file of an indexed folder needs no walk, the watcher keeps it current
+        if self.dir == None and all(folder in self.checked_folders for folder in self.get_all_open_folders()):
+            return
+        SCHEDULER.submit(('build', self.data_type), PRIORITY_BUILD, self.build_data)
+
+    def refresh_files_async(self, paths):
+        SCHEDULER.submit(None, PRIORITY_REFRESH, self.refresh_files, paths)
 
+    @METRICS.timed('query.looking_for_ther_nearest_record')
     def looking_for_ther_nearest_record(self, view, pos):
-        stack = []
-        if pos - 2 > 0 and view.substr(pos - 1) == '.':
-            record = []
-            pos -= 1
-            while pos > 0:
-                pos -= 1
-                char = view.substr(pos)
-                if char == '#' and record != []:
-                    record.reverse()
-                    return record, False
-                if char == ' ':
-                    return [], False
-                record.append(char)
-        else:
-            in_str = False
-            found_first_spec_word = False
-            pos -= 1
-            while pos > 0:
-                char = view.substr(pos)
-                match_spec = re.compile(r'\w').match(char)
-                if match_spec is None and found_first_spec_word == False :
-                    found_first_spec_word = True
-                    if char == '=':
-                        return [], False
-                if char == '"':
-                    if len(stack) == 0 or stack[len(stack) - 1] != char:
-                        in_str = True
-                        stack.append(char)
-                    elif stack[len(stack) - 1] == char:
-                        in_str = False
-                        stack.pop()
-                if char == '}' and in_str == False:
-                    stack.append(char)
-                if char == '{' and in_str == False:
-                    if len(stack) == 0:
-                        record = []
-                        while pos > 0:
-                            pos -= 1
-                            char = view.substr(pos)
-                            if char == '#' and record != []:
-                                record.reverse()
-                                return record, True
-                            if char == ' ':
-                                break
-                            record.append(char)
-                    elif stack[len(stack) - 1] == '}':
-                        stack.pop()
-                    else:
-                        return [], False
-                pos -= 1
-            return [], False
+        max_lookback = get_settings_param('record_context_max_lookback', 32768)
+        return self.record_context.find(view, pos, max_lookback)
+
+    @METRICS.timed('query.query_view_outline')
+    def query_view_outline(self, view):
+        return self.outline.get(view)
+
+    def forget_view(self, view_id):
+        self.record_context.forget(view_id)
+        self.outline.forget(view_id)
+
+    # builds the index of this cache's folders from scratch in a scratch dir
+    # under cProfile (and tracemalloc when available), the live index is untouched
+    def profile_build(self, report_path):
+        folders = self.dir or self.get_all_open_folders()
+        scratch_dir = tempfile.mkdtemp(prefix = 'erl_autocompletion_profile')
+        profile_cache = DataCache(self.data_type, scratch_dir, folders)
+        profile_cache.parse_inline = True
+        profiler = cProfile.Profile()
+        if tracemalloc != None:
+            tracemalloc.start()
+        start_time = time.time()
+        profiler.enable()
+        try:
+            profile_cache.build_data()
+        finally:
+            profiler.disable()
+            use_time = time.time() - start_time
+            memory = tracemalloc.take_snapshot() if tracemalloc != None else None
+            if tracemalloc != None:
+                (current, peak) = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+            profile_cache.db_con.close()
+            if getattr(profile_cache.local, 'db_con', None) != None:
+                profile_cache.local.db_con.close()
+            shutil.rmtree(scratch_dir, ignore_errors = True)
+
+        stats_io = io.StringIO()
+        pstats.Stats(profiler, stream = stats_io).sort_stats('cumulative').print_stats(40)
+        with open(report_path, 'w', encoding = 'UTF-8') as fd:
+            fd.write('index build of {} in {:.3f} second\n\n'.format(', '.join(folders), use_time))
+            fd.write(stats_io.getvalue())
+            if memory != None:
+                fd.write('\npeak traced memory {} bytes, top allocations:\n'.format(peak))
+                for stat in memory.statistics('lineno')[:20]:
+                    fd.write('{}\n'.format(stat))
@@ -0,0 +1,370 @@
+import os, re, fnmatch, threading, multiprocessing
+from multiprocessing.pool import ThreadPool
+from .settings import get_settings_param
+
+try:
+    from os import scandir
+except ImportError:
+    scandir = None
+
+APP_VSN_RE = re.compile(r'^(.+?)-\d[\w.]*$')
+
+# globs relative to the walked folder (or names when they have no /) that are
+# never walked: VCS metadata, common test data, rebar3 plugins and releases
+DEFAULT_EXCLUDE = ['.*', '*_SUITE_data', '_build/*/plugins', '_build/*/extras', '_build/*/rel', '_build/*/bin', 'node_modules']
+
+# directories holding copies of applications, most preferred first; an app
+# found anywhere else in the folder is the project's own and wins over all
+# copies, otherwise only its first copy is walked
+DEFAULT_APP_COPIES = ['_checkouts', '_build/default/lib', '_build/*/lib', 'deps']
+
+(WALK, COPY, TO_COPIES) = range(3)
+
+def get_app_name(app_dir):
+    app_name = os.path.basename(app_dir)
+    match = APP_VSN_RE.match(app_name)
+    return match.group(1) if match else app_name
+
+# the application a source belongs to, by the usual app/src and app/include layout
+def get_app_from_path(filepath):
+    (src_dir, filename) = os.path.split(filepath)
+    if os.path.basename(src_dir) not in ('src', 'include', 'test', 'ebin'):
+        return None
+    app_dir = os.path.dirname(src_dir)
+    return (get_app_name(app_dir), app_dir)
+
+def list_dir(path):
+    # (dirs, files) of path, symlinked directories are not followed
+    dirs = []
+    files = []
+    try:
+        if scandir != None:
+            for entry in scandir(path):
+                if entry.is_dir(follow_symlinks = False):
+                    dirs.append(entry.name)
+                elif entry.is_file():
+                    files.append(entry.name)
+        else:
+            for name in os.listdir(path):
+                fullpath = os.path.join(path, name)
+                if os.path.isdir(fullpath):
+                    if not os.path.islink(fullpath):
+                        dirs.append(name)
+                elif os.path.isfile(fullpath):
+                    files.append(name)
+    except OSError:
+        pass
+    return (dirs, files)
+
+def match_glob(relpath, patterns):
+    name = relpath.rsplit('/', 1)[-1]
+    for pattern in patterns:
+        if fnmatch.fnmatchcase(relpath if '/' in pattern else name, pattern):
+            return True
+    return False
+
+def gitignore_regex(pattern):
+    # fnmatch with git's rules: * and ? stop at /, ** crosses directories
+    regex = ''
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith('**/', i):
+            regex += '(?:.*/)?'
+            i += 3
+        elif pattern.startswith('/**', i) and i + 3 == len(pattern):
+            regex += '/.*'
+            i += 3
+        elif pattern[i] == '*':
+            regex += '[^/]*'
+            i += 1
+        elif pattern[i] == '?':
+            regex += '[^/]'
+            i += 1
+        elif pattern[i] == '[' and pattern.find(']', i + 1) > 0:
+            end = pattern.find(']', i + 1)
+            regex += '[' + pattern[i + 1:end].replace('\\', '\\\\').replace('!', '^', 1) + ']'
+            i = end + 1
+        else:
+            regex += re.escape(pattern[i])
+            i += 1
+    return re.compile(regex + r'\Z')
+
+class GitIgnore:
+    # the rules of one .gitignore, relpaths are relative to its directory
+    def __init__(self, lines):
+        self.rules = []
+        for line in lines:
+            line = line.rstrip('\n').rstrip('\r')
+            if line.strip() == '' or line.startswith('#'):
+                continue
+            line = line.rstrip(' ')
+            negate = line.startswith('!')
+            if negate:
+                line = line[1:]
+            dir_only = line.endswith('/')
+            line = line.rstrip('/')
+            anchored = '/' in line
+            self.rules.append((negate, dir_only, anchored, gitignore_regex(line.lstrip('/'))))
+
+    def match(self, relpath, is_dir):
+        # True ignored, False re-included by a ! rule, None no rule matches
+        result = None
+        name = relpath.rsplit('/', 1)[-1]
+        for (negate, dir_only, anchored, regex) in self.rules:
+            if dir_only and not is_dir:
+                continue
+            if regex.match(relpath if anchored else name):
+                result = not negate
+        return result
+
+def load_gitignore(dirpath):
+    try:
+        with open(os.path.join(dirpath, '.gitignore'), encoding = 'UTF-8', errors = 'ignore') as fd:
+            return GitIgnore(fd.readlines())
+    except OSError:
+        return None
+
+def is_gitignored(relpath, is_dir, ignores):
+    # ignores is [(relpath of the .gitignore's directory, GitIgnore)], outermost
+    # first, a deeper file overrides the rules of its parents
+    result = None
+    for (base, ignore) in ignores:
+        if base != '':
+            if not relpath.startswith(base + '/'):
+                continue
+            match = ignore.match(relpath[len(base) + 1:], is_dir)
+        else:
+            match = ignore.match(relpath, is_dir)
+        if match != None:
+            result = match
+    return result == True
+
+class DirWalker:
+    # walks folders level by level on a thread pool, the directories of one level
+    # are listed in parallel; copies holds for every walked folder the app
+    # copies chosen by the last walk, {app_name: app_dir}
+    def __init__(self):
+        self.copies = {}
+        self.project_apps = {}
+        self.gitignores = {}
+        self.lock = threading.Lock()
+
+    def load_settings(self):
+        self.exclude = get_settings_param('index_exclude', DEFAULT_EXCLUDE)
+        self.include = get_settings_param('index_include', [])
+        self.use_gitignore = get_settings_param('index_gitignore', True)
+        self.app_copies = get_settings_param('index_app_copies', DEFAULT_APP_COPIES)
+        self.pool_size = get_settings_param('index_walk_threads', None) or min(8, multiprocessing.cpu_count())
+
+    def walk(self, folder):
+        # [(root, [file])] of the directories below folder with files to index
+        self.load_settings()
+        return self.walk_from(folder, [(folder, '', (), WALK)], [], True)
+
+    def walk_path(self, folder, path, dirs = None):
+        # like walk for the directory path below folder, for refreshes. Every
+        # directory visited is appended to dirs, files or not
+        self.load_settings()
+        relpath = self.relpath(folder, path)
+        parts = relpath.split('/')
+        if relpath != '' and any(match_glob('/'.join(parts[:i]), self.exclude) for i in range(1, len(parts) + 1)):
+            return []
+        priority = self.copy_priority(relpath)
+        if priority != None:
+            if dirs != None:
+                dirs.append(path)
+            return self.walk_from(folder, [], self.list_copies(path, priority), False, dirs)
+        if self.find_copy(folder, path) != None:
+            if not self.accepts(folder, path, True):
+                return []
+            return self.walk_from(folder, [(path, relpath, (), COPY)], [], False, dirs)
+        if self.accepts(folder, path, True):
+            return self.walk_from(folder, [(path, relpath, self.parent_ignores(folder, path), WALK)], [], False, dirs)
+        if self.leads_to_copies(relpath):
+            return self.walk_from(folder, [(path, relpath, (), TO_COPIES)], [], False, dirs)
+        return []
+
+    def walk_dirs(self, folder, path):
+        # the directories below path a walk of folder visits, the ones a new
+        # source or app copy may appear in, for the watcher
+        dirs = []
+        self.walk_path(folder, path, dirs)
+        return dirs
+
+    def walk_from(self, folder, tasks, found_copies, full, dirs = None):
+        results = []
+        found_copies = list(found_copies)
+        pool = ThreadPool(self.pool_size)
+        try:
+            self.walk_tasks(pool, tasks, results, found_copies, dirs)
+            # the apps found outside of the copies are the project's own
+            apps = set()
+            if all(task[3] == WALK for task in tasks):
+                apps = {app[0] for app in (get_app_from_path(os.path.join(root, files[0])) for (root, files) in results) if app != None}
+            copy_dirs = []
+            try:
+                self.lock.acquire(True)
+                if full:
+                    self.project_apps[folder] = set()
+                    self.copies[folder] = {}
+                project_apps = self.project_apps.setdefault(folder, set())
+                project_apps.update(apps)
+                chosen = self.copies.setdefault(folder, {})
+                for (priority, app_name, app_dir) in sorted(found_copies):
+                    if app_name not in project_apps and chosen.setdefault(app_name, app_dir) == app_dir and app_dir not in copy_dirs:
+                        copy_dirs.append(app_dir)
+            finally:
+                self.lock.release()
+            self.walk_tasks(pool, [(app_dir, self.relpath(folder, app_dir), (), COPY) for app_dir in copy_dirs], results, [], dirs)
+        finally:
+            pool.close()
+            pool.join()
+        return results
+
+    def walk_tasks(self, pool, tasks, results, found_copies, dirs = None):
+        while tasks != []:
+            next_tasks = []
+            for (files, sub_tasks, copies, containers) in pool.map(self.visit, tasks):
+                results.extend(files)
+                next_tasks.extend(sub_tasks)
+                found_copies.extend(copies)
+                if dirs != None:
+                    dirs.extend(containers)
+            if dirs != None:
+                dirs.extend(task[0] for task in tasks)
+            tasks = next_tasks
+
+    def visit(self, task):
+        # mode is WALK, COPY inside a chosen app copy (its .gitignore is the
+        # dependency's, not the project's) or TO_COPIES inside an ignored
+        # directory that still leads to app copies, like _build
+        (path, relpath, ignores, mode) = task
+        (dirs, files) = list_dir(path)
+        if self.use_gitignore and mode == WALK and '.gitignore' in files:
+            ignore = self.load_gitignore(path)
+            if ignore != None:
+                ignores = ignores + ((relpath, ignore), )
+
+        found = []
+        keep_files = []
+        if mode != TO_COPIES:
+            for name in files:
+                if self.file_accepted(relpath + '/' + name if relpath else name, ignores, mode == COPY):
+                    keep_files.append(name)
+        if keep_files != []:
+            found.append((path, keep_files))
+
+        sub_tasks = []
+        copies = []
+        containers = []
+        for name in dirs:
+            dir_relpath = relpath + '/' + name if relpath else name
+            if match_glob(dir_relpath, self.exclude):
+                continue
+            priority = None if mode == COPY else self.copy_priority(dir_relpath)
+            if priority != None:
+                containers.append(os.path.join(path, name))
+                copies.extend(self.list_copies(os.path.join(path, name), priority))
+            elif mode == COPY or (mode == WALK and not (self.use_gitignore and is_gitignored(dir_relpath, True, ignores))):
+                sub_tasks.append((os.path.join(path, name), dir_relpath, ignores, mode))
+            elif self.leads_to_copies(dir_relpath):
+                sub_tasks.append((os.path.join(path, name), dir_relpath, ignores, TO_COPIES))
+        return (found, sub_tasks, copies, containers)
+
+    def load_gitignore(self, dirpath):
+        # parsed once per change of the file, refreshes look up the same ones often
+        try:
+            mtime = os.stat(os.path.join(dirpath, '.gitignore')).st_mtime
+        except OSError:
+            return None
+        cached = self.gitignores.get(dirpath)
+        if cached == None or cached[0] != mtime:
+            cached = self.gitignores[dirpath] = (mtime, load_gitignore(dirpath))
+        return cached[1]
+
+    def leads_to_copies(self, relpath):
+        depth = relpath.count('/') + 1
+        for pattern in self.app_copies:
+            parts = pattern.split('/')
+            if len(parts) > depth and fnmatch.fnmatchcase(relpath, '/'.join(parts[:depth])):
+                return True
+        return False
+
+    def file_accepted(self, relpath, ignores, in_copy):
+        if match_glob(relpath, self.exclude):
+            return False
+        if self.include != [] and not match_glob(relpath, self.include):
+            return False
+        return in_copy or not (self.use_gitignore and is_gitignored(relpath, False, ignores))
+
+    def copy_priority(self, relpath):
+        for (priority, pattern) in enumerate(self.app_copies):
+            if fnmatch.fnmatchcase(relpath, pattern):
+                return priority
+        return None
+
+    def list_copies(self, container, priority):
+        copies = []
+        for name in list_dir(container)[0]:
+            app_dir = os.path.join(container, name)
+            # rebar3 links the src of the project's own apps into _build
+            if not os.path.islink(os.path.join(app_dir, 'src')):
+                copies.append((priority, get_app_name(app_dir), app_dir))
+        return copies
+
+    def relpath(self, folder, path):
+        if path == folder:
+            return ''
+        return os.path.relpath(path, folder).replace(os.sep, '/')
+
+    def parent_ignores(self, folder, path):
+        ignores = ()
+        if not self.use_gitignore or self.find_copy(folder, path) != None:
+            return ignores
+        parts = self.relpath(folder, path).split('/')
+        for i in range(len(parts)):
+            relpath = '/'.join(parts[:i])
+            ignore = self.load_gitignore(os.path.join(folder, *parts[:i]))
+            if ignore != None:
+                ignores = ignores + ((relpath, ignore), )
+        return ignores
+
+    def find_copy(self, folder, path):
+        # (app_name, app_dir) of the app copy containing path, or None
+        parts = self.relpath(folder, path).split('/')
+        for i in range(1, len(parts)):
+            if self.copy_priority('/'.join(parts[:i])) != None:
+                app_dir = os.path.join(folder, *parts[:i + 1])
+                return (get_app_name(app_dir), app_dir)
+        return None
+
+    def accepts(self, folder, path, is_dir = False):
+        # whether a walk of folder would index path, for single changed paths
+        self.load_settings()
+        relpath = self.relpath(folder, path)
+        if relpath == '':
+            return True
+        parts = relpath.split('/')
+        for i in range(1, len(parts) + 1):
+            if match_glob('/'.join(parts[:i]), self.exclude):
+                return False
+        copy = self.find_copy(folder, path)
+        if copy != None:
+            (app_name, app_dir) = copy
+            try:
+                self.lock.acquire(True)
+                chosen = self.copies.setdefault(folder, {})
+                if app_name in self.project_apps.get(folder, ()):
+                    return False
+                # a dependency fetched after the walk
+                if chosen.setdefault(app_name, app_dir) != app_dir:
+                    return False
+            finally:
+                self.lock.release()
+            return is_dir or self.include == [] or match_glob(relpath, self.include)
+        if self.use_gitignore:
+            ignores = self.parent_ignores(folder, path)
+            for i in range(1, len(parts) + 1):
+                if is_gitignored('/'.join(parts[:i]), is_dir or i < len(parts), ignores):
+                    return False
+        return is_dir or self.include == [] or match_glob(relpath, self.include)
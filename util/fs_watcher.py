@@ -0,0 +1,290 @@
+import os, sys, time, errno, struct, select, threading, fnmatch
+
+try:
+    import ctypes, ctypes.util
+except ImportError:
+    ctypes = None
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0x00000800
+IN_CLOEXEC = 0x00080000
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MODIFY | IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+EVENT_HEADER = struct.Struct('iIII')
+
+def is_source(path):
+    return fnmatch.fnmatch(path, '*.[eh]rl')
+
+def is_skipped_dir(name):
+    return name.startswith('.')
+
+def walk_all_dirs(folder, path):
+    # every directory below path but the hidden ones, when no walker decides
+    dirs = []
+    for root, sub_dirs, files in os.walk(path):
+        sub_dirs[:] = [d for d in sub_dirs if not is_skipped_dir(d)]
+        dirs.append(root)
+    return dirs
+
+def top_folder(folders, path):
+    # the watched folder path lies in, the innermost one if they nest
+    found = None
+    for folder in folders:
+        if (path == folder or path.startswith(os.path.join(folder, ''))) and (found == None or len(folder) > len(found)):
+            found = folder
+    return found
+
+class InotifyBackend:
+    # one inotify watch per directory the walker visits, new directories are
+    # watched as they appear
+    def __init__(self, walk_dirs):
+        self.walk_dirs = walk_dirs
+        self.folders = set()
+        libc_name = ctypes.util.find_library('c') or 'libc.so.6'
+        self.libc = ctypes.CDLL(libc_name, use_errno = True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.wd_dirs = {}
+        self.dir_wds = {}
+
+    def watch(self, folder):
+        self.folders.add(folder)
+        self.__watch_dirs(folder, folder)
+
+    def unwatch(self, folder):
+        self.folders.discard(folder)
+        prefix = os.path.join(folder, '')
+        for path in list(self.dir_wds):
+            if path == folder or path.startswith(prefix):
+                self.libc.inotify_rm_watch(self.fd, self.dir_wds[path])
+                self.__forget(path)
+
+    def poll(self, timeout):
+        (readable, writable, errors) = select.select([self.fd], [], [], timeout)
+        if readable == []:
+            return set()
+        try:
+            data = os.read(self.fd, 65536)
+        except (BlockingIOError, InterruptedError):
+            return set()
+
+        changed = set()
+        pos = 0
+        while pos + EVENT_HEADER.size <= len(data):
+            (wd, mask, cookie, length) = EVENT_HEADER.unpack_from(data, pos)
+            name = data[pos + EVENT_HEADER.size:pos + EVENT_HEADER.size + length].rstrip(b'\0')
+            pos += EVENT_HEADER.size + length
+            directory = self.wd_dirs.get(wd)
+            if mask & IN_Q_OVERFLOW:
+                # events were lost, let the owner rescan everything it watches
+                changed.update(self.dir_wds)
+                continue
+            if directory == None:
+                continue
+            if mask & IN_IGNORED:
+                self.__forget(directory)
+                continue
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                changed.add(directory)
+                continue
+            path = os.path.join(directory, os.fsdecode(name))
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    self.__watch_new(path)
+                changed.add(path)
+            elif os.path.basename(path) == '.gitignore':
+                # directories it no longer ignores are watched from now on
+                self.__watch_new(directory)
+                changed.add(directory)
+            elif is_source(path):
+                changed.add(path)
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+    def __watch_new(self, path):
+        folder = top_folder(self.folders, path)
+        if folder == None:
+            return
+        try:
+            self.__watch_dirs(folder, path)
+        except OSError as e:
+            # removed again before it could be watched, the owner rescans it
+            # as a changed path
+            if e.errno not in (errno.ENOENT, errno.ENOTDIR):
+                raise
+
+    def __watch_dirs(self, folder, path):
+        for dirpath in self.walk_dirs(folder, path):
+            if dirpath not in self.dir_wds:
+                self.__add_watch(dirpath)
+
+    def __add_watch(self, path):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_add_watch {} failed'.format(path))
+        self.wd_dirs[wd] = path
+        self.dir_wds[path] = wd
+
+    def __forget(self, path):
+        wd = self.dir_wds.pop(path, None)
+        self.wd_dirs.pop(wd, None)
+
+class PollingBackend:
+    # compares (mtime, size) snapshots of the watched sources every interval,
+    # only in the directories the walker visits
+    def __init__(self, interval, walk_dirs):
+        self.interval = interval
+        self.walk_dirs = walk_dirs
+        self.snapshots = {}
+        self.next_scan = time.time() + interval
+
+    def watch(self, folder):
+        self.snapshots[folder] = self.__snapshot(folder)
+
+    def unwatch(self, folder):
+        self.snapshots.pop(folder, None)
+
+    def poll(self, timeout):
+        delay = self.next_scan - time.time()
+        if delay > timeout:
+            time.sleep(timeout)
+            return set()
+        time.sleep(max(delay, 0))
+        self.next_scan = time.time() + self.interval
+
+        changed = set()
+        for (folder, old_snapshot) in list(self.snapshots.items()):
+            snapshot = self.__snapshot(folder)
+            for (path, fingerprint) in snapshot.items():
+                if old_snapshot.get(path) != fingerprint:
+                    changed.add(path)
+            changed.update(path for path in old_snapshot if path not in snapshot)
+            self.snapshots[folder] = snapshot
+        return changed
+
+    def close(self):
+        pass
+
+    def __snapshot(self, folder):
+        snapshot = {}
+        for root in self.walk_dirs(folder, folder):
+            try:
+                files = os.listdir(root)
+            except OSError:
+                continue
+            for file in files:
+                if is_source(file):
+                    path = os.path.join(root, file)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    snapshot[path] = (stat.st_mtime, stat.st_size)
+        return snapshot
+
+class FolderWatcher(threading.Thread):
+    # collects changed paths and hands them to on_changes once the folders have
+    # been quiet for `debounce` seconds (or after `max_delay` during a storm).
+    # walk_dirs(folder, path) lists the directories below path to watch
+    def __init__(self, on_changes, walk_dirs = None, debounce = 0.5, max_delay = 5.0, poll_interval = 5.0):
+        threading.Thread.__init__(self, name = 'erl-autocompletion-watcher')
+        self.daemon = True
+        self.on_changes = on_changes
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        self.walk_dirs = walk_dirs if walk_dirs != None else walk_all_dirs
+        self.commands = []
+        self.commands_lock = threading.Lock()
+        self.stopped = False
+        self.watched = set()
+        self.backend = self.__create_backend()
+
+    def __create_backend(self):
+        if sys.platform.startswith('linux') and ctypes != None:
+            try:
+                return InotifyBackend(self.walk_dirs)
+            except (OSError, AttributeError) as e:
+                print('inotify unavailable, poll folders instead: {}'.format(e))
+        return PollingBackend(self.poll_interval, self.walk_dirs)
+
+    def watch(self, folder):
+        self.__command(('watch', folder))
+
+    def unwatch(self, folder):
+        self.__command(('unwatch', folder))
+
+    def stop(self):
+        self.stopped = True
+
+    def __command(self, command):
+        try:
+            self.commands_lock.acquire(True)
+            self.commands.append(command)
+        finally:
+            self.commands_lock.release()
+
+    def __run_commands(self):
+        try:
+            self.commands_lock.acquire(True)
+            (commands, self.commands) = (self.commands, [])
+        finally:
+            self.commands_lock.release()
+        for (command, folder) in commands:
+            if command == 'watch':
+                self.watched.add(folder)
+            else:
+                self.watched.discard(folder)
+            try:
+                getattr(self.backend, command)(folder)
+            except OSError as e:
+                # most likely out of inotify watches, poll from now on
+                print('watch {} failed, poll folders instead: {}'.format(folder, e))
+                self.__fallback_to_polling()
+
+    def __fallback_to_polling(self):
+        self.backend.close()
+        self.backend = PollingBackend(self.poll_interval, self.walk_dirs)
+        for folder in self.watched:
+            self.backend.watch(folder)
+
+    def run(self):
+        pending = set()
+        first_change = last_change = 0
+        while not self.stopped:
+            self.__run_commands()
+
+            try:
+                changed = self.backend.poll(self.debounce if pending else 0.2)
+            except OSError as e:
+                # events may have been lost, rescan everything watched
+                print('watch folders failed, poll folders instead: {}'.format(e))
+                self.__fallback_to_polling()
+                changed = set(self.watched)
+            now = time.time()
+            if changed:
+                if not pending:
+                    first_change = now
+                pending |= changed
+                last_change = now
+            if pending and (now - last_change >= self.debounce or now - first_change >= self.max_delay):
+                (paths, pending) = (pending, set())
+                try:
+                    self.on_changes(paths)
+                except Exception as e:
+                    print('reindex changed files failed: {}'.format(e))
+        self.backend.close()
@@ -5,5 +5,7 @@
 % command line exposure
 main(["lib_dir"]) ->
   io:format("~s", [code:lib_dir()]);
+main(["otp_info"]) ->
+  io:format("~s~n~s~n~s", [code:lib_dir(), erlang:system_info(otp_release), erlang:system_info(version)]);
 main(_) ->
   halt(1).
\ No newline at end of file
@@ -1,7 +1,7 @@
 from .data_cache import DataCache
 from functools import partial
 from html import escape
-import sublime, re, os
+import sublime
 
 class GoTo(DataCache):
     def __init__(self):
@@ -16,6 +16,21 @@ class GoTo(DataCache):
         self.__window = view.window()
         self.__is_quick_panel = is_quick_panel
 
+        result = self.resolve(point, view, cache)
+        if result == None:
+            return
+        (kind, data) = result
+        if is_quick_panel:
+            if kind == 'definition':
+                (filepath, start_line, text) = data
+                data = [('', filepath, start_line)]
+            self.__window_quick_panel_open_window(data)
+        else:
+            self.show_popup(view, point, self.popup_content(result))
+
+    # returns ('functions', [(name, filepath, row)]), ('definition', (filepath,
+    # row, text)) or None, only reads the view and the index
+    def resolve(self, point, view, cache):
         line_region = view.line(point)
         line_str = view.substr(line_region)
         word_region = view.word(point)
@@ -25,129 +40,127 @@ class GoTo(DataCache):
         maths = self.re_dict['take_mf'].findall(line_str)
         for math in maths:
             if word in math:
-                if self.__goto_menu(view, cache['libs'].query_fun_position(math[0], math[1])):
-                    return
-                if self.__goto_menu(view, cache['project'].query_fun_position(math[0], math[1])):
-                    return
+                for data_cache in (cache['libs'], cache['project']):
+                    data = data_cache.query_fun_position(math[0], math[1])
+                    if data != []:
+                        return ('functions', data)
 
         maths = self.re_dict['take_fun'].findall(line_str)
         for math in maths:
             if word == math:
-                module = self.get_module_from_path(filepath)
-                if self.__goto_menu(view, cache['libs'].query_fun_position('erlang', math)):
-                    return
-                if self.__goto_menu(view, self.__build_module_position(view, module, math, filepath)):
-                    return
+                data = cache['libs'].query_fun_position('erlang', math)
+                if data != []:
+                    return ('functions', data)
+                data = self.__build_module_position(cache['project'].query_view_outline(view), math, filepath)
+                if data != []:
+                    return ('functions', data)
 
         maths = self.re_dict['take_record'].findall(line_str)
         for math in maths:
             if word == math:
-                re_define = re.compile(r'(-\s*record\s*\([\s\n\r]*' + word + r'[\s\n\r]*,[\s\n\r]*{[^-]*}[\s\n\r]*\)\.)', re.MULTILINE|re.DOTALL)
-                if self.__open_hrl_popup(view, re_define, filepath):
-                    return
+                definition = self.__find_definition(view, cache, 'records', filepath, word)
+                if definition != None:
+                    return ('definition', definition)
 
         maths = self.re_dict['take_define'].findall(line_str)
         for math in maths:
             if word == math:
-                re_define = re.compile(r'(-\s*define\s*\([\s\n\r]*' + word + r'[\s\n\r]*,[\s\n\r]*[^-]*\)\.)', re.MULTILINE|re.DOTALL)
-                if self.__open_hrl_popup(view, re_define, filepath):
-                    return
+                definition = self.__find_definition(view, cache, 'defines', filepath, word)
+                if definition != None:
+                    return ('definition', definition)
+        return None
 
-    def __goto_menu(self, view, data):
+    def find_references(self, point, view, cache):
+        self.__view = view
+        self.__point = point
+        self.__window = view.window()
+
+        target = self.resolve_reference_target(point, view, cache)
+        if target == None:
+            return
+        data = []
+        for data_cache in (cache['libs'], cache['project']):
+            data += data_cache.query_references(*target)
         if data == []:
-            return False
+            sublime.status_message('no references of {}'.format(target[2]))
+            return
+        self.__window_quick_panel_open_window(data)
 
-        if self.__is_quick_panel:
-            self.__window_quick_panel_open_window(data)
-        else:
-            self.__open_function_popup(view, data)
-        return True
+    # returns (kind, module, name) for query_references or None, a local
+    # function is one of the view's own or else an auto-imported BIF
+    def resolve_reference_target(self, point, view, cache):
+        line_str = view.substr(view.line(point))
+        word = view.substr(view.word(point))
 
-    def __open_function_popup(self, view, data):
-        col = 0
-        row = 1
+        for math in self.re_dict['take_mf'].findall(line_str):
+            if word in math:
+                return ('call', math[0], math[1])
+
+        for math in self.re_dict['take_fun'].findall(line_str):
+            if word == math:
+                if math in cache['project'].query_view_outline(view)['functions']:
+                    return ('call', self.get_module_from_path(view.file_name()), math)
+                return ('call', 'erlang', math)
+
+        for math in self.re_dict['take_record'].findall(line_str):
+            if word == math:
+                return ('record', '', math)
+
+        for math in self.re_dict['take_define'].findall(line_str):
+            if word == math:
+                return ('macro', '', math)
+        return None
+
+    def popup_content(self, result):
+        (kind, data) = result
         html_content = '<div style={}>Definitions:</div>'.format(self.__definition_style)
-        for (name, path, row) in data:
-            add_str = '<div style={0}>{1} <a href="{2}:{3}:0">{2}:{3}</a></div>'.format(self.__line_style, name, path, row)
-            html_content += add_str
-            col = max(len(add_str), col)
-            row += 1
-
-        view.show_popup(html_content, max_height = self.__get_height(row), max_width = self.__get_width(col), 
-            flags = sublime.HIDE_ON_MOUSE_MOVE_AWAY, location = self.__point, 
+        if kind == 'functions':
+            col = 0
+            row = 1
+            for (name, path, row_num) in data:
+                add_str = '<div style={0}>{1} <a href="{2}:{3}:0">{2}:{3}</a></div>'.format(self.__line_style, name, path, row_num)
+                html_content += add_str
+                col = max(len(add_str), col)
+                row += 1
+            return (html_content, self.__get_height(row), self.__get_width(col))
+
+        (filepath, start_line, text) = data
+        record_define = '<div style={}>{}</div>'.format(self.__line_style, escape(text, quote = False))
+        record_address = '<div style={0}><a href="{1}:{2}:0">{1}:{2}</a></div>'.format(self.__line_style, filepath, start_line)
+        record_define_len = len(record_define)
+        if record_define_len > self.__max_col:
+            html_content += record_address
+            col = len(record_address)
+        else:
+            html_content += record_define + record_address
+            col = max(record_define_len, len(record_address))
+        return (html_content, self.__get_height(3), self.__get_width(col))
+
+    def show_popup(self, view, point, content):
+        (html_content, max_height, max_width) = content
+        view.show_popup(html_content, max_height = max_height, max_width = max_width, 
+            flags = sublime.HIDE_ON_MOUSE_MOVE_AWAY, location = point, 
             on_navigate = self.__on_navigate_cb)
-        return True
-
-    def __build_module_position(self, view, module, fun, filepath):
-        row_num = 1
-        cur_view_position = []
-        all_cur_view_fun = []
-        code = self.__get_view_code(view)
-        for line in code.split('\n'):
-            funhead = self.re_dict['funline'].search(line)
-            if funhead is not None: 
-                fun_name = funhead.group(1)
-                if fun_name == fun:
-                    param_str = funhead.group(2)
-                    param_list = self.format_param(param_str)
-                    key = (module, fun_name)
-                    param_len = len(param_list)
-                    format_fun_name = '{0}/{1}'.format(fun_name, param_len)
-                    
-                    if (key, param_len) not in all_cur_view_fun:
-                        cur_view_position.append((format_fun_name, filepath, row_num))
-                        all_cur_view_fun.append((key, param_len))
-            row_num += 1
-        return cur_view_position
-
-    def __open_hrl_popup(self, view, re_define, filepath):
-        if not os.path.exists(filepath):
-            return False
-        
-        with open(filepath, encoding = 'UTF-8', errors='ignore') as fd:
-            content = fd.read()
-            code = re.sub(self.re_dict['comment'], '\n', content)
-
-        re_newline = re.compile(r'\n')
-        for m in re_define.finditer(code):
-            start_line = len(re_newline.findall(code, 0, m.start(1))) + 1
-
-            if self.__is_quick_panel:
-                self.__window_quick_panel_open_window([('', filepath, start_line)])
-            else:
-                html_content = '<div style={}>Definitions:</div>'.format(self.__definition_style)
-                record_define = '<div style={}>{}</div>'.format(self.__line_style, escape(m.group(1), quote = False))
-                record_address = '<div style={0}><a href="{1}:{2}:0">{1}:{2}</a></div>'.format(self.__line_style, filepath, start_line)
-                record_define_len = len(record_define)
-                if record_define_len > self.__max_col:
-                    html_content += record_address
-                    col = len(record_address)
-                else:
-                    html_content += record_define + record_address
-                    col = max(record_define_len, len(record_address))
-
-                view.show_popup(html_content, max_height = self.__get_height(3), max_width = self.__get_width(col), 
-                    flags = sublime.HIDE_ON_MOUSE_MOVE_AWAY, location = self.__point, 
-                    on_navigate = self.__on_navigate_cb)
-            return True
-        
-        (directory, filename) = os.path.split(filepath)
-        for m in self.re_dict['take_include'].finditer(code):
-            hrl_name = m.group(1)
-            hrl_path = os.path.normpath(os.path.join(directory, hrl_name))
-            if self.__open_hrl_popup(view, re_define, hrl_path):
-                return True
-                
-        return False
+
+    def __build_module_position(self, outline, fun, filepath):
+        return [('{0}/{1}'.format(fun, param_len), filepath, row_num) for (param_len, row_num) in outline['functions'].get(fun, [])]
+
+    def __find_definition(self, view, cache, kind, filepath, word):
+        definition = cache['project'].query_view_outline(view)[kind].get(word)
+        if definition != None:
+            (start_line, text) = definition
+            return (filepath, start_line, text)
+        if kind == 'records':
+            definitions = cache['project'].query_record_position(filepath, word)
+        else:
+            definitions = cache['project'].query_define_position(filepath, word)
+        if definitions == []:
+            return None
+        return definitions[0]
 
     def __on_navigate_cb(self, address):
         sublime.active_window().open_file(address, sublime.ENCODED_POSITION)
 
-    def __get_view_code(self, view):
-        view_region = sublime.Region(0, view.size())
-        code = view.substr(view_region)
-        return code
-
     def __window_quick_panel_open_window(self, options):
         self.options = options
 
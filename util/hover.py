@@ -0,0 +1,98 @@
+import threading, time, sublime
+from .go_to import GoTo
+from .lru_cache import LRUCache
+
+class HoverResolver:
+    # resolves hovers on one worker thread, only the latest hover is kept, so
+    # moving the pointer on cancels the one before it
+    def __init__(self, cache, delay = 0.1, budget = 0.3, cache_size = 128):
+        self.cache = cache
+        self.delay = delay
+        self.budget = budget
+        self.popups = LRUCache(cache_size)
+        self.condition = threading.Condition()
+        self.pending = None
+        self.token = 0
+        self.worker = None
+
+    def hover(self, view, point):
+        # GoTo.resolve only reads the word, its line and the view's outline, the
+        # word's column tells aa:go from bb:go on one line. The index
+        # generations are added on the worker, reading them can be a round
+        # trip to the index daemon
+        line_region = view.line(point)
+        word_region = view.word(point)
+        view_key = (view.file_name(), view.substr(line_region), word_region.begin() - line_region.begin(),
+            view.substr(word_region), view.change_count())
+        try:
+            self.condition.acquire()
+            self.token += 1
+            self.pending = (self.token, time.time(), view_key, view, point)
+            self.__start_worker()
+            self.condition.notify()
+        finally:
+            self.condition.release()
+
+    def cancel(self):
+        try:
+            self.condition.acquire()
+            self.token += 1
+            self.pending = None
+        finally:
+            self.condition.release()
+
+    def __start_worker(self):
+        if self.worker == None:
+            self.worker = threading.Thread(target = self.__run, name = 'erl-autocompletion-hover')
+            self.worker.daemon = True
+            self.worker.start()
+
+    def __run(self):
+        while True:
+            try:
+                self.condition.acquire()
+                while self.pending == None:
+                    self.condition.wait()
+                request = self.pending
+            finally:
+                self.condition.release()
+
+            (token, start_time, view_key, view, point) = request
+            key = view_key + (self.cache['libs'].index_generation, self.cache['project'].index_generation)
+            content = self.popups.get(key)
+            # a cached popup is shown right away, the rest are debounced
+            if not self.__take(request, content == None):
+                continue
+            if content == None:
+                try:
+                    go_to = GoTo()
+                    result = go_to.resolve(point, view, self.cache)
+                    content = result and go_to.popup_content(result)
+                except Exception as e:
+                    print('resolve hover failed: {}'.format(e))
+                    continue
+                if content == None:
+                    continue
+                self.popups.put(key, content)
+            if time.time() - start_time > self.budget:
+                print('drop hover on {}, resolved in {:.3f} second'.format(view_key[3], time.time() - start_time))
+                continue
+            sublime.set_timeout(lambda: self.__show(token, view, point, content), 0)
+
+    def __take(self, request, debounce):
+        # false when a newer hover replaced request, during the delay too
+        try:
+            self.condition.acquire()
+            if self.pending is request and debounce:
+                self.condition.wait(self.delay)
+            if self.pending is not request:
+                return False
+            self.pending = None
+            return True
+        finally:
+            self.condition.release()
+
+    def __show(self, token, view, point, content):
+        if token != self.token:
+            return
+        GoTo().show_popup(view, point, content)
@@ -0,0 +1,106 @@
+import socket, threading
+from functools import partial
+from .data_cache import DataCache
+from .index_protocol import send_message, recv_message, REMOTE_METHODS, LONG_METHODS
+
+def index_daemon_running(socket_path):
+    if not hasattr(socket, 'AF_UNIX'):
+        return False
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(1.0)
+        sock.connect(socket_path)
+        return True
+    except OSError:
+        return False
+    finally:
+        sock.close()
+
+class IndexClient:
+    # stands in for a DataCache whose index is owned by daemon/index_daemon.py,
+    # the record context and view outlines stay in this process. When the
+    # daemon goes away on_lost is called once and queries return nothing.
+    def __init__(self, socket_path, data_type, on_lost = None, timeout = 2.0):
+        self.socket_path = socket_path
+        self.data_type = data_type
+        self.on_lost = on_lost
+        self.timeout = timeout
+        self.local = DataCache(data_type)
+        self.connections = threading.local()
+        self.sent_folders = set()
+        self.lost = False
+
+    def __getattr__(self, name):
+        if name in REMOTE_METHODS:
+            return partial(self.call, name)
+        return getattr(self.local, name)
+
+    @property
+    def index_generation(self):
+        return self.call('index_generation') or 0
+
+    def call(self, method, *args):
+        for attempt in range(2):
+            if self.lost:
+                break
+            try:
+                connection = getattr(self.connections, 'connection', None)
+                if connection == None:
+                    connection = self.connections.connection = self.__connect()
+                (sock, fd) = connection
+                sock.settimeout(None if method in LONG_METHODS else self.timeout)
+                send_message(fd, [self.data_type, method, list(args)])
+                response = recv_message(fd)
+                if response == None:
+                    raise EOFError('index daemon closed the connection')
+                (ok, result) = response
+                if ok:
+                    return result
+                print('index daemon {} {} failed: {}'.format(self.data_type, method, result))
+                break
+            except (OSError, EOFError, ValueError) as e:
+                self.__close()
+                if attempt == 1:
+                    self.__lose(e)
+        return [] if method.startswith('query') else None
+
+    def build_data_async(self):
+        folders = [folder for folder in self.local.get_all_open_folders() if folder not in self.sent_folders]
+        if folders == []:
+            return
+        self.sent_folders.update(folders)
+        threading.Thread(target = self.call, args = ('build_dir_data', folders)).start()
+
+    def start_watching(self):
+        pass
+
+    def stop_watching(self):
+        self.__close()
+
+    def __connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+        except OSError:
+            sock.close()
+            raise
+        return (sock, sock.makefile('rwb'))
+
+    def __close(self):
+        connection = getattr(self.connections, 'connection', None)
+        self.connections.connection = None
+        if connection != None:
+            try:
+                connection[1].close()
+                connection[0].close()
+            except OSError:
+                pass
+
+    def __lose(self, error):
+        if self.lost:
+            return
+        self.lost = True
+        print('index daemon at {} is gone, index in process: {}'.format(self.socket_path, error))
+        if self.on_lost != None:
+            self.on_lost()
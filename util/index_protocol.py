@@ -0,0 +1,47 @@
+import json, struct
+
+# messages between the plugin and daemon/index_daemon.py are a 4 byte big
+# endian length followed by that many bytes of UTF-8 JSON:
+#   request  [data_type, method, args]
+#   response [ok, result or error message]
+HEADER = struct.Struct('>I')
+MAX_MESSAGE = 64 * 1024 * 1024
+
+# DataCache methods the daemon answers, everything that needs a view stays
+# in the plugin
+REMOTE_METHODS = {
+    'query_mod_fun', 'touch_module', 'query_all_mod', 'query_module_prefix', 'query_fun_prefix',
+    'query_fun_position', 'query_file_defines', 'query_file_record', 'query_record_fields',
+    'query_define_position', 'query_record_position', 'query_references', 'index_generation',
+    'build_dir_data', 'rebuild_module_index', 'delete_module_index', 'refresh_files'
+}
+
+# may walk and parse whole trees, the client waits for them without a timeout
+LONG_METHODS = {'build_dir_data', 'delete_module_index', 'refresh_files'}
+
+def send_message(fd, message):
+    data = json.dumps(message, separators = (',', ':')).encode('UTF-8')
+    fd.write(HEADER.pack(len(data)) + data)
+    fd.flush()
+
+def recv_message(fd):
+    # None once the other side closed the connection
+    header = read_exactly(fd, HEADER.size)
+    if header == None:
+        return None
+    (length, ) = HEADER.unpack(header)
+    if length > MAX_MESSAGE:
+        raise ValueError('message of {} bytes is too large'.format(length))
+    data = read_exactly(fd, length)
+    if data == None:
+        return None
+    return json.loads(data.decode('UTF-8'))
+
+def read_exactly(fd, size):
+    data = b''
+    while len(data) < size:
+        chunk = fd.read(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
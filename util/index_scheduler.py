@@ -0,0 +1,192 @@
+import os, re, time, heapq, threading
+
+# jobs with a lower priority run first, PRIORITY_FILE jobs (saves and
+# details a query waits for) also run between the slices of a build
+(PRIORITY_FILE, PRIORITY_DELETE, PRIORITY_REFRESH, PRIORITY_BUILD) = range(4)
+
+# files of open views and the headers they include, modules they call, the rest
+(RANK_OPEN, RANK_CALLED, RANK_OTHER) = range(3)
+
+INCLUDE_RE = re.compile(r'^-[ \t]*include(?:_lib)?[ \t]*\([ \t]*"([^"]+)"', re.MULTILINE)
+CALL_RE = re.compile(r'\b([a-z][\w@]*)[ \t]*:[ \t]*[a-z\']')
+
+# only the head of a huge file is searched for its references
+REFERENCES_SIZE = 1024 * 1024
+
+def read_references(filepath):
+    try:
+        with open(filepath, encoding = 'UTF-8', errors = 'ignore') as fd:
+            content = fd.read(REFERENCES_SIZE)
+    except OSError:
+        return ([], set())
+    return ([os.path.basename(include) for include in INCLUDE_RE.findall(content)], set(CALL_RE.findall(content)))
+
+def is_below(path, folders):
+    return any(path == folder or path.startswith(os.path.join(folder, '')) for folder in folders)
+
+class IndexScheduler:
+    # runs the index builds of every cache one at a time on one worker thread,
+    # most urgent first. A running build asks cancelled() between files, is
+    # throttled while the user types and reports its progress.
+    def __init__(self, cpu_limit = 1.0, typing_delay = 1.0, progress_interval = 0.5):
+        self.cpu_limit = cpu_limit
+        self.typing_delay = typing_delay
+        self.progress_interval = progress_interval
+        self.on_progress = None
+        self.condition = threading.Condition()
+        self.jobs = []
+        self.job_keys = {}
+        self.seq = 0
+        self.cancelled_folders = set()
+        self.open_files = set()
+        self.last_typing = 0
+        self.last_progress = 0
+        self.worker = None
+
+    def submit(self, key, priority, fun, *args):
+        # a job already waiting under the same key is not queued twice
+        try:
+            self.condition.acquire()
+            if key != None and key in self.job_keys:
+                return False
+            self.__push(key, priority, fun, args)
+            return True
+        finally:
+            self.condition.release()
+
+    def call(self, key, priority, timeout, fun, *args):
+        # like submit, then waits up to timeout seconds for the job (or the one
+        # already waiting under key) to finish, true when it did
+        if threading.current_thread() is self.worker:
+            fun(*args)
+            return True
+        try:
+            self.condition.acquire()
+            done = self.job_keys.get(key) if key != None else None
+            if done == None:
+                done = self.__push(key, priority, fun, args)
+        finally:
+            self.condition.release()
+        return done.wait(timeout)
+
+    def run_urgent(self):
+        # called by a running build between its slices
+        while True:
+            try:
+                self.condition.acquire()
+                if self.jobs == [] or self.jobs[0][0] != PRIORITY_FILE:
+                    return
+                job = heapq.heappop(self.jobs)
+                self.job_keys.pop(job[2], None)
+            finally:
+                self.condition.release()
+            self.__run_job(*job)
+
+    def __push(self, key, priority, fun, args):
+        done = threading.Event()
+        self.seq += 1
+        heapq.heappush(self.jobs, (priority, self.seq, key, fun, args, done))
+        if key != None:
+            self.job_keys[key] = done
+        self.__start_worker()
+        self.condition.notify()
+        return done
+
+    def cancel(self, folders):
+        # the running job stops indexing files below folders, queued jobs
+        # look at the open folders again when they start
+        try:
+            self.condition.acquire()
+            self.cancelled_folders.update(folders)
+            self.condition.notify()
+        finally:
+            self.condition.release()
+
+    def cancelled(self, path):
+        return self.cancelled_folders != set() and is_below(path, list(self.cancelled_folders))
+
+    def focus(self, filepath):
+        if filepath != None:
+            self.open_files.add(filepath)
+
+    def forget(self, filepath):
+        self.open_files.discard(filepath)
+
+    def typing(self):
+        self.last_typing = time.time()
+
+    def rank(self, paths):
+        # RANK_OPEN for the open files and the headers they include, followed
+        # by name through the headers found in paths, RANK_CALLED for the
+        # modules any of them calls
+        by_name = {}
+        for path in paths:
+            by_name.setdefault(os.path.basename(path), []).append(path)
+        visited = set(self.open_files)
+        pending = list(visited)
+        called = set()
+        while pending != []:
+            (includes, modules) = read_references(pending.pop())
+            called.update(modules)
+            for include in includes:
+                for header in by_name.get(include, []):
+                    if header not in visited:
+                        visited.add(header)
+                        pending.append(header)
+        ranks = {}
+        for path in paths:
+            if path in visited:
+                ranks[path] = RANK_OPEN
+            elif os.path.splitext(os.path.basename(path))[0] in called:
+                ranks[path] = RANK_CALLED
+            else:
+                ranks[path] = RANK_OTHER
+        return ranks
+
+    def throttle(self, busy):
+        # while the user types, idle so that indexing takes at most cpu_limit
+        # of the time, a cancel ends the pause
+        if self.cpu_limit >= 1 or time.time() - self.last_typing > self.typing_delay:
+            return
+        try:
+            self.condition.acquire()
+            if self.cancelled_folders == set():
+                self.condition.wait(busy * (1 - self.cpu_limit) / max(self.cpu_limit, 0.05))
+        finally:
+            self.condition.release()
+
+    def progress(self, text, done, total):
+        if self.on_progress == None or (done < total and time.time() - self.last_progress < self.progress_interval):
+            return
+        self.last_progress = time.time()
+        self.on_progress('{}: {}/{} files'.format(text, done, total) if done < total else '{}: {} files done'.format(text, total))
+
+    def __start_worker(self):
+        if self.worker == None:
+            self.worker = threading.Thread(target = self.__run, name = 'erl-autocompletion-index')
+            self.worker.daemon = True
+            self.worker.start()
+
+    def __run(self):
+        while True:
+            try:
+                self.condition.acquire()
+                while self.jobs == []:
+                    self.condition.wait()
+                job = heapq.heappop(self.jobs)
+                self.job_keys.pop(job[2], None)
+                # a cancel only applies to the job that was running
+                self.cancelled_folders = set()
+            finally:
+                self.condition.release()
+            self.__run_job(*job)
+
+    def __run_job(self, priority, seq, key, fun, args, done):
+        try:
+            fun(*args)
+        except Exception as e:
+            print('index job {} failed: {}'.format(key, e))
+        finally:
+            done.set()
+
+SCHEDULER = IndexScheduler()
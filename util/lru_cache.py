@@ -0,0 +1,35 @@
+import threading
+from collections import OrderedDict
+
+class LRUCache:
+    def __init__(self, max_size = 128):
+        self.max_size = max_size
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, default = None):
+        try:
+            self.lock.acquire(True)
+            if key not in self.data:
+                return default
+            self.data.move_to_end(key)
+            return self.data[key]
+        finally:
+            self.lock.release()
+
+    def put(self, key, value):
+        try:
+            self.lock.acquire(True)
+            self.data[key] = value
+            self.data.move_to_end(key)
+            while len(self.data) > self.max_size:
+                self.data.popitem(last = False)
+        finally:
+            self.lock.release()
+
+    def clear(self):
+        try:
+            self.lock.acquire(True)
+            self.data.clear()
+        finally:
+            self.lock.release()
@@ -0,0 +1,187 @@
+import bisect, heapq, threading, time, functools
+
+# upper bounds in milliseconds, one more bucket collects everything slower
+LATENCY_BUCKETS = [0.1, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000]
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, ms):
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, ms)] += 1
+        self.count += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+
+    def percentile(self, q):
+        # the upper bound of the bucket the q-th observation falls in
+        seen = 0
+        for (i, count) in enumerate(self.counts):
+            seen += count
+            if seen >= q * self.count:
+                return LATENCY_BUCKETS[i] if i < len(LATENCY_BUCKETS) else self.max
+        return self.max
+
+    def to_dict(self):
+        buckets = {}
+        for (i, count) in enumerate(self.counts):
+            if count > 0:
+                buckets['<={}'.format(LATENCY_BUCKETS[i]) if i < len(LATENCY_BUCKETS) else '>{}'.format(LATENCY_BUCKETS[-1])] = count
+        return {
+            'count': self.count,
+            'mean_ms': self.total / self.count if self.count else 0,
+            'max_ms': self.max,
+            'p50_ms': self.percentile(0.5),
+            'p99_ms': self.percentile(0.99),
+            'buckets': buckets
+        }
+
+class Metrics:
+    # counters, latency histograms, the slowest files to parse and the UI
+    # thread handlers that went over handler_budget seconds
+    def __init__(self, slow_files = 10, handler_budget = 0.05):
+        self.slow_files_size = slow_files
+        self.handler_budget = handler_budget
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        try:
+            self.lock.acquire(True)
+            self.started = time.time()
+            self.counters = {}
+            self.histograms = {}
+            self.slow_files = []
+            self.slow_handlers = {}
+            self.builds = []
+            self.degraded_files = {}
+        finally:
+            self.lock.release()
+
+    def count(self, name, n = 1):
+        try:
+            self.lock.acquire(True)
+            self.counters[name] = self.counters.get(name, 0) + n
+        finally:
+            self.lock.release()
+
+    def observe(self, name, seconds):
+        try:
+            self.lock.acquire(True)
+            histogram = self.histograms.get(name)
+            if histogram == None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.add(seconds * 1000)
+        finally:
+            self.lock.release()
+
+    def parsed(self, filepath, seconds, code_hash, index):
+        if code_hash == None:
+            self.count('files_failed')
+            return
+        self.count('files_parsed' if index != None else 'files_same_hash')
+        self.observe('parse_file', seconds)
+        try:
+            self.lock.acquire(True)
+            if len(self.slow_files) < self.slow_files_size:
+                heapq.heappush(self.slow_files, (seconds, filepath))
+            else:
+                heapq.heappushpop(self.slow_files, (seconds, filepath))
+        finally:
+            self.lock.release()
+
+    def degraded(self, filepath, reason):
+        # files that only got their exports indexed, the last reason per file
+        try:
+            self.lock.acquire(True)
+            self.degraded_files[filepath] = reason
+        finally:
+            self.lock.release()
+        self.count('files_degraded')
+
+    def build(self, data_type, files, seconds, lock_time, batches):
+        try:
+            self.lock.acquire(True)
+            self.builds = self.builds[-9:] + [{
+                'data_type': data_type,
+                'at': time.time(),
+                'files': files,
+                'seconds': seconds,
+                'lock_held_seconds': lock_time,
+                'batches': batches
+            }]
+        finally:
+            self.lock.release()
+
+    def timed(self, name):
+        def decorator(fun):
+            @functools.wraps(fun)
+            def wrapper(*args, **kwargs):
+                start_time = time.time()
+                try:
+                    return fun(*args, **kwargs)
+                finally:
+                    self.observe(name, time.time() - start_time)
+            return wrapper
+        return decorator
+
+    def handler(self, name):
+        # like timed, and warns when a handler blocks the UI thread too long,
+        # *_async handlers run on the worker thread and are only timed
+        def decorator(fun):
+            @functools.wraps(fun)
+            def wrapper(*args, **kwargs):
+                start_time = time.time()
+                try:
+                    return fun(*args, **kwargs)
+                finally:
+                    use_time = time.time() - start_time
+                    self.observe('handler.' + name, use_time)
+                    if use_time > self.handler_budget and not name.endswith('_async'):
+                        self.count('slow_handler.' + name)
+                        print('{} blocked the UI thread for {:.3f} second'.format(name, use_time))
+            return wrapper
+        return decorator
+
+    def snapshot(self):
+        try:
+            self.lock.acquire(True)
+            return {
+                'since': self.started,
+                'counters': dict(self.counters),
+                'latency': {name: histogram.to_dict() for (name, histogram) in self.histograms.items()},
+                'slowest_files': [{'path': path, 'seconds': seconds} for (seconds, path) in sorted(self.slow_files, reverse = True)],
+                'builds': list(self.builds),
+                'degraded_files': [{'path': path, 'reason': reason} for (path, reason) in sorted(self.degraded_files.items())],
+                'handler_budget_ms': self.handler_budget * 1000
+            }
+        finally:
+            self.lock.release()
+
+    def summary(self):
+        snapshot = self.snapshot()
+        lines = ['Erl-AutoCompletion metrics', '']
+        for build in snapshot['builds']:
+            lines.append('build {data_type}: {files} files in {seconds:.3f}s, lock held {lock_held_seconds:.3f}s in {batches} batches'.format(**build))
+        lines.append('')
+        for (name, value) in sorted(snapshot['counters'].items()):
+            lines.append('{:<40} {}'.format(name, value))
+        lines.append('')
+        lines.append('{:<40} {:>8} {:>10} {:>10} {:>10}'.format('latency', 'count', 'p50 ms', 'p99 ms', 'max ms'))
+        for (name, latency) in sorted(snapshot['latency'].items()):
+            lines.append('{:<40} {:>8} {:>10} {:>10} {:>10.2f}'.format(name, latency['count'], latency['p50_ms'], latency['p99_ms'], latency['max_ms']))
+        lines.append('')
+        lines.append('slowest files to parse')
+        for slow_file in snapshot['slowest_files']:
+            lines.append('{:>10.4f}s  {}'.format(slow_file['seconds'], slow_file['path']))
+        if snapshot['degraded_files'] != []:
+            lines.append('')
+            lines.append('exports only (size or parse time over the limit)')
+            for degraded_file in snapshot['degraded_files']:
+                lines.append('{:>10}  {}'.format(degraded_file['reason'], degraded_file['path']))
+        return '\n'.join(lines) + '\n'
+
+METRICS = Metrics()
@@ -0,0 +1,37 @@
+import sublime
+from . import scanner
+
+
+def build_outline(symbols):
+    # first definition wins, like the compiler reports it
+    functions = {}
+    for (fun_name, param_len, row_num, params) in symbols['functions']:
+        arities = functions.setdefault(fun_name, [])
+        if all(param_len != arity for (arity, row) in arities):
+            arities.append((param_len, row_num))
+    records = {}
+    for (record, row_num, fields, text) in symbols['records']:
+        records.setdefault(record, (row_num, text))
+    defines = {}
+    for (define, row_num, text) in symbols['defines']:
+        defines.setdefault(define, (row_num, text))
+    return {'functions': functions, 'records': records, 'defines': defines}
+
+
+class ViewOutline:
+    # functions, records and macros of an open buffer, rescanned only when
+    # the view's change_count moved since the last lookup
+    def __init__(self):
+        self.views = {}
+
+    def get(self, view):
+        change_count = view.change_count()
+        entry = self.views.get(view.id())
+        if entry == None or entry[0] != change_count:
+            code = view.substr(sublime.Region(0, view.size()))
+            entry = (change_count, build_outline(scanner.scan(code)))
+            self.views[view.id()] = entry
+        return entry[1]
+
+    def forget(self, view_id):
+        self.views.pop(view_id, None)
@@ -0,0 +1,69 @@
+import bisect, heapq, threading
+
+class PrefixIndex:
+    # sorted names with reference counts per owner (a file id), so a name only
+    # disappears when the last file that provides it is removed
+    def __init__(self):
+        self.names = []
+        self.counts = {}
+        self.owners = {}
+        self.usage = {}
+        self.lock = threading.Lock()
+
+    def set_owner(self, owner, names):
+        try:
+            self.lock.acquire(True)
+            for name in self.owners.pop(owner, ()):
+                self.__dec(name)
+            names = frozenset(names)
+            if names:
+                self.owners[owner] = names
+            for name in names:
+                self.__inc(name)
+        finally:
+            self.lock.release()
+
+    def remove_owner(self, owner):
+        self.set_owner(owner, ())
+
+    def clear(self):
+        try:
+            self.lock.acquire(True)
+            self.names = []
+            self.counts = {}
+            self.owners = {}
+        finally:
+            self.lock.release()
+
+    def touch(self, name):
+        if name in self.counts:
+            self.usage[name] = self.usage.get(name, 0) + 1
+
+    def rank_key(self, name, prefix):
+        return (name != prefix, -self.usage.get(name, 0), len(name), name)
+
+    def query(self, prefix, limit):
+        try:
+            self.lock.acquire(True)
+            start = bisect.bisect_left(self.names, prefix)
+            end = bisect.bisect_left(self.names, prefix + '\uffff', start)
+            candidates = self.names[start:end]
+        finally:
+            self.lock.release()
+        return heapq.nsmallest(limit, [(self.rank_key(name, prefix), name) for name in candidates])
+
+    def __inc(self, name):
+        count = self.counts.get(name, 0)
+        if count == 0:
+            bisect.insort(self.names, name)
+        self.counts[name] = count + 1
+
+    def __dec(self, name):
+        count = self.counts.get(name, 0) - 1
+        if count > 0:
+            self.counts[name] = count
+            return
+        self.counts.pop(name, None)
+        index = bisect.bisect_left(self.names, name)
+        if index < len(self.names) and self.names[index] == name:
+            del self.names[index]
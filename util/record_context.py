@@ -0,0 +1,152 @@
+import re, sublime
+from .scanner import unquote_atom
+
+CHUNK_SIZE = 4096
+
+# where a span starts: in code, or inside a string or quoted atom that an
+# earlier span left open
+(IN_CODE, IN_STRING, IN_ATOM) = range(3)
+
+# strings, quoted atoms, char literals and comments are consumed whole so the
+# braces inside them are not counted, strings and atoms may span lines and
+# one still open at the end of the text is left open for the next span
+CONTEXT_TOKEN_RE = re.compile(r'''
+    %[^\n]*
+  | "(?:[^"\\]|\\[\s\S])*"
+  | \$\\?[\s\S]
+  | \#\s*(?P<record>[a-z][\w@]*|'(?:[^'\\]|\\[\s\S])*')\s*\{
+  | '(?:[^'\\]|\\[\s\S])*'
+  | (?P<open>\{)
+  | (?P<close>\})
+  | (?P<string>")
+  | (?P<atom>')
+''', re.VERBOSE)
+
+# the rest of a string or quoted atom a span starts in
+REST_RE = {IN_STRING: re.compile(r'(?:[^"\\]|\\[\s\S])*"'), IN_ATOM: re.compile(r"(?:[^'\\]|\\[\s\S])*'")}
+
+RECORD_ACCESS_RE = re.compile(r'\#\s*([a-z][\w@]*|\'(?:[^\'\\]|\\.)*\')\.$')
+WORD_TAIL_RE = re.compile(r'(\W?)\w*$')
+
+
+def summarize(text, state = IN_CODE):
+    # (closing braces without an opener, openers left open, state at the end)
+    # of a piece of code, an opener is the record name for '#name{' and None
+    # for a tuple or map
+    closes = 0
+    opens = []
+    start = 0
+    if state != IN_CODE:
+        m = REST_RE[state].match(text)
+        if m == None:
+            return (0, [], state)
+        start = m.end()
+    for m in CONTEXT_TOKEN_RE.finditer(text, start):
+        kind = m.lastgroup
+        if kind == 'close':
+            if opens != []:
+                opens.pop()
+            else:
+                closes += 1
+        elif kind == 'open':
+            opens.append(None)
+        elif kind == 'record':
+            opens.append(unquote_atom(m.group('record')))
+        elif kind == 'string':
+            return (closes, opens, IN_STRING)
+        elif kind == 'atom':
+            return (closes, opens, IN_ATOM)
+    return (closes, opens, IN_CODE)
+
+
+def chunk_head(raw, index):
+    # the end of the line the previous chunk stops in, chunks are lexed from
+    # line starts so a comment is never cut in two
+    if index == 0:
+        return ''
+    return raw[:raw.find('\n') + 1]
+
+
+class RecordContext:
+    # the buffer is read in CHUNK_SIZE chunks, the brace summary of each chunk
+    # is kept per view and only recomputed when its text or the state it
+    # starts in changed
+    def __init__(self):
+        self.views = {}
+
+    def find(self, view, pos, max_lookback = 32768):
+        cache = self.views.get(view.id())
+        change_count = view.change_count()
+        if cache == None or cache['change_count'] != change_count:
+            spans = cache['spans'] if cache != None else {}
+            cache = {'change_count': change_count, 'raws': {}, 'spans': spans, 'results': {}}
+            self.views[view.id()] = cache
+
+        result = cache['results'].get((pos, max_lookback))
+        if result == None:
+            result = self.__find(view, cache, pos, max_lookback)
+            cache['results'][(pos, max_lookback)] = result
+        return result
+
+    def forget(self, view_id):
+        self.views.pop(view_id, None)
+
+    def __find(self, view, cache, pos, max_lookback):
+        tail = view.substr(sublime.Region(max(0, pos - 256), pos))
+        if tail.endswith('.'):
+            m = RECORD_ACCESS_RE.search(tail)
+            if m == None:
+                return ([], False)
+            return (list(unquote_atom(m.group(1))), False)
+        if WORD_TAIL_RE.search(tail).group(1) == '=':
+            return ([], False)
+
+        # the spans of the chunks within max_lookback are lexed forwards, each
+        # in the state the span before it ended in, so a string spanning lines
+        # is known as one. The first span is taken to start in code
+        last = pos // CHUNK_SIZE
+        first = max(0, pos - max_lookback) // CHUNK_SIZE
+        cursor_raw = view.substr(sublime.Region(last * CHUNK_SIZE, pos))
+        head = chunk_head(cursor_raw if first == last else self.__read_chunk(view, cache, first), first)
+        spans = {}
+        summaries = []
+        state = IN_CODE
+        for index in range(first, last + 1):
+            if index == last:
+                span = cursor_raw[len(head):]
+            else:
+                if index + 1 == last:
+                    # the line the cursor is in may start in this chunk
+                    next_head = cursor_raw[:cursor_raw.find('\n') + 1] if '\n' in cursor_raw else cursor_raw
+                else:
+                    next_head = chunk_head(self.__read_chunk(view, cache, index + 1), index + 1)
+                span = self.__read_chunk(view, cache, index)[len(head):] + next_head
+                head = next_head
+            (old_span, old_state, summary) = cache['spans'].get(index, (None, None, None))
+            if old_span != span or old_state != state:
+                summary = summarize(span, state)
+            if index != last:
+                spans[index] = (span, state, summary)
+            summaries.append(summary)
+            state = summary[2]
+        cache['spans'] = spans
+
+        need = 0
+        for (closes, opens, state) in reversed(summaries):
+            # the innermost brace that is still open, skipping tuples and maps
+            if need < len(opens):
+                for name in reversed(opens[:len(opens) - need]):
+                    if name != None:
+                        return (list(name), True)
+                need = 0
+            else:
+                need -= len(opens)
+            need += closes
+        return ([], False)
+
+    def __read_chunk(self, view, cache, index):
+        raw = cache['raws'].get(index)
+        if raw == None:
+            raw = view.substr(sublime.Region(index * CHUNK_SIZE, (index + 1) * CHUNK_SIZE))
+            cache['raws'][index] = raw
+        return raw
@@ -0,0 +1,408 @@
+import re, time, hashlib
+
+# comments, strings, quoted atoms and char literals are consumed whole so that
+# '%' or '.' inside them never split a form; everything else is skipped in C
+FORM_RE = re.compile(r'''
+    (?P<comment>%[^\n]*)
+  | \$\\?[\s\S]
+  | "(?:[^"\\]|\\[\s\S])*"
+  | '(?:[^'\\]|\\[\s\S])*'
+  | (?P<end>\.(?=\s|%|\Z))
+  | (?P<open>["'])
+''', re.VERBOSE)
+
+HEAD_TOKEN_RE = re.compile(r'''"(?:[^"\\]|\\[\s\S])*"|'(?:[^'\\]|\\[\s\S])*'|\$\\?[\s\S]|<<|>>|->|[()\[\]{},=]''')
+
+ATTRIBUTE_RE = re.compile(r'-\s*(\w+)\s*\(?')
+EXPORT_ATTRIBUTE_RE = re.compile(r'^-[ \t]*(?:export|compile)\b', re.MULTILINE)
+FUN_NAME_RE = re.compile(r'([a-z][\w@]*|\'(?:[^\'\\]|\\.)*\')\s*\(')
+SIMPLE_HEAD_RE = re.compile(r'([a-z][\w@]*|\'(?:[^\'\\]|\\.)*\')\s*\(([\w@\s,]*)\)\s*(?:->|when\b)')
+GUARD_RE = re.compile(r'\s*(?:->|when\b)')
+EXPORT_FUN_RE = re.compile(r'([a-z][\w@]*|\'(?:[^\'\\]|\\.)*\')\s*/\s*(\d+)')
+EXPORT_ALL_RE = re.compile(r'\bexport_all\b')
+STRING_ARG_RE = re.compile(r'"((?:[^"\\]|\\.)*)"')
+DEFINE_NAME_RE = re.compile(r'\(\s*(\w+)')
+RECORD_NAME_RE = re.compile(r'\(\s*([a-z][\w@]*|\'(?:[^\'\\]|\\.)*\')\s*,')
+SIMPLE_PARAM_RE = re.compile(r'^[\w@]+$')
+VARIABLE_RE = re.compile(r'^[A-Z_][\w@]*$')
+
+OPEN_BRACKETS = {'(': ')', '[': ']', '{': '}', '<<': '>>'}
+CLOSE_BRACKETS = {')', ']', '}', '>>'}
+
+# the references in a function body: calls, record and macro uses. Strings,
+# chars and based integers are consumed so nothing inside them is taken for
+# one, Var:name( is consumed as a call of an unknown module. The lookahead
+# lets the search skip the characters no alternative starts with.
+ATOM = r"(?:[a-z][\w@]*|'(?:[^'\\]|\\[\s\S])*')"
+REFERENCE_RE = re.compile(r'''(?=["$\d?\#A-Za-z_'])(?:
+    "(?:[^"\\]|\\[\s\S])*"
+  | \$\\?[\s\S]
+  | \d[\d_]*\#\w+
+  | \bfun\s+(?:(?P<ref_module>{0})\s*:\s*)?(?P<ref_fun>{0})\s*/\s*(?P<ref_arity>\d+)
+  | \?\??\s*(?P<macro>\w+)(?:\s*:\s*(?P<macro_fun>{0})\s*\()?
+  | \#\s*(?P<record>{0})
+  | [A-Z_][\w@]*\s*:\s*{0}\s*\(
+  | (?<![\w@])(?:(?P<module>{0})\s*:\s*)?(?P<call>{0})\s*\(
+  | '(?:[^'\\]|\\[\s\S])*')
+'''.format(ATOM), re.VERBOSE)
+
+# arguments without brackets, strings or chars, counted without a walk
+SIMPLE_ARGS_RE = re.compile(r'([^()\[\]{}<>"\'$]*)\)')
+ARGS_TOKEN_RE = re.compile(r'''"(?:[^"\\]|\\[\s\S])*"|'(?:[^'\\]|\\[\s\S])*'|\$\\?[\s\S]|<<|>>|[()\[\]{},]|\b(?:begin|case|if|maybe|receive|try|end)\b|\bfun(?=\s*\()''')
+
+RESERVED_WORDS = {'after', 'and', 'andalso', 'band', 'begin', 'bnot', 'bor', 'bsl', 'bsr', 'bxor', 'case', 'catch',
+    'cond', 'div', 'else', 'end', 'fun', 'if', 'let', 'maybe', 'not', 'of', 'or', 'orelse', 'receive', 'rem', 'try', 'when', 'xor'}
+OPEN_TOKENS = {'(', '[', '{', '<<', 'begin', 'case', 'if', 'maybe', 'receive', 'try', 'fun'}
+CLOSE_TOKENS = {')', ']', '}', '>>', 'end'}
+
+
+def scan(content, skip_hash = None, references = False, deadline = None):
+    # returns None when the hash of the comment-stripped source equals
+    # skip_hash, the references of function bodies are only scanned on request.
+    # Past deadline the rest is scanned as by scan_stream with exports_only
+    code_hash = hashlib.md5()
+    forms = []
+    pieces = []
+    form_start = 0
+    last = 0
+    for m in FORM_RE.finditer(content):
+        kind = m.lastgroup
+        if kind == 'comment':
+            pieces.append(content[last:m.start()])
+            last = m.end()
+        elif kind == 'end':
+            pieces.append(content[last:m.end()])
+            last = m.end()
+            forms.append((form_start, ''.join(pieces)))
+            for piece in pieces:
+                code_hash.update(piece.encode('UTF-8'))
+            pieces = []
+            form_start = last
+    pieces.append(content[last:])
+    for piece in pieces:
+        code_hash.update(piece.encode('UTF-8'))
+
+    code_hash = code_hash.hexdigest()
+    if code_hash == skip_hash:
+        return None
+
+    result = new_result(code_hash)
+    result['degraded'] = None
+    heads = {}
+    row = 1
+    pos = 0
+    for (i, (start, form)) in enumerate(forms):
+        row += content.count('\n', pos, start)
+        pos = start
+        if result['degraded'] is None and deadline is not None and i % 64 == 63 and time.time() > deadline:
+            result['degraded'] = 'budget'
+        if result['degraded'] is not None:
+            scan_form_head(form, row, result, heads)
+        else:
+            scan_form(form, row, result, references)
+    if result['degraded'] is not None:
+        add_export_heads(result, heads)
+    return result
+
+
+def scan_stream(chunks, skip_hash = None, deadline = None, exports_only = False, references = False):
+    # scan for a source read in chunks, each form is scanned as soon as it is
+    # complete so only the unfinished one is held. With exports_only, or once
+    # time.time() passes deadline, function heads are no longer parsed and the
+    # exported functions get their row and numbered parameters only; result
+    # ['degraded'] then says why. The hash is the one scan gives.
+    code_hash = hashlib.md5()
+    result = new_result(None)
+    result['degraded'] = 'size' if exports_only else None
+    heads = {}
+    row = 1
+    pending = ''
+    forms = 0
+    for chunk in chunks_with_end(chunks):
+        final = chunk is None
+        text = pending + (chunk or '')
+        pieces = []
+        last = 0
+        consumed = 0
+        for m in FORM_RE.finditer(text):
+            kind = m.lastgroup
+            if kind == 'comment':
+                pieces.append(text[last:m.start()])
+                last = m.end()
+            elif kind == 'end':
+                # may be the dot of a float split by the chunk
+                if not final and m.end() == len(text):
+                    break
+                pieces.append(text[last:m.end()])
+                last = consumed = m.end()
+                form = ''.join(pieces)
+                pieces = []
+                code_hash.update(form.encode('UTF-8'))
+                forms += 1
+                if not exports_only and deadline is not None and forms % 64 == 0 and time.time() > deadline:
+                    exports_only = True
+                    result['degraded'] = 'budget'
+                if exports_only:
+                    scan_form_head(form, row, result, heads)
+                else:
+                    scan_form(form, row, result, references)
+                row += form.count('\n')
+            elif kind == 'open' and not final:
+                # a string or quoted atom that ends in the next chunk
+                break
+        if final:
+            pieces.append(text[last:])
+            code_hash.update(''.join(pieces).encode('UTF-8'))
+        pending = text[consumed:]
+
+    result['hash'] = code_hash.hexdigest()
+    if result['hash'] == skip_hash:
+        return None
+    if result['degraded'] is not None:
+        add_export_heads(result, heads)
+    return result
+
+
+def add_export_heads(result, heads):
+    # the exported functions a degraded scan did not parse, with numbered
+    # parameters at the row of their first clause
+    scanned = {(name, arity) for (name, arity, row_num, params) in result['functions']}
+    for (name, arity) in sorted(result['exports']):
+        if (name, arity) not in scanned and name in heads:
+            result['functions'].append((name, arity, heads[name], ['Arg{}'.format(i + 1) for i in range(arity)]))
+
+
+def scan_exports(content):
+    # the export and compile attributes only, found by a search for their
+    # first line instead of splitting the whole file into forms
+    result = new_result(None)
+    for m in EXPORT_ATTRIBUTE_RE.finditer(content):
+        pieces = []
+        last = m.start()
+        end = len(content)
+        for token in FORM_RE.finditer(content, m.end()):
+            if token.lastgroup == 'comment':
+                pieces.append(content[last:token.start()])
+                last = token.end()
+            elif token.lastgroup == 'end':
+                end = token.end()
+                break
+        pieces.append(content[last:end])
+        scan_attribute(''.join(pieces), 0, result)
+    return result
+
+
+def chunks_with_end(chunks):
+    for chunk in chunks:
+        yield chunk
+    yield None
+
+
+def new_result(code_hash):
+    return {
+        'hash': code_hash,
+        'module': None,
+        'export_all': False,
+        'exports': set(),
+        'functions': [],
+        'includes': [],
+        'defines': [],
+        'records': [],
+        'references': []
+    }
+
+
+def scan_form(form, row, result, references = False):
+    text = form.lstrip()
+    form_row = row + form.count('\n', 0, len(form) - len(text))
+    if text.startswith('-'):
+        scan_attribute(text, form_row, result)
+    else:
+        function = scan_function(text, form_row)
+        if function is not None:
+            result['functions'].append(function)
+            if references:
+                scan_references(text, form_row, result['references'], function[0])
+
+
+def scan_references(text, row, references, function):
+    # appends ('call', module, name, arity, row), ('record', None, name, -1,
+    # row) and ('macro', None, name, -1, row); module is None for a local call
+    # and '?MODULE' for ?MODULE:name(...), arity is -1 when the arguments do
+    # not close. Clause heads, function at the start of a line, are skipped.
+    pos = 0
+    for m in REFERENCE_RE.finditer(text):
+        kind = m.lastgroup
+        if kind == None:
+            continue
+        row += text.count('\n', pos, m.start())
+        pos = m.start()
+        if kind == 'call':
+            name = unquote_atom(m.group('call'))
+            module = m.group('module')
+            if name in RESERVED_WORDS or (module is None and name == function and (pos == 0 or text[pos - 1] == '\n')):
+                continue
+            references.append(('call', module and unquote_atom(module), name, call_arity(text, m.end()), row))
+        elif kind == 'record':
+            references.append(('record', None, unquote_atom(m.group('record')), -1, row))
+        elif kind == 'macro' or kind == 'macro_fun':
+            references.append(('macro', None, m.group('macro'), -1, row))
+            if kind == 'macro_fun' and m.group('macro') == 'MODULE':
+                references.append(('call', '?MODULE', unquote_atom(m.group('macro_fun')), call_arity(text, m.end()), row))
+        elif kind == 'ref_arity':
+            module = m.group('ref_module')
+            references.append(('call', module and unquote_atom(module), unquote_atom(m.group('ref_fun')), int(m.group('ref_arity')), row))
+
+
+def call_arity(text, start):
+    # start is just after the opening bracket
+    m = SIMPLE_ARGS_RE.match(text, start)
+    if m is not None:
+        args = m.group(1)
+        return 0 if args.strip() == '' else args.count(',') + 1
+    depth = 0
+    commas = 0
+    for m in ARGS_TOKEN_RE.finditer(text, start):
+        token = m.group()
+        if token in OPEN_TOKENS:
+            depth += 1
+        elif token in CLOSE_TOKENS:
+            if depth == 0:
+                return 0 if text[start:m.start()].strip() == '' else commas + 1
+            depth -= 1
+        elif token == ',' and depth == 0:
+            commas += 1
+    return -1
+
+
+def scan_form_head(form, row, result, heads):
+    # attributes as usual, functions only by name and first row
+    text = form.lstrip()
+    form_row = row + form.count('\n', 0, len(form) - len(text))
+    if text.startswith('-'):
+        scan_attribute(text, form_row, result)
+    else:
+        m = FUN_NAME_RE.match(text)
+        if m is not None:
+            heads.setdefault(unquote_atom(m.group(1)), form_row)
+
+
+def scan_attribute(text, row, result):
+    m = ATTRIBUTE_RE.match(text)
+    if m is None:
+        return
+    name = m.group(1)
+    if name == 'module':
+        m = re.match(r'\s*(\w+)', text[m.end():])
+        result['module'] = m and m.group(1)
+    elif name == 'export':
+        for (fun_name, arity) in EXPORT_FUN_RE.findall(text):
+            result['exports'].add((unquote_atom(fun_name), int(arity)))
+    elif name == 'compile':
+        if EXPORT_ALL_RE.search(text):
+            result['export_all'] = True
+    elif name == 'include' or name == 'include_lib':
+        m = STRING_ARG_RE.search(text)
+        if m is not None:
+            result['includes'].append((name, m.group(1), row))
+    elif name == 'define':
+        m = DEFINE_NAME_RE.search(text)
+        if m is not None:
+            result['defines'].append((m.group(1), row, text.rstrip()))
+    elif name == 'record':
+        m = RECORD_NAME_RE.search(text)
+        if m is not None:
+            body_start = text.find('{', m.end())
+            body_end = text.rfind('}')
+            if body_start != -1 and body_end > body_start:
+                fields = [scan_record_field(field) for field in split_top_level(text[body_start + 1:body_end])]
+                fields = [field for field in fields if field is not None]
+            else:
+                fields = []
+            result['records'].append((unquote_atom(m.group(1)), row, fields, text.rstrip()))
+
+
+def scan_record_field(field):
+    field = field.split('::', 1)[0]
+    if '=' in field:
+        (name, default_val) = field.split('=', 1)
+    else:
+        (name, default_val) = (field, '')
+    name = name.strip()
+    if name == '':
+        return None
+    return (unquote_atom(name), ' '.join(default_val.split()))
+
+
+def scan_function(text, row):
+    m = SIMPLE_HEAD_RE.match(text)
+    if m is not None:
+        args = m.group(2).split(',')
+        params = [arg.strip() for arg in args] if len(args) > 1 or args[0].strip() != '' else []
+        return (unquote_atom(m.group(1)), len(params), row, params)
+
+    m = FUN_NAME_RE.match(text)
+    if m is None:
+        return None
+    params = []
+    sides = []
+    depth = 0
+    last = m.end()
+    for token_match in HEAD_TOKEN_RE.finditer(text, last):
+        token = token_match.group()
+        if token in OPEN_BRACKETS:
+            depth += 1
+        elif token in CLOSE_BRACKETS:
+            if depth > 0:
+                depth -= 1
+                continue
+            if token != ')':
+                return None
+            sides.append(text[last:token_match.start()])
+            if GUARD_RE.match(text, token_match.end()) is None:
+                return None
+            if len(params) > 0 or len(sides) > 1 or sides[0].strip() != '':
+                params.append(param_name(sides))
+            return (unquote_atom(m.group(1)), len(params), row, params)
+        elif depth == 0 and (token == ',' or token == '='):
+            sides.append(text[last:token_match.start()])
+            last = token_match.end()
+            if token == ',':
+                params.append(param_name(sides))
+                sides = []
+    return None
+
+
+def split_top_level(text):
+    parts = []
+    depth = 0
+    last = 0
+    for m in HEAD_TOKEN_RE.finditer(text):
+        token = m.group()
+        if token in OPEN_BRACKETS:
+            depth += 1
+        elif token in CLOSE_BRACKETS:
+            depth -= 1
+        elif token == ',' and depth == 0:
+            parts.append(text[last:m.start()])
+            last = m.end()
+    last_part = text[last:]
+    if parts != [] or last_part.strip() != '':
+        parts.append(last_part)
+    return parts
+
+
+def param_name(sides):
+    sides = [side.strip() for side in sides]
+    for side in sides:
+        if VARIABLE_RE.match(side):
+            return side
+    if len(sides) == 1 and SIMPLE_PARAM_RE.match(sides[0]):
+        return sides[0]
+    return 'Param'
+
+
+def unquote_atom(name):
+    if len(name) > 1 and name[0] == "'" and name[-1] == "'":
+        return name[1:-1]
+    return name
@@ -1,4 +1,4 @@
-import sublime, re, os
+import sublime, re, os, json, shutil, subprocess
 
 def get_plugin_settings():
     setting_name = 'erl_autocompletion.sublime-settings'
@@ -8,36 +8,57 @@ def get_plugin_settings():
 
 def get_settings_param(param_name, default=None):
     plugin_settings = get_plugin_settings()
-    project_settings = sublime.active_window().active_view().settings()
+    window = sublime.active_window()
+    view = window and window.active_view()
+    if view is None:
+        return plugin_settings.get(param_name, default)
+    project_settings = view.settings()
     return project_settings.get(
         param_name,
         plugin_settings.get(param_name, default)
     )
 
-def get_erl_lib_dir():
-    os.chdir(os.path.dirname(os.path.realpath(__file__)))
+# lib dir, release and erts version of the installed OTP, asking escript only
+# when the escript binary changed since the answer was cached
+def get_erl_otp_info(cache_dir):
     escript = get_settings_param('escript', 'escript')
-    lib_dir = os.popen('{0} get_erl_libs.erl lib_dir'.format(escript)).read()
-    return lib_dir
+    escript_path = shutil.which(escript) or escript
+    try:
+        mtime = os.stat(escript_path).st_mtime
+    except OSError:
+        print('escript {} not found, OTP modules are not indexed'.format(escript))
+        return None
+
+    info_path = os.path.join(cache_dir, 'otp_info.json')
+    try:
+        with open(info_path, encoding = 'UTF-8') as fd:
+            info = json.load(fd)
+        if info['escript'] == escript_path and info['mtime'] == mtime:
+            return info
+    except (OSError, ValueError, KeyError):
+        pass
+
+    script = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'get_erl_libs.erl')
+    try:
+        output = subprocess.check_output([escript_path, script, 'otp_info']).decode('UTF-8')
+        (lib_dir, otp_release, erts_version) = output.split('\n')[:3]
+    except (OSError, ValueError, subprocess.CalledProcessError) as e:
+        print('run {} failed, OTP modules are not indexed: {}'.format(escript_path, e))
+        return None
+
+    info = {'escript': escript_path, 'mtime': mtime, 'lib_dir': lib_dir, 'otp_release': otp_release, 'erts_version': erts_version}
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    with open(info_path, 'w', encoding = 'UTF-8') as fd:
+        json.dump(info, fd)
+    return info
 
 GLOBAL_SET = {
     'compiled_re' : {
-        'comment' : re.compile(r'%.*\n'),
-        'export' : re.compile(r'^\s*-\s*export\s*\(\s*\[\s*([^\]]*)\s*\]\s*\)\s*.', re.DOTALL + re.MULTILINE),
-        'export_all' : re.compile(r'^\s*-\s*compile\s*\(\s*export_all\s*\)\s*.', re.DOTALL + re.MULTILINE),
-        'funname' : re.compile(r'[a-zA-Z]+\w*\s*\/\s*[0-9]+'),
-        'funline' : re.compile(r'\s*(\w+)\s*\(([^)]*)\).*\-\>'),
-        'includeline' : re.compile(r'^\s*-\s*include\s*\(\s*"(\w+.\w+)"\s*\)\s*\.'),
-        'defineline' : re.compile(r'^\s*-\s*define\s*\(\s*(\w+)\({0}.*?\,\s*.*?\s*\)\s*\.'),
-        'record_re' : re.compile(r'\s*-\s*record\s*\(\s*(\w+)\s*,\s*\{([^-]*)\}\s*\)\s*\.', re.DOTALL + re.MULTILINE),
-        'record_field_re' : re.compile(r'\s*(\w+)\s*=?\s*([#{}\[\].\w\d"]*)\s*,?\s*', re.DOTALL + re.MULTILINE),
-        'special_param': re.compile(r'(?:\{.*\})|(?:<<.*>>)|(?:\[.*\])'),
-        '=' : re.compile(r'\s*=\s*\w+'),
         'take_mf' : re.compile(r'(\w+)\s*:\s*(\w+)\s*\('),
         'take_fun' : re.compile(r'(\w+)\s*[\(|/]'),
         'take_record' : re.compile(r'\#\s*(\w+)\s*[\{|.]'),
-        'take_define' : re.compile(r'\?\s*(\w+)'),
-        'take_include' : re.compile(r'-include\("([^\)]*)"\)')
+        'take_define' : re.compile(r'\?\s*(\w+)')
     },
     'package_name' : 'Erl-AutoCompletion',
     '-key' : [